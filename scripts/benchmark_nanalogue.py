@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for nanalogue subcommands.
+
+Simulates BAM files of increasing read counts from one of the configs in
+test_data.py, then times each benchmarked subcommand on each of them, both
+without a filter and with each of the shared filters from the recipes page.
+Reads per second and peak RSS of every combination are written to a JSON
+file that can be compared with one from another nanalogue release.
+
+Each subcommand is also timed on one --region query of every width in the
+fixture's region table, which nanalogue answers from the BAM index. These
+rows report latency rather than throughput, to set against the time for
+the whole file; `--fixture test_input_large` has contigs long enough for
+every width.
+
+Usage:
+    python benchmark_nanalogue.py [--sizes 30,1000,100000] [--repeat N]
+                                  [--fixture STEM] [--output PATH]
+                                  [--compare BASELINE] [--tolerance FRACTION]
+
+Simulated BAMs are kept in the fixture cache, so only the first run at a
+given size pays for the simulation. Each combination runs --repeat times;
+the median wall time and the largest peak RSS are reported.
+
+With --compare, the new results are matched against a baseline written by
+an earlier run. Any combination whose throughput dropped, or whose peak RSS
+grew, by more than --tolerance is reported and the script exits with
+status 1.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from block_cache import tool_version
+from python_runner import wait_with_timeout
+from test_data import (
+    FIXTURE_CACHE_DIR,
+    FIXTURES,
+    read_region_table,
+    scaled_config,
+    simulate_cached,
+)
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+BENCHMARK_DIR = REPO_ROOT / ".cache" / "benchmarks"
+DEFAULT_SIZES = [30, 1000, 100000]
+COMMAND_TIMEOUT_SECONDS = 600
+
+# Subcommands and the arguments each needs, as used in the docs
+SUBCOMMANDS = {
+    'read-stats': [],
+    'window-dens': ['--win', '10', '--step', '5'],
+    'window-grad': ['--win', '10', '--step', '5'],
+    'read-table-show-mods': ['--tag', 'm'],
+    'read-info': [],
+    'find-modified-reads': ['--win', '10', '--step', '5', '--tag', 'm', '--high', '0.8'],
+}
+# Nested subcommand benchmarked for subcommands that need one; its options
+# and the filters go after it
+NESTED_SUBCOMMANDS = {
+    'find-modified-reads': ['any-dens-above'],
+}
+
+# Shared filters, with the values used on the recipes page
+FILTERS = {
+    'none': [],
+    'mapq-filter': ['--mapq-filter', '20'],
+    'min-align-len': ['--min-align-len', '500'],
+    'subsample': ['-s', '0.1'],
+    'read-filter': ['--read-filter', 'primary_forward,primary_reverse'],
+}
+
+
+def run_once(command: list[str], timeout: float) -> tuple[int, float, int]:
+    """Run a command with its output discarded.
+
+    Returns (returncode, wall seconds, peak RSS in KiB).
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True
+    )
+    returncode, timed_out, usage = wait_with_timeout(process.pid, timeout)
+    # Already reaped by wait_with_timeout
+    process.returncode = returncode
+    wall = time.monotonic() - start
+    if timed_out:
+        returncode = -1
+    # ru_maxrss is in KiB on Linux
+    return returncode, wall, usage.ru_maxrss
+
+
+def benchmark_command(subcommand: str, filter_args: list[str], bam_path: Path) -> list[str]:
+    """The nanalogue command line that benchmarks subcommand with filter_args."""
+    return ['nanalogue', subcommand, *NESTED_SUBCOMMANDS.get(subcommand, []),
+            *SUBCOMMANDS[subcommand], *filter_args, str(bam_path)]
+
+
+def benchmark(bam_path: Path, reads: int, subcommand: str, filter_name: str,
+              repeat: int, timeout: float, region: str | None = None) -> dict:
+    """Time one subcommand and filter combination on one BAM.
+
+    With a region, the subcommand is limited to it instead of using one of
+    FILTERS, and filter_name only labels the result.
+    """
+    filter_args = FILTERS[filter_name] if region is None else ['--region', region]
+    command = benchmark_command(subcommand, filter_args, bam_path)
+    walls = []
+    peak_rss_kib = 0
+    returncode = 0
+    for _ in range(repeat):
+        returncode, wall, rss_kib = run_once(command, timeout)
+        if returncode != 0:
+            break
+        walls.append(wall)
+        peak_rss_kib = max(peak_rss_kib, rss_kib)
+
+    result = {
+        'subcommand': subcommand,
+        'filter': filter_name,
+        'reads': reads,
+        'exit_status': returncode,
+    }
+    if region is not None:
+        result['region'] = region
+    if returncode != 0:
+        return result
+
+    wall = statistics.median(walls)
+    result.update({
+        'wall_seconds': wall,
+        # A region query reads only part of the file, so only its latency counts
+        'reads_per_second': reads / wall if wall > 0 and region is None else None,
+        'peak_rss_mb': peak_rss_kib / 1024,
+    })
+    return result
+
+
+def result_key(result: dict) -> tuple[str, str, int]:
+    return result['subcommand'], result['filter'], result['reads']
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """Describe every combination that regressed relative to the baseline."""
+    old = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for new in results:
+        before = old.get(result_key(new))
+        if before is None or before['exit_status'] != 0:
+            continue
+        name = f"{new['subcommand']} [{new['filter']}] at {new['reads']} reads"
+        if new['exit_status'] != 0:
+            regressions.append(f"{name}: now fails with exit status {new['exit_status']}")
+            continue
+
+        old_rate = before.get('reads_per_second')
+        new_rate = new.get('reads_per_second')
+        if old_rate and new_rate and new_rate < old_rate * (1 - tolerance):
+            regressions.append(f"{name}: {new_rate:,.0f} reads/s (was {old_rate:,.0f})")
+        if 'region' in new and new['wall_seconds'] > before['wall_seconds'] * (1 + tolerance):
+            regressions.append(f"{name}: latency {new['wall_seconds']:.3f}s "
+                               f"(was {before['wall_seconds']:.3f}s)")
+        if new['peak_rss_mb'] > before['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {new['peak_rss_mb']:.1f} MB "
+                               f"(was {before['peak_rss_mb']:.1f} MB)")
+    return regressions
+
+
+def region_queries(entry: Path) -> dict[str, str]:
+    """Pick one region of each width from a fixture's region table.
+
+    Returns a dict mapping a result label such as 'region-500' to the region.
+    """
+    queries = {}
+    for row in read_region_table(entry / "sim.regions.tsv"):
+        queries.setdefault(f"region-{row['width']}", row['region'])
+    return queries
+
+
+def print_table(results: list[dict]) -> None:
+    """Print the results as a table."""
+    print(f"{'subcommand':<22} {'filter':<14} {'reads':>8} {'wall':>9} "
+          f"{'reads/s':>12} {'peak RSS':>10}")
+    for r in results:
+        if r['exit_status'] != 0:
+            print(f"{r['subcommand']:<22} {r['filter']:<14} {r['reads']:>8}   "
+                  f"failed with exit status {r['exit_status']}")
+            continue
+        rate = f"{r['reads_per_second']:,.0f}" if r['reads_per_second'] else '-'
+        print(f"{r['subcommand']:<22} {r['filter']:<14} {r['reads']:>8} "
+              f"{r['wall_seconds']:8.3f}s {rate:>12} {r['peak_rss_mb']:8.1f}MB")
+
+
+def parse_sizes(value: str) -> list[int]:
+    """Parse a comma-separated list of read counts."""
+    try:
+        sizes = [int(size) for size in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid read counts: {value!r}")
+    if any(size < 1 for size in sizes):
+        raise argparse.ArgumentTypeError("read counts must be positive")
+    return sizes
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description='Benchmark nanalogue subcommands and filters across BAM sizes'
+    )
+    parser.add_argument('--sizes', type=parse_sizes, default=DEFAULT_SIZES,
+                        metavar='N,N,...',
+                        help='Read counts of the simulated BAMs (default: 30,1000,100000)')
+    parser.add_argument('--repeat', type=int, default=3, metavar='N',
+                        help='Runs per combination; the median wall time is used (default: 3)')
+    parser.add_argument('--fixture', default='test_input',
+                        choices=[stem for stem, _ in FIXTURES],
+                        help='Simulation config from test_data.py to scale (default: test_input)')
+    parser.add_argument('--output', type=Path, metavar='PATH',
+                        help='Where to write the results (default: '
+                             '.cache/benchmarks/nanalogue-<version>.json)')
+    parser.add_argument('--compare', type=Path, metavar='BASELINE',
+                        help='Compare with results written by an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2, metavar='FRACTION',
+                        help='Allowed relative drop in reads/s or growth in peak RSS '
+                             '(default: 0.2)')
+    parser.add_argument('--timeout', type=float, default=COMMAND_TIMEOUT_SECONDS,
+                        metavar='SECONDS', help='Timeout for a single run (default: 600)')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    return args
+
+
+def main() -> int:
+    args = parse_args()
+
+    version = tool_version(['nanalogue', '--version'])
+    if version == 'missing':
+        print("Error: nanalogue not found in PATH", file=sys.stderr)
+        return 1
+
+    baseline = None
+    if args.compare is not None:
+        try:
+            baseline = json.loads(args.compare.read_text())
+        except (OSError, ValueError) as e:
+            print(f"Error: cannot read baseline {args.compare}: {e}", file=sys.stderr)
+            return 1
+
+    json_config = dict(FIXTURES)[args.fixture]
+    results = []
+
+    for reads in args.sizes:
+        print(f"Simulating {reads} reads from {args.fixture}...")
+        entry = simulate_cached(scaled_config(json_config, reads), FIXTURE_CACHE_DIR)
+        bam_path = entry / "sim.bam"
+
+        queries = region_queries(entry)
+
+        for subcommand in SUBCOMMANDS:
+            for filter_name in FILTERS:
+                result = benchmark(bam_path, reads, subcommand, filter_name,
+                                   args.repeat, args.timeout)
+                results.append(result)
+            for label, region in queries.items():
+                results.append(benchmark(bam_path, reads, subcommand, label,
+                                         args.repeat, args.timeout, region))
+        print()
+
+    print_table(results)
+
+    output = args.output
+    if output is None:
+        output = BENCHMARK_DIR / f"{version.replace(' ', '-')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        'nanalogue': version,
+        'fixture': args.fixture,
+        'repeat': args.repeat,
+        'cpu_count': os.cpu_count(),
+        'results': results,
+    }
+    output.write_text(json.dumps(report, indent=2) + '\n')
+    print(f"\nWrote {output}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.tolerance)
+        print(f"\nCompared with {args.compare} ({baseline.get('nanalogue', 'unknown version')}):")
+        if not regressions:
+            print("  No regressions")
+            return 0
+        for regression in regressions:
+            print(f"  REGRESSION {regression}")
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
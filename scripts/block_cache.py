@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Persistent, content-addressed cache of passing code block results.
+
+A cache entry is keyed on the prepared code of a block (with the per-run
+work directory normalised away), digests of the test fixtures the block
+uses and a fingerprint of the tools the blocks call. When any of those change, the
+key changes and the block is run again. Only passing results are stored.
+
+Output files that a block writes (e.g. hypermethylated_reads.txt) are
+stored alongside the entry and restored on a hit, so later blocks that
+consume them still find them.
+
+stdout is stored as it was captured, which may be only its first lines
+(see output_capture.py). Such an entry only serves blocks that need no
+more lines than were kept.
+"""
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from dataclasses import dataclass
+from importlib import metadata
+from pathlib import Path
+
+from output_capture import CapturedOutput
+
+WORK_DIR_TOKEN = '<work_dir>'
+
+
+def file_digest(path: Path) -> str:
+    """Return the sha256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fixture_digests(test_files: dict[str, Path]) -> dict[str, str]:
+    """Hash the contents of each test fixture, keyed by placeholder name."""
+    by_path: dict[Path, str] = {}
+    digests = {}
+    for placeholder, path in test_files.items():
+        if path not in by_path:
+            by_path[path] = file_digest(path)
+        digests[placeholder] = by_path[path]
+    return digests
+
+
+def tool_version(command: list[str]) -> str:
+    """Return the first line of a tool's version output, or 'missing'."""
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return 'missing'
+    output = (result.stdout or result.stderr).strip()
+    return output.split('\n')[0] if output else 'missing'
+
+
+def tool_fingerprint() -> str:
+    """Describe the versions of every tool that code blocks may call."""
+    try:
+        pynanalogue_version = metadata.version('pynanalogue')
+    except metadata.PackageNotFoundError:
+        pynanalogue_version = 'missing'
+
+    parts = [
+        f"nanalogue: {tool_version(['nanalogue', '--version'])}",
+        f"pynanalogue: {pynanalogue_version}",
+        f"samtools: {tool_version(['samtools', '--version'])}",
+        f"jq: {tool_version(['jq', '--version'])}",
+        f"python: {sys.version.split()[0]}",
+    ]
+    return '\n'.join(parts)
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write data to path so that readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+@dataclass
+class CachedResult:
+    """A passing block result loaded from the cache."""
+    stdout: CapturedOutput
+    stderr: str
+    output_files: dict[str, str]
+
+
+class ResultCache:
+    """On-disk cache of passing block results.
+
+    `salt` should combine everything outside the block's own code and
+    fixtures that can change its result, i.e. the tool fingerprint.
+    """
+
+    def __init__(self, cache_dir: Path, salt: str, read: bool = True):
+        self.cache_dir = cache_dir
+        self.salt = salt
+        self.read = read
+
+    def key(self, language: str, prepared_code: str, work_dir: Path,
+            fixtures: dict[str, str]) -> str:
+        """Compute the cache key for a prepared block.
+
+        fixtures maps the placeholders the block uses to their digests.
+        """
+        normalised = prepared_code.replace(str(work_dir), WORK_DIR_TOKEN)
+        used = ''.join(f'{placeholder}={digest}\n' for placeholder, digest in sorted(fixtures.items()))
+        digest = hashlib.sha256()
+        for part in (self.salt, used, language, normalised):
+            digest.update(part.encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.cache_dir / 'results' / key[:2] / f'{key}.json'
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.cache_dir / 'blobs' / digest[:2] / digest
+
+    def get(self, key: str, outputs: dict[str, Path],
+            max_lines: int | None = None) -> CachedResult | None:
+        """Look up a result and restore its output files.
+
+        outputs maps the name of each file the block may write to where it
+        belongs in this run. max_lines is the number of lines of stdout
+        needed, None for all of it.
+        """
+        if not self.read:
+            return None
+
+        try:
+            entry = json.loads(self._entry_path(key).read_text())
+            stdout = CapturedOutput(entry['stdout'], entry.get('stdout_bytes', 0),
+                                    entry.get('stdout_sha256', ''),
+                                    entry.get('stdout_truncated', False))
+            kept_lines = entry.get('stdout_max_lines')
+            if stdout.truncated and (max_lines is None or max_lines > kept_lines):
+                return None
+            result = CachedResult(stdout, entry['stderr'], entry['output_files'])
+            blobs = {name: self._blob_path(digest).read_bytes()
+                     for name, digest in result.output_files.items()}
+        except (OSError, ValueError, KeyError):
+            return None
+
+        for name, data in blobs.items():
+            if name in outputs:
+                outputs[name].parent.mkdir(parents=True, exist_ok=True)
+                outputs[name].write_bytes(data)
+        return result
+
+    def put(self, key: str, stdout: CapturedOutput, stderr: str, outputs: dict[str, Path],
+            max_lines: int | None = None) -> None:
+        """Store a passing result along with any of its outputs that exist.
+
+        outputs maps the name of each file the block may write to its path.
+        max_lines is the number of lines stdout was captured with.
+        """
+        stored = {}
+        for name, path in outputs.items():
+            if not path.is_file():
+                continue
+            data = path.read_bytes()
+            digest = hashlib.sha256(data).hexdigest()
+            blob = self._blob_path(digest)
+            if not blob.exists():
+                atomic_write_bytes(blob, data)
+            stored[name] = digest
+
+        entry = {'stdout': stdout.text, 'stdout_bytes': stdout.total_bytes,
+                 'stdout_sha256': stdout.sha256, 'stdout_truncated': stdout.truncated,
+                 'stdout_max_lines': max_lines, 'stderr': stderr, 'output_files': stored}
+        atomic_write_bytes(self._entry_path(key), json.dumps(entry).encode())
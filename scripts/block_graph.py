@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Producer/consumer dependencies between code blocks.
+
+A block produces a file if it writes it through a redirection (`> f`,
+`>> f`), `tee f`, an output option (`-o f`, `--output f`) or, in python,
+`open(f, 'w')`, `savefig(f)`, `write_csv(f)` and similar. A later block
+that mentions the file by name, as a shell word or a string literal,
+depends on the last block before it that produced the file. A block that
+overwrites a file also depends on the blocks that read the earlier
+version, so that it cannot clobber it too soon.
+
+The output files known to prepare_bash_code are passed in as well: the
+first block to mention one of them counts as its producer even when the
+writing command is not recognised.
+"""
+
+import heapq
+import os
+import re
+import shlex
+from dataclasses import dataclass
+
+# Shell operators whose next word is a file that gets written
+WRITE_REDIRECTS = {'>', '>|', '&>'}
+APPEND_REDIRECTS = {'>>', '&>>'}
+# Options whose value is an output file, e.g. `samtools view -o out.bam`
+OUTPUT_OPTIONS = {'-o', '--output'}
+# Commands for which -o is a flag rather than an output file
+NO_OUTPUT_OPTION = {'grep', 'egrep', 'fgrep', 'rg'}
+# Characters that make up shell operators such as |, && and >>
+OPERATOR_CHARS = set('();<>|&')
+
+HEREDOC = re.compile(r"<<-?\s*(['\"]?)(\w+)\1")
+PYTHON_STRING = re.compile(r"""(['"])([^'"\n]+)\1""")
+PYTHON_OPEN = re.compile(r"""open\(\s*(['"])([^'"\n]+)\1\s*,\s*(['"])[^'"\n]*[wax]""")
+PYTHON_WRITERS = re.compile(
+    r"""\.(?:savefig|write_csv|to_csv|write_parquet|to_parquet|write_json|to_json)"""
+    r"""\(\s*(['"])([^'"\n]+)\1"""
+)
+
+
+@dataclass
+class BlockGraph:
+    """Dependencies between a list of blocks, by position in the list."""
+    # Files each block writes
+    produces: list[set[str]]
+    # Positions of the blocks each block must wait for
+    depends_on: list[set[int]]
+
+    def reordered(self, order: list[int]) -> 'BlockGraph':
+        """The same graph for the blocks rearranged as [blocks[i] for i in order]."""
+        position = {old: new for new, old in enumerate(order)}
+        return BlockGraph(
+            produces=[self.produces[i] for i in order],
+            depends_on=[{position[j] for j in self.depends_on[i]} for i in order],
+        )
+
+
+def strip_heredocs(code: str) -> str:
+    """Drop the bodies of here-documents, which are data rather than commands."""
+    lines = code.split('\n')
+    kept = []
+    delimiter = None
+    for line in lines:
+        if delimiter is not None:
+            if line.strip() == delimiter:
+                delimiter = None
+            continue
+        kept.append(line)
+        match = HEREDOC.search(line)
+        if match:
+            delimiter = match.group(2)
+    return '\n'.join(kept)
+
+
+def shell_words(code: str) -> list[str]:
+    """Split shell code into words and operators, dropping comments."""
+    code = strip_heredocs(code).replace('\\\n', ' ')
+    lexer = shlex.shlex(code, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    try:
+        return list(lexer)
+    except ValueError:
+        # Unbalanced quotes; a plain split is good enough to find file names
+        return code.split()
+
+
+def is_operator(word: str) -> bool:
+    return all(c in OPERATOR_CHARS for c in word)
+
+
+def normalise(name: str) -> str:
+    return os.path.normpath(name)
+
+
+def bash_files(code: str) -> tuple[set[str], set[str]]:
+    """Return (files written, files read or otherwise mentioned) by shell code."""
+    words = shell_words(code)
+    produced: set[str] = set()
+    mentioned: set[str] = set()
+    in_tee = False
+    command = None
+
+    for i, word in enumerate(words):
+        previous = words[i - 1] if i > 0 else None
+        if is_operator(word):
+            in_tee = False
+            command = None
+            continue
+        if command is None:
+            command = word
+
+        if previous in WRITE_REDIRECTS:
+            produced.add(normalise(word))
+        elif previous in APPEND_REDIRECTS:
+            # Appending keeps what an earlier block wrote
+            produced.add(normalise(word))
+            mentioned.add(normalise(word))
+        elif ((previous in OUTPUT_OPTIONS and command not in NO_OUTPUT_OPTION)
+              or (in_tee and not word.startswith('-'))):
+            produced.add(normalise(word))
+        elif word.startswith('--output='):
+            produced.add(normalise(word.split('=', 1)[1]))
+        else:
+            mentioned.add(normalise(word))
+        if word == 'tee':
+            in_tee = True
+
+    return produced, mentioned
+
+
+def python_files(code: str) -> tuple[set[str], set[str]]:
+    """Return (files written, files mentioned) by python code."""
+    produced = {normalise(m.group(2)) for m in PYTHON_OPEN.finditer(code)}
+    produced |= {normalise(m.group(2)) for m in PYTHON_WRITERS.finditer(code)}
+    mentioned = {normalise(m.group(2)) for m in PYTHON_STRING.finditer(code)} - produced
+    return produced, mentioned
+
+
+def block_files(language: str, code: str) -> tuple[set[str], set[str]]:
+    """Return (files written, files mentioned) by a block."""
+    if language == 'bash':
+        return bash_files(code)
+    if language == 'python':
+        return python_files(code)
+    return set(), set()
+
+
+def build_graph(blocks: list[tuple[str, str]], known_outputs: list[str]) -> BlockGraph:
+    """Build the dependency graph of (language, code) blocks in document order."""
+    known = {normalise(name) for name in known_outputs}
+    last_producer: dict[str, int] = {}
+    # Blocks that read a file since it was last written
+    readers: dict[str, set[int]] = {}
+    produces = []
+    depends_on = []
+
+    for index, (language, code) in enumerate(blocks):
+        produced, mentioned = block_files(language, code)
+        produced |= {name for name in mentioned & known if name not in last_producer}
+
+        deps = {last_producer[name] for name in mentioned if name in last_producer}
+        for name in produced:
+            if name in last_producer:
+                deps.add(last_producer[name])
+            deps |= readers.get(name, set())
+        deps.discard(index)
+
+        for name in mentioned:
+            if name in last_producer:
+                readers.setdefault(name, set()).add(index)
+        for name in produced:
+            last_producer[name] = index
+            readers[name] = set()
+
+        produces.append(produced)
+        depends_on.append(deps)
+
+    return BlockGraph(produces=produces, depends_on=depends_on)
+
+
+def dependency_order(graph: BlockGraph, preferred: list[int]) -> list[int]:
+    """Order the blocks as close to `preferred` as their dependencies allow.
+
+    Returns the positions of the blocks so that every block comes after
+    the blocks it depends on.
+    """
+    rank = {index: r for r, index in enumerate(preferred)}
+    waiting = [len(deps) for deps in graph.depends_on]
+    dependents: list[list[int]] = [[] for _ in graph.depends_on]
+    for index, deps in enumerate(graph.depends_on):
+        for dep in deps:
+            dependents[dep].append(index)
+
+    ready = [(rank[i], i) for i, count in enumerate(waiting) if count == 0]
+    heapq.heapify(ready)
+    order = []
+    while ready:
+        _, index = heapq.heappop(ready)
+        order.append(index)
+        for dependent in dependents[index]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                heapq.heappush(ready, (rank[dependent], dependent))
+    return order
+
+
+def affected_blocks(graph: BlockGraph, changed: list[bool]) -> list[int]:
+    """Positions of the blocks to re-run when the flagged blocks change.
+
+    These are the changed blocks, the blocks that depend on them, directly
+    or not, and every block that those depend on, in their original order.
+    """
+    dependents: list[list[int]] = [[] for _ in graph.depends_on]
+    for index, deps in enumerate(graph.depends_on):
+        for dep in deps:
+            dependents[dep].append(index)
+
+    downstream: set[int] = set()
+    stack = [index for index, flag in enumerate(changed) if flag]
+    while stack:
+        index = stack.pop()
+        if index not in downstream:
+            downstream.add(index)
+            stack.extend(dependents[index])
+
+    needed: set[int] = set()
+    stack = list(downstream)
+    while stack:
+        index = stack.pop()
+        if index not in needed:
+            needed.add(index)
+            stack.extend(graph.depends_on[index])
+    return sorted(needed)
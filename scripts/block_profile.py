@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+cProfile and tracemalloc profiles of python code blocks.
+
+A profiled block runs inside a small harness that executes its code under
+cProfile with tracemalloc tracing, in the namespace the block would have
+had anyway, so it works the same in a fresh `python -c`, a forked warm
+interpreter or a python session. The harness saves a .pstats file of the
+block and a summary of its largest allocations by source line. The code is
+compiled with the block's page and line as its file name, so that its
+functions can be told apart from those of pynanalogue, polars and the rest
+once the profiles of every block are merged.
+"""
+
+import pstats
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+PROFILE_DIR = REPO_ROOT / ".cache" / "profiles"
+# Source lines listed in each block's allocation summary
+TOP_ALLOCATIONS = 10
+# Functions listed in the hot-function table of a run
+HOT_FUNCTIONS = 15
+# Packages whose share of the time is reported separately
+PROFILE_PACKAGES = ('pynanalogue', 'polars', 'pandas', 'numpy', 'matplotlib')
+# File name given to the code of a block: its page and line number
+BLOCK_FILENAME = re.compile(r'\.md:\d+$')
+
+# Runs the code in _profile_params under cProfile and tracemalloc, in the
+# current globals, and writes the profile and allocation summary even if
+# the code raises or exits. Helper names are removed again afterwards, as
+# a python session keeps the namespace for the next block.
+PROFILE_HARNESS = '''
+import cProfile as _cProfile, tracemalloc as _tracemalloc
+_tracemalloc.start()
+_profiler = _cProfile.Profile()
+try:
+    _profiler.runctx(compile(_profile_params['code'], _profile_params['label'], 'exec'),
+                     globals(), globals())
+finally:
+    _profiler.dump_stats(_profile_params['stats'])
+    _peak = _tracemalloc.get_traced_memory()[1]
+    _snapshot = _tracemalloc.take_snapshot().filter_traces([
+        _tracemalloc.Filter(False, _tracemalloc.__file__),
+        _tracemalloc.Filter(False, _cProfile.__file__),
+        _tracemalloc.Filter(False, '<string>'),
+    ])
+    _tracemalloc.stop()
+    with open(_profile_params['allocations'], 'w') as _file:
+        _file.write('peak traced memory: %.1f MiB\\n' % (_peak / 1048576))
+        _file.write('%12s %10s  %s\\n' % ('size', 'blocks', 'line'))
+        for _stat in _snapshot.statistics('lineno')[:_profile_params['top']]:
+            _frame = _stat.traceback[0]
+            _file.write('%8.1f KiB %10d  %s:%d\\n'
+                        % (_stat.size / 1024, _stat.count, _frame.filename, _frame.lineno))
+    del _cProfile, _tracemalloc, _profiler, _peak, _snapshot, _file, _profile_params
+'''
+
+
+@dataclass
+class BlockProfile:
+    """Where the profile of one python block is written."""
+    # Page and line of the block, used as the file name of its code
+    label: str
+    stats_path: Path
+    allocations_path: Path
+
+
+def block_profile(profile_dir: Path, page: str, line_number: int) -> BlockProfile:
+    """Paths of the profile of the block at line_number of page, in profile_dir."""
+    label = f"{page}:{line_number}"
+    stem = re.sub(r'[^\w.-]+', '_', label).strip('_')
+    return BlockProfile(label, profile_dir / f"{stem}.pstats",
+                        profile_dir / f"{stem}.allocations.txt")
+
+
+def profiled_code(code: str, profile: BlockProfile) -> str:
+    """Python code that runs code under the profiling harness."""
+    params = {
+        'code': code,
+        'label': profile.label,
+        'stats': str(profile.stats_path),
+        'allocations': str(profile.allocations_path),
+        'top': TOP_ALLOCATIONS,
+    }
+    return f"_profile_params = {params!r}\n{PROFILE_HARNESS}"
+
+
+def package_of(function: tuple[str, int, str]) -> str:
+    """Which package a profiled function belongs to: a PROFILE_PACKAGES entry,
+    'example code' for the code of a block, or 'other'."""
+    filename, _, name = function
+    if BLOCK_FILENAME.search(filename):
+        return 'example code'
+    for package in PROFILE_PACKAGES:
+        if f'/{package}/' in filename or (filename == '~' and package in name):
+            return package
+    return 'other'
+
+
+def merge_profiles(profiles: list[BlockProfile], path: Path) -> pstats.Stats | None:
+    """Merge the profiles that were written into one, saved at path."""
+    files = [str(p.stats_path) for p in profiles if p.stats_path.exists()]
+    if not files:
+        return None
+    stats = pstats.Stats(*files)
+    stats.dump_stats(path)
+    return stats
+
+
+def hot_functions(stats: pstats.Stats, count: int = HOT_FUNCTIONS) -> list[dict]:
+    """The count functions with the most time spent in themselves."""
+    rows = [
+        {
+            'function': pstats.func_std_string(function),
+            'package': package_of(function),
+            'calls': calls,
+            'self_seconds': self_time,
+            'cumulative_seconds': cumulative,
+        }
+        for function, (_, calls, self_time, cumulative, _) in stats.stats.items()
+    ]
+    rows.sort(key=lambda row: row['self_seconds'], reverse=True)
+    return rows[:count]
+
+
+def package_seconds(stats: pstats.Stats) -> dict[str, float]:
+    """Time spent in the functions of each package, most first."""
+    totals: dict[str, float] = {}
+    for function, (_, _, self_time, _, _) in stats.stats.items():
+        package = package_of(function)
+        totals[package] = totals.get(package, 0.0) + self_time
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+def print_profile(stats: pstats.Stats, count: int, merged_path: Path) -> None:
+    """Print where the time of the profiled blocks went."""
+    totals = package_seconds(stats)
+    overall = sum(totals.values()) or 1.0
+    print(f"\nProfile of the python blocks, merged into {merged_path}:")
+    print("  Time by package: " + ', '.join(
+        f"{package} {seconds:.2f}s ({seconds / overall:.0%})" for package, seconds in totals.items()))
+    print(f"  Hottest {count} functions by time spent in themselves:")
+    print(f"  {'self':>8} {'cumul':>8} {'calls':>8}  {'package':<13} function")
+    for row in hot_functions(stats, count):
+        print(f"  {row['self_seconds']:7.3f}s {row['cumulative_seconds']:7.3f}s "
+              f"{row['calls']:>8}  {row['package']:<13} {row['function']}")
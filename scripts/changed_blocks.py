@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Git-based selection of the documentation pages affected by recent changes.
+
+A page is affected if it changed since a git ref, or if it uses a
+placeholder (e.g. input.bam) whose simulated fixture is built from a config
+in scripts/test_data.py that changed since that ref.
+"""
+
+import ast
+import subprocess
+from pathlib import Path
+
+from test_data import FIXTURES, PLACEHOLDERS, placeholder_pattern
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+TEST_DATA_PATH = Path(__file__).resolve().parent / 'test_data.py'
+
+
+def is_valid_ref(ref: str) -> bool:
+    """Check that ref names a commit."""
+    result = subprocess.run(
+        ['git', 'rev-parse', '--verify', '--quiet', f'{ref}^{{commit}}'],
+        cwd=REPO_ROOT,
+        capture_output=True
+    )
+    return result.returncode == 0
+
+
+def show_at_ref(ref: str, path: Path) -> str | None:
+    """Return the contents of path at ref, or None if it did not exist there."""
+    relative = path.resolve().relative_to(REPO_ROOT).as_posix()
+    result = subprocess.run(
+        ['git', 'show', f'{ref}:{relative}'],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True
+    )
+    return result.stdout if result.returncode == 0 else None
+
+
+def changed_markdown_files(ref: str) -> set[Path]:
+    """Markdown files under src/ changed since ref, including untracked ones."""
+    commands = [
+        ['git', 'diff', '--name-only', ref, '--', 'src'],
+        ['git', 'ls-files', '--others', '--exclude-standard', '--', 'src'],
+    ]
+    changed = set()
+    for command in commands:
+        result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True,
+                                check=True)
+        for name in result.stdout.splitlines():
+            path = REPO_ROOT / name
+            if path.suffix == '.md' and path.exists():
+                changed.add(path)
+    return changed
+
+
+def string_constants(tree: ast.Module) -> dict[str, str]:
+    """Module-level NAME = '...' assignments, e.g. the JSON configs."""
+    constants = {}
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                and isinstance(node.targets[0], ast.Name)
+                and isinstance(node.value, ast.Constant)
+                and isinstance(node.value.value, str)):
+            constants[node.targets[0].id] = node.value.value
+    return constants
+
+
+def without_string_constants(tree: ast.Module) -> str:
+    """Dump a module's AST leaving out its string constant assignments."""
+    names = string_constants(tree)
+    body = [node for node in tree.body
+            if not (isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)
+                    and node.targets[0].id in names)]
+    return ast.dump(ast.Module(body=body, type_ignores=[]))
+
+
+def changed_placeholders(ref: str) -> set[str]:
+    """Placeholders whose fixtures may differ because test_data.py changed.
+
+    If only some simulation configs changed, just their placeholders are
+    returned. Any other change to test_data.py affects every placeholder.
+    """
+    old_source = show_at_ref(ref, TEST_DATA_PATH)
+    new_source = TEST_DATA_PATH.read_text()
+    if old_source == new_source:
+        return set()
+    if old_source is None:
+        return set(PLACEHOLDERS)
+
+    try:
+        old_tree = ast.parse(old_source)
+    except SyntaxError:
+        return set(PLACEHOLDERS)
+    new_tree = ast.parse(new_source)
+
+    if without_string_constants(old_tree) != without_string_constants(new_tree):
+        return set(PLACEHOLDERS)
+
+    old_constants = string_constants(old_tree)
+    new_constants = string_constants(new_tree)
+    changed_configs = {value for name, value in new_constants.items()
+                       if old_constants.get(name) != value}
+    stems = {stem for stem, json_config in FIXTURES if json_config in changed_configs}
+    return {placeholder for placeholder, stem in PLACEHOLDERS.items() if stem in stems}
+
+
+def uses_placeholder(text: str, placeholders: set[str]) -> bool:
+    """Check whether text mentions any of the placeholder filenames."""
+    return bool(placeholders) and placeholder_pattern(placeholders).search(text) is not None
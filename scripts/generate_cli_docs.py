@@ -1,15 +1,37 @@
 #!/usr/bin/env python3
 # Generates CLI documentation from nanalogue help text.
 # Creates src/all_cli_commands.md with all command help text.
-
-import subprocess
+#
+# Subcommand help, including nested subcommands such as
+# `find-modified-reads any-dens-above`, is fetched concurrently. The
+# generated page is cached in .cache/cli_docs, keyed on the content of the
+# nanalogue binary, its --version and this script, so an unchanged binary
+# costs one `nanalogue --version` and the page is not rewritten.
+
+import hashlib
+import os
 import re
+import shutil
+import subprocess
 import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
+from block_cache import atomic_write_bytes, file_digest, tool_version
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+CACHE_DIR = REPO_ROOT / ".cache" / "cli_docs"
+# Help runs are short and mostly wait on process startup
+HELP_WORKERS = min(32, 2 * (os.cpu_count() or 1))
+
 
 def get_help_text(command):
-    """Get help text for a command."""
+    """Get help text for a command.
+
+    Returns (text, returncode). On failure the text is the command's stderr
+    or a description of the error, and returncode is None if the command
+    did not run to completion.
+    """
     try:
         result = subprocess.run(
             command,
@@ -17,13 +39,14 @@ def get_help_text(command):
             text=True,
             timeout=30
         )
-        return result.stdout if result.returncode == 0 else result.stderr
+        text = result.stdout if result.returncode == 0 else result.stderr
+        return text, result.returncode
     except subprocess.TimeoutExpired:
-        return "Error: Command timed out after 30 seconds"
+        return "Error: Command timed out after 30 seconds", None
     except FileNotFoundError:
-        return f"Error: Command not found - {' '.join(command)}"
+        return f"Error: Command not found - {' '.join(command)}", None
     except Exception as e:
-        return f"Error getting help: {e}"
+        return f"Error getting help: {e}", None
 
 
 def parse_subcommands(help_text):
@@ -60,6 +83,54 @@ def parse_subcommands(help_text):
     return subcommands
 
 
+def collect_subcommand_help(main_help):
+    """Get the help of every subcommand, recursing into nested subcommands.
+
+    All help commands that are known at any point run concurrently. The
+    `help` subcommand that clap adds is listed at the top level as before,
+    but is not recursed into, and not listed again below it.
+
+    Returns a list of (subcommand path, help text, returncode) in document
+    order, each subcommand followed by its own subcommands.
+    """
+    helps = {}
+    children = {(): parse_subcommands(main_help)}
+
+    with ThreadPoolExecutor(max_workers=HELP_WORKERS) as executor:
+        pending = {}
+
+        def submit(path):
+            future = executor.submit(get_help_text, ["nanalogue", *path, "--help"])
+            pending[future] = path
+
+        for subcmd in children[()]:
+            submit((subcmd,))
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                helps[path] = future.result()
+                children[path] = []
+                help_text, returncode = helps[path]
+                if path[-1] == 'help' or returncode != 0:
+                    continue
+                children[path] = [s for s in parse_subcommands(help_text) if s != 'help']
+                for subcmd in children[path]:
+                    submit(path + (subcmd,))
+
+    ordered = []
+
+    def visit(path):
+        for subcmd in children[path]:
+            child = path + (subcmd,)
+            ordered.append((child, *helps[child]))
+            visit(child)
+
+    visit(())
+    return ordered
+
+
 def format_command_section(command_name, help_text):
     """Format a single command's help as markdown."""
     lines = [
@@ -73,24 +144,35 @@ def format_command_section(command_name, help_text):
     return lines
 
 
-def main():
-    """Generate CLI documentation."""
-    output_file = Path(__file__).parent.parent / "src" / "all_cli_commands.md"
+def cache_key(binary, version):
+    """Key the generated page on the binary, its version and this script."""
+    digest = hashlib.sha256()
+    for part in (file_digest(binary), version, file_digest(Path(__file__))):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
 
-    print("Generating CLI documentation...")
 
+def generate_markdown():
+    """Run nanalogue's help commands and build the reference page.
+
+    Returns (markdown, complete), where complete is False if any help
+    command failed, or None if the main help could not be fetched.
+    """
     # Get main help
     print("  Getting main help...")
-    main_help = get_help_text(["nanalogue", "--help"])
+    main_help, returncode = get_help_text(["nanalogue", "--help"])
 
-    if main_help.startswith("Error:"):
+    if returncode != 0:
         print(f"Failed to get main help: {main_help}", file=sys.stderr)
-        sys.exit(1)
+        return None
 
-    # Parse subcommands
-    print("  Parsing subcommands...")
-    subcommands = parse_subcommands(main_help)
-    print(f"  Found {len(subcommands)} subcommands: {', '.join(subcommands)}")
+    # Parse subcommands and get their help, nested ones included
+    print("  Getting subcommand help...")
+    sections = collect_subcommand_help(main_help)
+    top_level = [path[0] for path, _, _ in sections if len(path) == 1]
+    print(f"  Found {len(top_level)} subcommands: {', '.join(top_level)}")
+    print(f"  Found {len(sections) - len(top_level)} nested subcommands")
 
     # Build markdown content
     markdown_lines = [
@@ -107,18 +189,51 @@ def main():
     ]
 
     # Add each subcommand
-    if subcommands:
+    if sections:
         markdown_lines.append("# Subcommands")
         markdown_lines.append("")
 
-        for subcmd in subcommands:
-            print(f"  Getting help for '{subcmd}'...")
-            help_text = get_help_text(["nanalogue", subcmd, "--help"])
-            markdown_lines.extend(format_command_section(subcmd, help_text))
+        for path, help_text, _ in sections:
+            markdown_lines.extend(format_command_section(' '.join(path), help_text))
+
+    complete = all(returncode == 0 for _, _, returncode in sections)
+    return "\n".join(markdown_lines), complete
+
+
+def main():
+    """Generate CLI documentation."""
+    output_file = REPO_ROOT / "src" / "all_cli_commands.md"
+
+    print("Generating CLI documentation...")
+
+    binary = shutil.which("nanalogue")
+    if binary is None:
+        print("Failed to get main help: Error: Command not found - nanalogue --help",
+              file=sys.stderr)
+        sys.exit(1)
+
+    version = tool_version(["nanalogue", "--version"])
+    cached = CACHE_DIR / f"{cache_key(Path(binary).resolve(), version)}.md"
+
+    if cached.exists():
+        print(f"  Using cached help for {version}")
+        content = cached.read_text()
+    else:
+        generated = generate_markdown()
+        if generated is None:
+            sys.exit(1)
+        content, complete = generated
+        # Help that failed to come out is retried next time
+        if complete:
+            atomic_write_bytes(cached, content.encode())
+
+    if output_file.exists() and output_file.read_text() == content:
+        print(f"✓ CLI documentation is up to date: {output_file}")
+        return 0
 
     # Write to file
     output_file.parent.mkdir(parents=True, exist_ok=True)
-    output_file.write_text("\n".join(markdown_lines))
+    output_file.write_text(content)
     print(f"✓ Generated CLI documentation: {output_file}")
 
     return 0
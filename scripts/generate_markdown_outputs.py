@@ -15,6 +15,19 @@ Markers (full output, no truncation):
     content to be replaced
     <!-- AUTO-GENERATED-FULL:END -->
 
+Markers (benchmark: runtime and peak memory of the block above):
+    <!-- AUTO-GENERATED-BENCH:START runs=10 reads=100000 -->
+    content to be replaced
+    <!-- AUTO-GENERATED-BENCH:END -->
+
+A benchmark section runs its block `runs` times (default 5) and fills the
+section with a table of the median and 95th percentile of wall time, CPU
+time and peak RSS. With `reads`, the fixtures the block uses are scaled
+to that many reads first (and kept in the fixture cache). Each run goes
+through a small probe process, so CPU time and peak RSS come from
+getrusage(RUSAGE_CHILDREN) of that run alone, without the python
+interpreter or anything else this script started.
+
 Usage:
     python generate_markdown_outputs.py [markdown_files...]
 
@@ -22,21 +35,50 @@ If no files specified, searches for all .md files in src/
 """
 
 import argparse
+import json
 import os
 import re
+import statistics
 import subprocess
 import sys
 import tempfile
-from dataclasses import dataclass
+from collections.abc import Callable
+from dataclasses import dataclass, field
 from pathlib import Path
 
-from test_data import create_test_data
+from block_cache import tool_version
+from markdown_index import MarkdownIndex, MarkerSection, index_markdown
+from output_capture import HeadCapture, TailCapture, stream_process
+from test_data import (
+    FIXTURE_CACHE_DIR,
+    FIXTURES,
+    PLACEHOLDERS,
+    create_test_data,
+    referenced_placeholders,
+    scaled_config,
+    simulate_cached,
+    substitute_placeholders,
+)
 
 COMMAND_TIMEOUT_SECONDS = 60
 REPO_ROOT = Path(__file__).parent.parent.resolve()
 OUTPUTS_DIR = REPO_ROOT / "outputs"
 OUTPUT_FILES = ['hypermethylated_reads.txt', 'hypermethylated.bam', 'densities.tsv']
 DEFAULT_TRUNCATE_LINES = 5
+DEFAULT_BENCH_RUNS = 5
+
+# Runs a command with its stdout discarded and prints what it used as JSON.
+# RUSAGE_CHILDREN covers the command and everything it waited for, and
+# nothing else, as the command is the probe's only child.
+BENCH_PROBE = '''
+import json, resource, subprocess, sys, time
+start = time.monotonic()
+returncode = subprocess.call(sys.argv[1:], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+wall = time.monotonic() - start
+usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+print(json.dumps({"returncode": returncode, "wall": wall,
+                  "cpu": usage.ru_utime + usage.ru_stime, "maxrss_kib": usage.ru_maxrss}))
+'''
 
 
 @dataclass
@@ -45,6 +87,8 @@ class MarkerConfig:
     start: str
     end: str
     max_lines: int | None
+    # Filled with timings of repeated runs instead of the block's output
+    bench: bool = False
 
 
 MARKERS = [
@@ -58,23 +102,55 @@ MARKERS = [
         end='<!-- AUTO-GENERATED-FULL:END -->',
         max_lines=None,
     ),
+    MarkerConfig(
+        start='<!-- AUTO-GENERATED-BENCH:START -->',
+        end='<!-- AUTO-GENERATED-BENCH:END -->',
+        max_lines=0,
+        bench=True,
+    ),
 ]
 
 
+def marker_config(section: MarkerSection) -> MarkerConfig | None:
+    """The configuration of a marker section, or None for unknown kinds."""
+    for marker in MARKERS:
+        if marker.start == section.start_tag:
+            return marker
+    return None
+
+
+def rewrite_for_output(code: str) -> str:
+    """Rewrite example code so that it prints its output for the docs.
+
+    Example regions are mapped onto the simulated contigs and redirections
+    into .tsv files are dropped, so the output goes to stdout instead.
+    """
+    prepared = re.sub(r'chr\d+:\d+-\d+', 'contig_00000:0-500', code)
+    prepared = re.sub(r'\s*>\s*\S+\.tsv\s*$', '', prepared, flags=re.MULTILINE)
+    return prepared
+
+
 def prepare_bash_code(code: str, test_files: dict[str, Path], work_dir: Path) -> str:
     """Prepare bash code for execution by substituting test files and paths."""
     prepared = code
 
-    for placeholder, real_path in test_files.items():
-        prepared = prepared.replace(placeholder, str(real_path))
+    prepared = substitute_placeholders(prepared, test_files)
 
     for outfile in OUTPUT_FILES:
         prepared = prepared.replace(outfile, str(work_dir / outfile))
 
-    prepared = re.sub(r'chr\d+:\d+-\d+', 'contig_00000:0-500', prepared)
-    prepared = re.sub(r'\s*>\s*\S+\.tsv\s*$', '', prepared, flags=re.MULTILINE)
+    return rewrite_for_output(prepared)
 
-    return prepared
+
+@dataclass
+class BenchSummary:
+    """Measurements of the repeated runs of a benchmarked block."""
+    runs: int
+    # Reads in the fixture the block ran on, if it used one
+    reads: int | None
+    wall_seconds: list[float] = field(default_factory=list)
+    cpu_seconds: list[float] = field(default_factory=list)
+    peak_rss_mb: list[float] = field(default_factory=list)
 
 
 @dataclass
@@ -83,112 +159,272 @@ class CommandResult:
     success: bool
     stdout: str
     stderr: str
+    # True if stdout was cut short while it was captured
+    truncated: bool = False
+    # Set for the runs of a benchmark section
+    bench: BenchSummary | None = None
 
 
-def run_bash_command(code: str, work_dir: Path) -> CommandResult:
-    """Run a bash command and return the result."""
+def run_bash_command(code: str, work_dir: Path, max_lines: int | None = None) -> CommandResult:
+    """Run a bash command and return the result.
+
+    Only the first max_lines lines of stdout are kept (all of it if None),
+    and only the end of stderr.
+    """
     env = {**os.environ, 'HOME': str(work_dir)}
+    stdout = HeadCapture(max_lines)
+    stderr = TailCapture()
 
     try:
-        result = subprocess.run(
+        process = subprocess.Popen(
             ['bash', '-e', '-c', code],
-            capture_output=True,
-            text=True,
-            timeout=COMMAND_TIMEOUT_SECONDS,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
             cwd=OUTPUTS_DIR,
-            env=env
-        )
-        return CommandResult(
-            success=result.returncode == 0,
-            stdout=result.stdout,
-            stderr=result.stderr
-        )
-    except subprocess.TimeoutExpired:
-        return CommandResult(
-            success=False,
-            stdout="",
-            stderr=f"Command timed out after {COMMAND_TIMEOUT_SECONDS} seconds"
+            env=env,
+            start_new_session=True
         )
+        returncode, timed_out, _ = stream_process(process, COMMAND_TIMEOUT_SECONDS, stdout, stderr)
     except Exception as e:
         return CommandResult(success=False, stdout="", stderr=str(e))
 
+    output = stdout.result()
+    if timed_out:
+        return CommandResult(
+            success=False,
+            stdout=output.text,
+            stderr=f"Command timed out after {COMMAND_TIMEOUT_SECONDS} seconds",
+            truncated=output.truncated
+        )
+    return CommandResult(
+        success=returncode == 0,
+        stdout=output.text,
+        stderr=stderr.result().text,
+        truncated=output.truncated
+    )
 
-def find_code_block_before_marker(content: str, marker_pos: int) -> str | None:
-    """Find the bash code block immediately before a marker position."""
-    text_before = content[:marker_pos]
-    pattern = r'```bash\n(.*?)```'
-    matches = list(re.finditer(pattern, text_before, re.DOTALL))
-
-    if not matches:
-        return None
-
-    return matches[-1].group(1).strip()
 
+def bench_options(section: MarkerSection) -> tuple[int, int | None]:
+    """Return the runs and reads options of a benchmark section.
 
-def format_output(stdout: str, max_lines: int | None = 5) -> str:
-    """Format command output, truncating if necessary. max_lines=None means no truncation."""
-    output_lines = stdout.strip().split('\n')
-    if max_lines is not None and len(output_lines) > max_lines:
+    Raises ValueError if they are not positive integers.
+    """
+    runs = section.options.get('runs', str(DEFAULT_BENCH_RUNS))
+    reads = section.options.get('reads')
+    try:
+        values = int(runs), None if reads is None else int(reads)
+    except ValueError:
+        raise ValueError(f"benchmark options must be integers: runs={runs} reads={reads}")
+    if values[0] < 1 or (values[1] is not None and values[1] < 1):
+        raise ValueError(f"benchmark options must be positive: runs={runs} reads={reads}")
+    return values
+
+
+def bench_test_files(code: str, test_files: dict[str, Path],
+                     reads: int | None) -> tuple[dict[str, Path], int | None]:
+    """Choose the fixtures a benchmarked block runs on.
+
+    With reads, each fixture the block uses is replaced by a copy scaled to
+    that many reads, simulated into the fixture cache if needed. Returns the
+    test files and the number of reads of the (first) fixture used.
+    """
+    configs = dict(FIXTURES)
+    used = [p for p in PLACEHOLDERS if p in referenced_placeholders([code])]
+    if not used:
+        return test_files, None
+    if reads is None:
+        config = json.loads(configs[PLACEHOLDERS[used[0]]])
+        return test_files, sum(group['number'] for group in config['reads'])
+
+    scaled = dict(test_files)
+    for placeholder in used:
+        config = scaled_config(configs[PLACEHOLDERS[placeholder]], reads)
+        scaled[placeholder] = simulate_cached(config, FIXTURE_CACHE_DIR) / "sim.bam"
+    return scaled, reads
+
+
+def run_benchmark(code: str, runs: int, reads: int | None, work_dir: Path) -> CommandResult:
+    """Run a prepared bash command runs times and measure each run.
+
+    Stops at the first run that fails or times out, and returns its error.
+    """
+    env = {**os.environ, 'HOME': str(work_dir)}
+    summary = BenchSummary(runs, reads)
+
+    for _ in range(runs):
+        stdout = HeadCapture(None)
+        stderr = TailCapture()
+        try:
+            process = subprocess.Popen(
+                [sys.executable, '-c', BENCH_PROBE, 'bash', '-e', '-c', code],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=OUTPUTS_DIR,
+                env=env,
+                start_new_session=True
+            )
+            _, timed_out, _ = stream_process(process, COMMAND_TIMEOUT_SECONDS, stdout, stderr)
+        except Exception as e:
+            return CommandResult(success=False, stdout="", stderr=str(e))
+        if timed_out:
+            return CommandResult(success=False, stdout="",
+                                 stderr=f"Command timed out after {COMMAND_TIMEOUT_SECONDS} seconds")
+
+        try:
+            measured = json.loads(stdout.result().text)
+        except ValueError:
+            return CommandResult(success=False, stdout="", stderr=stderr.result().text)
+        if measured['returncode'] != 0:
+            return CommandResult(success=False, stdout="", stderr=stderr.result().text)
+
+        summary.wall_seconds.append(measured['wall'])
+        summary.cpu_seconds.append(measured['cpu'])
+        # ru_maxrss is in KiB on Linux
+        summary.peak_rss_mb.append(measured['maxrss_kib'] / 1024)
+
+    return CommandResult(success=True, stdout="", stderr="", bench=summary)
+
+
+def percentile_95(values: list[float]) -> float:
+    """The 95th percentile of values, interpolated between the closest two."""
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=20, method='inclusive')[18]
+
+
+def format_bench(summary: BenchSummary, version: str) -> str:
+    """Format benchmark measurements as a markdown table with a caption."""
+    rows = [
+        ('Wall time', summary.wall_seconds, '{:.3f} s'),
+        ('CPU time', summary.cpu_seconds, '{:.3f} s'),
+        ('Peak RSS', summary.peak_rss_mb, '{:.1f} MB'),
+    ]
+    lines = ['| | median | p95 |', '|---|---|---|']
+    for label, values, fmt in rows:
+        median = fmt.format(statistics.median(values))
+        p95 = fmt.format(percentile_95(values))
+        lines.append(f'| {label} | {median} | {p95} |')
+
+    caption = f"{summary.runs} run{'s' if summary.runs != 1 else ''}"
+    if summary.reads is not None:
+        caption += f" on {summary.reads:,} simulated reads"
+    lines.extend(['', f"*Measured over {caption} with `{version}`.*"])
+    return '\n'.join(lines)
+
+
+def format_output(stdout: str, max_lines: int | None = 5, truncated: bool = False) -> str:
+    """Format command output, truncating if necessary. max_lines=None means no truncation.
+
+    truncated says that stdout is only the start of the output, in which
+    case it is at least one line longer than max_lines and is not the end.
+    """
+    output = stdout.lstrip() if truncated else stdout.strip()
+    output_lines = output.split('\n')
+    if max_lines is not None and (len(output_lines) > max_lines or truncated):
         output_lines = output_lines[:max_lines] + ['...']
     return '\n'.join(output_lines)
 
 
-def process_marker(
+def fill_marker_sections(
     content: str,
-    marker: MarkerConfig,
-    test_files: dict[str, Path],
-    work_dir: Path,
-    errors: list[str]
+    index: MarkdownIndex,
+    lookup: Callable[[MarkerSection], CommandResult | None],
+    errors: list[str],
+    skip_missing: bool = False
 ) -> tuple[str, int]:
-    """Process all instances of a single marker type in content."""
-    pattern = re.compile(
-        rf'{re.escape(marker.start)}\n(.*?){re.escape(marker.end)}',
-        re.DOTALL
-    )
+    """Replace the body of every known marker section in content.
+
+    index must be the index of content. lookup(marker) returns the result
+    of the code block the marker documents, or None if there is no such
+    block. With skip_missing, sections without a result are left as they
+    are instead. Sections of marker kinds not listed in MARKERS are left alone,
+    and so are benchmark sections whose result has no measurements.
+    """
+    pieces = []
+    previous_end = 0
     replacements = 0
+    version = None
 
-    def replace_section(match: re.Match) -> str:
-        nonlocal replacements
-
-        marker_pos = match.start()
-        code = find_code_block_before_marker(content, marker_pos)
+    for section in index.markers:
+        marker = marker_config(section)
+        if marker is None:
+            continue
 
-        if code is None:
-            errors.append(f"No code block found before marker at position {marker_pos}")
-            return match.group(0)
-
-        prepared_code = prepare_bash_code(code, test_files, work_dir)
-        result = run_bash_command(prepared_code, work_dir)
+        result = lookup(section)
+        if result is None and skip_missing:
+            continue
+        if result is None:
+            errors.append(f"No code block found before marker at position {section.start}")
+            continue
 
         if not result.success:
             errors.append(f"Command failed: {result.stderr}")
-            return match.group(0)
-
-        formatted_output = format_output(result.stdout, max_lines=marker.max_lines)
+            continue
+
+        if marker.bench:
+            if result.bench is None:
+                continue
+            if version is None:
+                version = tool_version(['nanalogue', '--version'])
+            body = f"{format_bench(result.bench, version)}\n"
+        else:
+            formatted_output = format_output(result.stdout, max_lines=marker.max_lines,
+                                             truncated=result.truncated)
+            body = f"```\n{formatted_output}\n```\n"
+        pieces.append(content[previous_end:section.start])
+        # The start tag is kept as it is, with any options
+        pieces.append(content[section.start:section.body_start])
+        pieces.append(f"{body}{marker.end}")
+        previous_end = section.end
         replacements += 1
-        return f"{marker.start}\n```\n{formatted_output}\n```\n{marker.end}"
 
-    new_content = pattern.sub(replace_section, content)
-    return new_content, replacements
+    pieces.append(content[previous_end:])
+    return ''.join(pieces), replacements
+
+
+def run_bench_section(marker: MarkerSection, code: str, test_files: dict[str, Path],
+                      work_dir: Path) -> CommandResult:
+    """Benchmark the block of a benchmark section as its options say."""
+    try:
+        runs, reads = bench_options(marker)
+        bench_files, reads = bench_test_files(code, test_files, reads)
+    except (ValueError, RuntimeError) as e:
+        return CommandResult(success=False, stdout="", stderr=str(e))
+    prepared_code = prepare_bash_code(code, bench_files, work_dir)
+    return run_benchmark(prepared_code, runs, reads, work_dir)
 
 
 def process_markdown_file(
     file_path: Path,
     test_files: dict[str, Path],
     work_dir: Path,
-    dry_run: bool = False
+    dry_run: bool = False,
+    bench_only: bool = False
 ) -> tuple[bool, int]:
-    """Process a markdown file, replacing auto-generated sections."""
+    """Process a markdown file, replacing auto-generated sections.
+
+    With bench_only, only the benchmark sections are filled.
+    """
     content = file_path.read_text()
-    new_content = content
-    total_replacements = 0
     errors: list[str] = []
 
-    for marker in MARKERS:
-        new_content, replacements = process_marker(
-            new_content, marker, test_files, work_dir, errors
-        )
-        total_replacements += replacements
+    index = index_markdown(content)
+
+    def run_block_before(marker: MarkerSection) -> CommandResult | None:
+        config = marker_config(marker)
+        if marker.owner is None or (bench_only and not config.bench):
+            return None
+        code = index.blocks[marker.owner].code.strip()
+        if config.bench:
+            return run_bench_section(marker, code, test_files, work_dir)
+        prepared_code = prepare_bash_code(code, test_files, work_dir)
+        return run_bash_command(prepared_code, work_dir, config.max_lines)
+
+    new_content, total_replacements = fill_marker_sections(
+        content, index, run_block_before, errors, skip_missing=bench_only
+    )
 
     if errors:
         for error in errors:
@@ -237,9 +473,16 @@ def main() -> int:
     with tempfile.TemporaryDirectory() as tmpdir:
         work_dir = Path(tmpdir)
 
+        # Only the blocks that feed a marker are run, so only their
+        # placeholders need test data
+        codes = []
+        for md_file in md_files:
+            index = index_markdown(md_file.read_text())
+            codes.extend(index.blocks[m.owner].code for m in index.markers if m.owner is not None)
+
         print("Creating test data...")
-        test_files = create_test_data(work_dir)
-        print(f"  Created test BAM: {test_files['input.bam']}\n")
+        test_files = create_test_data(work_dir, placeholders=referenced_placeholders(codes))
+        print(f"  Created test data for: {', '.join(sorted(test_files))}\n")
 
         total_replacements = 0
         all_success = True
@@ -1,14 +1,44 @@
 #!/usr/bin/env python3
 # Generates Python API documentation from pynanalogue docstrings.
 # Creates src/all_python_functions.md with all function documentation.
-
+#
+# Members are first described as plain data (signatures and docstrings),
+# optionally in a subprocess with a timeout (--subprocess), and then
+# rendered. Rendered pages are cached in .cache/python_docs, keyed on the
+# installed pynanalogue (version and the file hashes of its wheel) and the
+# source of the formatter functions, so an unchanged install is not even
+# imported. When the install changes, only members whose description
+# changed are rendered again, and the page is only written if it differs.
+
+import argparse
+import hashlib
 import inspect
+import json
+import subprocess
 import sys
+from importlib import metadata
 from pathlib import Path
 
+from block_cache import atomic_write_bytes, file_digest
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+CACHE_DIR = REPO_ROOT / ".cache" / "python_docs"
+SECTIONS_PATH = CACHE_DIR / "sections.json"
+INTROSPECT_TIMEOUT_SECONDS = 120
+PAGE_HEADER = [
+    "# pynanalogue Python API Reference",
+    "",
+    "> **Note**: This file is auto-generated.",
+    "",
+]
+
 
-def format_signature(name, sig):
-    """Format a function signature with proper line breaks for readability."""
+def format_signature(name, sig, params):
+    """Format a function signature with proper line breaks for readability.
+
+    sig is the signature as text and params the text of each parameter,
+    or None if they could not be listed.
+    """
     sig_str = f"{name}{sig}"
 
     # If signature is short enough, return as-is
@@ -16,13 +46,6 @@ def format_signature(name, sig):
         return sig_str
 
     # For long signatures, format with line breaks after each parameter
-    params = []
-    try:
-        for param in sig.parameters.values():
-            params.append(str(param))
-    except Exception:
-        return sig_str
-
     if not params:
         return sig_str
 
@@ -146,6 +169,36 @@ def format_docstring(docstring):
     return "\n".join(result_lines)
 
 
+def describe_callable(func):
+    """Describe a function's signature and docstring as plain data."""
+    description = {'signature': None, 'params': None, 'doc': inspect.getdoc(func)}
+    try:
+        sig = inspect.signature(func)
+    except Exception:
+        # Some built-in functions don't have signatures
+        return description
+    description['signature'] = str(sig)
+    try:
+        description['params'] = [str(param) for param in sig.parameters.values()]
+    except Exception:
+        pass
+    return description
+
+
+def describe_member(name, obj):
+    """Describe a public function or class as plain data for the formatters."""
+    if not inspect.isclass(obj):
+        return {'name': name, 'kind': 'function', **describe_callable(obj)}
+
+    # Only include public methods
+    methods = [
+        {'name': method_name, **describe_callable(method)}
+        for method_name, method in inspect.getmembers(obj, predicate=inspect.isfunction)
+        if not method_name.startswith('_')
+    ]
+    return {'name': name, 'kind': 'class', 'doc': inspect.getdoc(obj), 'methods': methods}
+
+
 def get_all_members(module):
     """Get all public functions and classes from a module."""
     members = []
@@ -168,22 +221,18 @@ def get_all_members(module):
 
 
 def format_function_docs(name, func):
-    """Format function documentation as markdown."""
+    """Format function documentation as markdown from its description."""
     lines = [f"## `{name}`", ""]
 
     # Add signature
-    try:
-        sig = inspect.signature(func)
+    if func['signature'] is not None:
         lines.append("```python")
-        lines.append(format_signature(name, sig))
+        lines.append(format_signature(name, func['signature'], func['params']))
         lines.append("```")
         lines.append("")
-    except Exception:
-        # Some built-in functions don't have signatures
-        pass
 
     # Add docstring
-    docstring = inspect.getdoc(func)
+    docstring = func['doc']
     if docstring:
         formatted_doc = format_docstring(docstring)
         lines.append(formatted_doc)
@@ -196,40 +245,33 @@ def format_function_docs(name, func):
 
 
 def format_class_docs(name, cls):
-    """Format class documentation as markdown."""
+    """Format class documentation as markdown from its description."""
     lines = [f"## `{name}` (class)", ""]
 
     # Add docstring
-    docstring = inspect.getdoc(cls)
+    docstring = cls['doc']
     if docstring:
         lines.append(docstring)
         lines.append("")
 
-    # Add methods (only include public methods)
-    methods = []
-    for method_name, method in inspect.getmembers(cls, predicate=inspect.isfunction):
-        if not method_name.startswith('_'):
-            methods.append((method_name, method))
-
+    methods = cls['methods']
     if methods:
         lines.append("### Methods")
         lines.append("")
-        for method_name, method in sorted(methods):
+        for method in sorted(methods, key=lambda m: m['name']):
+            method_name = method['name']
             # Indent method docs to show hierarchy
             lines.extend([f"#### `{method_name}`", ""])
 
             # Add signature
-            try:
-                sig = inspect.signature(method)
+            if method['signature'] is not None:
                 lines.append("```python")
-                lines.append(format_signature(method_name, sig))
+                lines.append(format_signature(method_name, method['signature'], method['params']))
                 lines.append("```")
                 lines.append("")
-            except Exception:
-                pass
 
             # Add docstring
-            method_doc = inspect.getdoc(method)
+            method_doc = method['doc']
             if method_doc:
                 formatted_doc = format_docstring(method_doc)
                 lines.append(formatted_doc)
@@ -241,63 +283,204 @@ def format_class_docs(name, cls):
     return lines
 
 
-def main():
-    """Generate Python API documentation."""
-    output_file = Path(__file__).parent.parent / "src" / "all_python_functions.md"
+FORMATTERS = [format_signature, escape_markdown_brackets, format_docstring,
+              format_function_docs, format_class_docs]
+
+
+def formatter_hash():
+    """Hash the source of the functions that turn descriptions into markdown."""
+    digest = hashlib.sha256()
+    for formatter in FORMATTERS:
+        digest.update(inspect.getsource(formatter).encode())
+    digest.update(json.dumps(PAGE_HEADER).encode())
+    return digest.hexdigest()
 
-    print("Generating Python API documentation...")
 
-    # Import pynanalogue
+def install_fingerprint():
+    """Describe the installed pynanalogue without importing it, or None.
+
+    Uses the version and the RECORD file of the installed wheel, which
+    lists a hash of every file in it.
+    """
     try:
-        print("  Importing pynanalogue...")
-        import pynanalogue
-    except ImportError as e:
-        print(f"Error: Could not import pynanalogue: {e}", file=sys.stderr)
-        print("Make sure pynanalogue is installed: pip install pynanalogue", file=sys.stderr)
-        return 1
+        dist = metadata.distribution('pynanalogue')
+    except metadata.PackageNotFoundError:
+        return None
+    return f"{dist.version}\n{dist.read_text('RECORD') or ''}"
 
-    # Build markdown content
-    markdown_lines = [
-        "# pynanalogue Python API Reference",
-        "",
-        "> **Note**: This file is auto-generated.",
-        "",
-    ]
 
-    # Get all members
-    print("  Discovering functions and classes...")
+def page_cache_path(fingerprint, formatters):
+    """Where the page rendered for an install and formatter version is cached.
+
+    A cached page is used without importing pynanalogue, so the key also
+    covers this script, whose describe_* functions decide what the page
+    holds.
+    """
+    digest = hashlib.sha256()
+    for part in (fingerprint, formatters, file_digest(Path(__file__))):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    return CACHE_DIR / "pages" / f"{digest.hexdigest()}.md"
+
+
+def describe_module():
+    """Import pynanalogue and describe its public members, sorted by kind and name.
+
+    Raises ImportError if pynanalogue cannot be imported.
+    """
+    import pynanalogue
+
     members = get_all_members(pynanalogue)
+    functions = sorted((n, o) for n, o in members if inspect.isfunction(o) or inspect.isbuiltin(o))
+    classes = sorted((n, o) for n, o in members if inspect.isclass(o))
+    return [describe_member(name, obj) for name, obj in functions + classes]
+
+
+def describe_in_subprocess(timeout):
+    """Run describe_module() in a child interpreter, giving up after timeout seconds.
+
+    Raises RuntimeError if the child fails, times out or prints something
+    other than the JSON descriptions.
+    """
+    try:
+        result = subprocess.run(
+            [sys.executable, str(Path(__file__).resolve()), '--describe'],
+            capture_output=True,
+            text=True,
+            timeout=timeout
+        )
+    except subprocess.TimeoutExpired:
+        raise RuntimeError(f"Introspecting pynanalogue timed out after {timeout:g} seconds")
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip() or f"exit status {result.returncode}")
+    try:
+        return json.loads(result.stdout)
+    except ValueError as e:
+        raise RuntimeError(f"Could not parse the member descriptions: {e}") from None
+
+
+def member_digest(description):
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
 
-    # Separate functions and classes
-    functions = [(n, o) for n, o in members if inspect.isfunction(o) or inspect.isbuiltin(o)]
-    classes = [(n, o) for n, o in members if inspect.isclass(o)]
 
+def load_sections(formatters):
+    """Load the cached rendered sections, if rendered by the same formatters."""
+    try:
+        cached = json.loads(SECTIONS_PATH.read_text())
+    except (OSError, ValueError):
+        return {}
+    if cached.get('formatters') != formatters:
+        return {}
+    return cached.get('sections', {})
+
+
+def render_page(descriptions, sections):
+    """Render the page, reusing sections of members whose description is unchanged.
+
+    sections maps member digests to rendered markdown; it is updated to
+    hold exactly the members on the page. Returns (markdown, number of
+    members rendered again).
+    """
+    functions = [d for d in descriptions if d['kind'] == 'function']
+    classes = [d for d in descriptions if d['kind'] == 'class']
     print(f"  Found {len(functions)} functions and {len(classes)} classes")
 
-    # Add functions section
-    if functions:
-        markdown_lines.append("# Functions")
-        markdown_lines.append("")
-        for name, func in sorted(functions):
-            print(f"  Documenting function '{name}'...")
-            markdown_lines.extend(format_function_docs(name, func))
+    # Build markdown content
+    markdown_lines = list(PAGE_HEADER)
+    used = {}
+    rendered = 0
 
-    # Add classes section
-    if classes:
-        markdown_lines.append("# Classes")
+    for title, group in (("Functions", functions), ("Classes", classes)):
+        if not group:
+            continue
+        markdown_lines.append(f"# {title}")
         markdown_lines.append("")
-        for name, cls in sorted(classes):
-            print(f"  Documenting class '{name}'...")
-            markdown_lines.extend(format_class_docs(name, cls))
+        for description in group:
+            digest = member_digest(description)
+            if digest not in sections:
+                print(f"  Documenting {description['kind']} '{description['name']}'...")
+                formatter = format_class_docs if description['kind'] == 'class' else format_function_docs
+                sections[digest] = "\n".join(formatter(description['name'], description))
+                rendered += 1
+            used[digest] = sections[digest]
+            markdown_lines.append(used[digest])
 
     # Handle case where no functions or classes found
     if not functions and not classes:
         markdown_lines.append("*No public functions or classes found.*")
         markdown_lines.append("")
 
+    sections.clear()
+    sections.update(used)
+    return "\n".join(markdown_lines), rendered
+
+
+def parse_args():
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Generate the pynanalogue API reference')
+    parser.add_argument('--subprocess', action='store_true',
+                        help='Import and introspect pynanalogue in a child process, '
+                             'so that a hanging import cannot hang the build')
+    parser.add_argument('--timeout', type=float, default=INTROSPECT_TIMEOUT_SECONDS,
+                        metavar='SECONDS',
+                        help='Time limit for --subprocess introspection (default: 120)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Introspect and render every member again')
+    # Used by --subprocess: print the member descriptions as JSON
+    parser.add_argument('--describe', action='store_true', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    """Generate Python API documentation."""
+    args = parse_args()
+
+    if args.describe:
+        json.dump(describe_module(), sys.stdout)
+        return 0
+
+    output_file = REPO_ROOT / "src" / "all_python_functions.md"
+
+    print("Generating Python API documentation...")
+
+    formatters = formatter_hash()
+    fingerprint = install_fingerprint()
+    cached_page = page_cache_path(fingerprint, formatters) if fingerprint is not None else None
+
+    if cached_page is not None and cached_page.exists() and not args.no_cache:
+        print(f"  Using cached reference for pynanalogue {fingerprint.split(chr(10))[0]}")
+        content = cached_page.read_text()
+    else:
+        # Import pynanalogue and describe its members
+        print("  Importing pynanalogue...")
+        try:
+            if args.subprocess:
+                descriptions = describe_in_subprocess(args.timeout)
+            else:
+                descriptions = describe_module()
+        except ImportError as e:
+            print(f"Error: Could not import pynanalogue: {e}", file=sys.stderr)
+            print("Make sure pynanalogue is installed: pip install pynanalogue", file=sys.stderr)
+            return 1
+        except RuntimeError as e:
+            print(f"Error: Could not introspect pynanalogue: {e}", file=sys.stderr)
+            return 1
+
+        sections = {} if args.no_cache else load_sections(formatters)
+        content, rendered = render_page(descriptions, sections)
+        print(f"  Rendered {rendered} of {len(descriptions)} members")
+        atomic_write_bytes(SECTIONS_PATH, json.dumps(
+            {'formatters': formatters, 'sections': sections}).encode())
+        if cached_page is not None:
+            atomic_write_bytes(cached_page, content.encode())
+
+    if output_file.exists() and output_file.read_text() == content:
+        print(f"✓ Python API documentation is up to date: {output_file}")
+        return 0
+
     # Write to file
     output_file.parent.mkdir(parents=True, exist_ok=True)
-    output_file.write_text("\n".join(markdown_lines))
+    output_file.write_text(content)
     print(f"✓ Generated Python API documentation: {output_file}")
 
     return 0
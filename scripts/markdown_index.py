@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Single-pass index of the structure of a markdown page.
+
+Walks the page once, line by line, and records:
+- fenced code blocks (```language ... ```) with their line numbers,
+- REPLACE tag regions and the replacement rules that apply to each block,
+- AUTO-GENERATED marker sections of any kind (AUTO-GENERATED,
+  AUTO-GENERATED-FULL, ...), the key=value options of their start tag
+  and the bash block each one documents,
+- BUDGET comments on the line before an opening fence, which state the
+  resources the block may use.
+
+The scripts in this directory share this index instead of running their
+own regular expressions over the page, which took time quadratic in the
+size of the page.
+"""
+
+import re
+from dataclasses import dataclass, field
+
+# Opening fence of an executable block: optional indent, ``` and a language
+FENCE_OPEN = re.compile(r'[ \t]*```(\w+)\n')
+# REPLACE tags, e.g. <!--REPLACE_CHR1_WITH_CONTIG_00001:START-->
+REPLACE_TAG = re.compile(r'<!--REPLACE_([^_]+)_WITH_([^:]+):(START|END)-->')
+# Start of any auto-generated section, with optional key=value options,
+# e.g. <!-- AUTO-GENERATED-BENCH:START runs=10 -->; the tag must end its line
+MARKER_START = re.compile(r'<!-- (AUTO-GENERATED[-A-Z]*):START((?: [a-z_]+=[^\s=]+)*) -->\n')
+# Resource budget of the next block, e.g. <!-- BUDGET seconds=30 rss_mb=512 -->
+BUDGET_COMMENT = re.compile(r'[ \t]*<!-- BUDGET((?: [a-z_]+=[^\s=]+)+) -->\n')
+
+
+@dataclass
+class FencedBlock:
+    """A fenced code block with a language tag."""
+    language: str
+    code: str
+    # 1-based line number of the opening fence
+    line_number: int
+    # Offsets of the opening fence line and just past the closing ```
+    start: int
+    end: int
+    # (from, to) rules of the REPLACE regions containing the block
+    replacements: list[tuple[str, str]] = field(default_factory=list)
+    # key=value options of a BUDGET comment on the line before the fence
+    budget: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class ReplaceRegion:
+    """A region between matching REPLACE start and end tags."""
+    start: int
+    end: int
+    from_str: str
+    to_str: str
+
+
+@dataclass
+class MarkerSection:
+    """An auto-generated section between START and END marker comments."""
+    # Marker name, e.g. AUTO-GENERATED or AUTO-GENERATED-FULL
+    name: str
+    line_number: int
+    # Offset of the start tag, of the body, of the end tag and past the end tag
+    start: int
+    body_start: int
+    body_end: int
+    end: int
+    # Index into MarkdownIndex.blocks of the last bash block above the marker
+    owner: int | None
+    # key=value options given in the start tag
+    options: dict[str, str] = field(default_factory=dict)
+
+    @property
+    def start_tag(self) -> str:
+        """The start tag without its options."""
+        return f'<!-- {self.name}:START -->'
+
+    @property
+    def end_tag(self) -> str:
+        return f'<!-- {self.name}:END -->'
+
+
+@dataclass
+class MarkdownIndex:
+    """Everything the scripts need to know about the layout of a page."""
+    blocks: list[FencedBlock]
+    replace_regions: list[ReplaceRegion]
+    markers: list[MarkerSection]
+
+
+@dataclass
+class _OpenRegion:
+    start: int
+    from_str: str
+    to_str: str
+    blocks: list[FencedBlock] = field(default_factory=list)
+
+
+def split_lines(content: str) -> list[str]:
+    """Split content into lines at '\n' only, keeping the line endings."""
+    lines = [line + '\n' for line in content.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines
+
+
+def index_markdown(content: str) -> MarkdownIndex:
+    """Build the index of a page in one pass over its lines."""
+    blocks: list[FencedBlock] = []
+    regions: list[ReplaceRegion] = []
+    markers: list[MarkerSection] = []
+
+    open_regions: dict[tuple[str, str], _OpenRegion] = {}
+    # Sections waiting for their end tag: name -> (line, start, body_start, owner, options)
+    open_markers: dict[str, tuple[int, int, int, int | None, dict[str, str]]] = {}
+    # Block whose closing fence has not been seen yet, and where its code starts
+    open_block: FencedBlock | None = None
+    code_start = 0
+    last_bash: int | None = None
+    # Options of a BUDGET comment on the previous line
+    budget: dict[str, str] = {}
+
+    offset = 0
+    for line_number, line in enumerate(split_lines(content), start=1):
+        line_start = offset
+        offset += len(line)
+
+        # Fenced code blocks
+        if open_block is not None:
+            if line.lstrip(' \t').startswith('```'):
+                open_block.code = content[code_start:line_start]
+                open_block.end = line_start + line.index('```') + 3
+                blocks.append(open_block)
+                if open_block.language == 'bash':
+                    last_bash = len(blocks) - 1
+                open_block = None
+        else:
+            match = FENCE_OPEN.match(line)
+            if match:
+                open_block = FencedBlock(match.group(1), '', line_number, line_start, -1,
+                                         budget=budget)
+                code_start = offset
+                # Rules are attached once the region's END tag is found
+                for region in open_regions.values():
+                    region.blocks.append(open_block)
+
+        match = BUDGET_COMMENT.match(line) if open_block is None else None
+        budget = dict(option.split('=') for option in match.group(1).split()) if match else {}
+
+        # REPLACE regions
+        if '<!--REPLACE_' in line:
+            for match in REPLACE_TAG.finditer(line):
+                key = (match.group(1), match.group(2))
+                if match.group(3) == 'START':
+                    open_regions.setdefault(key, _OpenRegion(line_start + match.start(), *key))
+                elif key in open_regions:
+                    region = open_regions.pop(key)
+                    regions.append(ReplaceRegion(region.start, line_start + match.end(), *key))
+                    for block in region.blocks:
+                        block.replacements.append(key)
+
+        # Auto-generated sections
+        if 'AUTO-GENERATED' in line:
+            for name, (marker_line, start, body_start, owner, options) in list(open_markers.items()):
+                end_tag = f'<!-- {name}:END -->'
+                position = line.find(end_tag, max(body_start - line_start, 0))
+                if position >= 0:
+                    del open_markers[name]
+                    markers.append(MarkerSection(
+                        name=name,
+                        line_number=marker_line,
+                        start=start,
+                        body_start=body_start,
+                        body_end=line_start + position,
+                        end=line_start + position + len(end_tag),
+                        owner=owner,
+                        options=options,
+                    ))
+
+            match = MARKER_START.search(line)
+            if match and match.group(1) not in open_markers:
+                options = dict(option.split('=') for option in match.group(2).split())
+                open_markers[match.group(1)] = (
+                    line_number, line_start + match.start(), offset, last_bash, options
+                )
+
+    markers.sort(key=lambda m: m.start)
+    return MarkdownIndex(blocks=blocks, replace_regions=regions, markers=markers)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+Bounded, streaming capture of the output of code blocks.
+
+Blocks can print far more than anyone reads: an AUTO-GENERATED section
+keeps 5 lines, yet `nanalogue read-info --detailed-pretty` on a large BAM
+prints hundreds of MB. Output is therefore read incrementally as the
+child writes it, and only a bounded part is kept: the first lines of
+stdout and the last bytes of stderr. The size and sha256 of the whole
+stream are still recorded.
+"""
+
+import hashlib
+import os
+import selectors
+import signal
+import subprocess
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+# Most of stderr that is kept; the end is kept, as that is where errors are
+STDERR_LIMIT_BYTES = 64 * 1024
+# Most of stdout kept when lines are limited, in case a line never ends
+HEAD_LIMIT_BYTES = 1024 * 1024
+CHUNK_SIZE = 1 << 16
+# How long to keep reading after the child exits, if something it started
+# in the background still holds its output open
+DRAIN_SECONDS = 1.0
+
+
+@dataclass
+class CapturedOutput:
+    """The kept part of an output stream and a summary of all of it."""
+    text: str
+    total_bytes: int = 0
+    sha256: str = ''
+    # True if anything other than trailing whitespace was dropped
+    truncated: bool = False
+
+
+def decode(data: bytes) -> str:
+    """Decode output the way text-mode pipes do, with universal newlines."""
+    return data.decode(errors='replace').replace('\r\n', '\n').replace('\r', '\n')
+
+
+class StreamCapture:
+    """Hash and count a stream; subclasses decide what to keep."""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.total_bytes = 0
+        self.kept = bytearray()
+        self.truncated = False
+
+    def feed(self, data: bytes) -> None:
+        self.digest.update(data)
+        self.total_bytes += len(data)
+        self.keep(data)
+
+    def keep(self, data: bytes) -> None:
+        self.kept += data
+
+    def result(self) -> CapturedOutput:
+        return CapturedOutput(decode(bytes(self.kept)), self.total_bytes,
+                              self.digest.hexdigest(), self.truncated)
+
+
+class HeadCapture(StreamCapture):
+    """Keep the first max_lines lines of a stream, or all of it if None.
+
+    Leading whitespace is not counted, and one line beyond max_lines is
+    kept, so that formatting the kept text with format_output() gives the
+    same result as formatting the whole stream.
+    """
+
+    def __init__(self, max_lines: int | None):
+        super().__init__()
+        self.max_lines = max_lines
+        self.lines = 0
+        self.started = False
+        self.full = False
+
+    def keep(self, data: bytes) -> None:
+        if self.max_lines is None:
+            self.kept += data
+            return
+        if self.full:
+            self.truncated = self.truncated or bool(data.strip())
+            return
+
+        pos = 0
+        if not self.started:
+            stripped = data.lstrip()
+            if not stripped:
+                self.kept += data
+                return
+            self.started = True
+            pos = len(data) - len(stripped)
+
+        limit = self.max_lines + 1
+        end = len(data)
+        while self.lines < limit:
+            newline = data.find(b'\n', pos)
+            if newline < 0:
+                break
+            self.lines += 1
+            pos = newline + 1
+            if self.lines == limit:
+                end = pos
+
+        room = HEAD_LIMIT_BYTES - len(self.kept)
+        if end > room:
+            end = room
+            self.full = True
+        self.kept += data[:end]
+        if self.lines >= limit:
+            self.full = True
+        if self.full:
+            self.truncated = bool(data[end:].strip())
+
+
+class TailCapture(StreamCapture):
+    """Keep the last max_bytes bytes of a stream."""
+
+    def __init__(self, max_bytes: int = STDERR_LIMIT_BYTES):
+        super().__init__()
+        self.max_bytes = max_bytes
+
+    def keep(self, data: bytes) -> None:
+        self.kept += data
+        # Trim now and then rather than on every chunk
+        if len(self.kept) > 2 * self.max_bytes:
+            del self.kept[:-self.max_bytes]
+
+    def result(self) -> CapturedOutput:
+        if len(self.kept) > self.max_bytes:
+            del self.kept[:-self.max_bytes]
+        self.truncated = self.total_bytes > len(self.kept)
+        return super().result()
+
+
+def capture_file(path: Path, capture: StreamCapture) -> CapturedOutput:
+    """Feed a file that a child wrote its output to through capture."""
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                capture.feed(chunk)
+    except FileNotFoundError:
+        pass
+    return capture.result()
+
+
+def kill_group(pgid: int) -> None:
+    """Kill a process group, ignoring one that has already gone."""
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def stream_process(process: subprocess.Popen, timeout: float, stdout: StreamCapture,
+                   stderr: StreamCapture):
+    """Feed a child's stdout and stderr pipes through captures until it exits.
+
+    The child must lead its own process group, which is killed on timeout.
+    The timeout also covers reading what is left in the pipes after the
+    child exits: a background process that keeps them open and keeps
+    writing is killed along with the rest of the group when it runs out.
+    Returns (returncode, timed_out, usage) like wait_with_timeout.
+    """
+    deadline = time.monotonic() + timeout
+    captures = {process.stdout: stdout, process.stderr: stderr}
+    status = None
+    usage = None
+    timed_out = False
+    exited_at = 0.0
+
+    with selectors.DefaultSelector() as selector:
+        for pipe in captures:
+            os.set_blocking(pipe.fileno(), False)
+            selector.register(pipe, selectors.EVENT_READ)
+
+        while selector.get_map():
+            ready = selector.select(0.05)
+            for key, _ in ready:
+                data = os.read(key.fd, CHUNK_SIZE)
+                if data:
+                    captures[key.fileobj].feed(data)
+                else:
+                    selector.unregister(key.fileobj)
+
+            now = time.monotonic()
+            if status is None:
+                done, wait_status, wait_usage = os.wait4(process.pid, os.WNOHANG)
+                if done:
+                    status, usage, exited_at = wait_status, wait_usage, now
+                elif now >= deadline:
+                    kill_group(process.pid)
+                    _, status, usage = os.wait4(process.pid, 0)
+                    timed_out = True
+                    exited_at = now
+            elif not ready and now - exited_at > DRAIN_SECONDS:
+                break
+            elif now >= deadline:
+                kill_group(process.pid)
+                timed_out = True
+                break
+
+    if status is None:
+        _, status, usage = os.wait4(process.pid, 0)
+    returncode = os.waitstatus_to_exitcode(status)
+    # Already reaped; stop Popen from waiting for it again
+    process.returncode = returncode
+    process.stdout.close()
+    process.stderr.close()
+    return returncode, timed_out, usage
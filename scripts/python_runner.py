@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+Warm, pre-imported Python interpreters for running python code blocks.
+
+Starting `python -c` for every block pays for interpreter startup and for
+importing pynanalogue, matplotlib, polars and numpy each time. Instead, a
+small number of server processes import them once and then fork an
+isolated child per block. The child behaves like `python -c CODE`: it runs
+in the requested working directory with a fresh `__main__` namespace,
+uncaught exceptions print a traceback and exit with status 1, and
+`sys.exit()` is honoured. stdout and stderr are captured to files.
+
+PythonSession runs the python blocks of one page in a single long-lived
+interpreter instead, executing them in order in one shared `__main__`
+namespace so that later blocks can use data loaded by earlier ones.
+
+The servers are started by WarmPythonPool and PythonSession and speak JSON
+lines over their stdin/stdout. Run this file with --serve or --session to
+start one by hand.
+"""
+
+import builtins
+import json
+import os
+import queue
+import random
+import resource
+import selectors
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from collections.abc import Callable
+from pathlib import Path
+
+from output_capture import CapturedOutput, HeadCapture, TailCapture, capture_file
+from resource_limits import apply_limits, limited_command
+from timing_report import ProcessStats
+
+# Heavy modules imported once by each server before forking. Submodules
+# that their packages load lazily are listed too, so that children do not
+# import them after their rlimits are set: each child reseeds numpy.random,
+# and pyplot loads the Agg backend on the first plot
+PRELOAD_MODULES = ['numpy', 'numpy.random', 'polars', 'matplotlib', 'matplotlib.pyplot',
+                   'matplotlib.backends.backend_agg', 'pynanalogue']
+
+
+class RunnerError(RuntimeError):
+    """A forked child could not be set up, so none of the block's code ran."""
+
+
+def preload() -> None:
+    """Import the modules that python blocks commonly use."""
+    # Blocks save figures to files; never try to open a display
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    for name in PRELOAD_MODULES:
+        try:
+            __import__(name)
+        except ImportError:
+            pass
+
+
+def exit_status(exc: SystemExit) -> int:
+    """Translate a SystemExit into an exit status the way the interpreter does."""
+    if exc.code is None:
+        return 0
+    if isinstance(exc.code, int):
+        return exc.code
+    print(exc.code, file=sys.stderr)
+    return 1
+
+
+def new_namespace() -> dict:
+    """Return a fresh `__main__` namespace."""
+    return {'__name__': '__main__', '__builtins__': builtins}
+
+
+def run_child(code: str, namespace: dict | None = None) -> int:
+    """Execute code as `python -c` would and return the exit status.
+
+    A namespace may be passed in to keep globals between calls.
+    """
+    sys.argv = ['-c']
+    if namespace is None:
+        namespace = new_namespace()
+    try:
+        exec(compile(code, '<string>', 'exec'), namespace)
+        return 0
+    except SystemExit as exc:
+        return exit_status(exc)
+    except BaseException as exc:
+        # Drop this frame so the traceback matches `python -c`
+        traceback.print_exception(type(exc), exc, exc.__traceback__.tb_next)
+        return 1
+
+
+def fork_block(request: dict) -> tuple[int, int]:
+    """Fork a child that runs one block.
+
+    Returns the child's pid and the read end of a pipe that carries the
+    traceback of any error in setting the child up, before the block's own
+    code runs. The child closes the pipe once it is set up.
+    """
+    setup_read, setup_write = os.pipe()
+    pid = os.fork()
+    if pid != 0:
+        os.close(setup_write)
+        return pid, setup_read
+
+    # Child: own process group so a timeout can kill anything it spawns
+    os.close(setup_read)
+    try:
+        os.setsid()
+        # Forked children would otherwise share the parent's random state.
+        # Reseed before the rlimits, which must only constrain the block
+        random.seed()
+        if 'numpy.random' in sys.modules:
+            sys.modules['numpy.random'].seed()
+        # rlimits of a block with a resource budget
+        apply_limits(request.get('limits', {}))
+        os.chdir(request['cwd'])
+        stdin = os.open(os.devnull, os.O_RDONLY)
+        stdout = os.open(request['stdout_path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        stderr = os.open(request['stderr_path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        os.dup2(stdin, 0)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        sys.path[0] = ''
+    except BaseException:
+        try:
+            os.write(setup_write, traceback.format_exc().encode())
+        finally:
+            os._exit(1)
+    os.close(setup_write)
+
+    status = 1
+    try:
+        status = run_child(request['code'])
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status)
+
+
+def wait_with_timeout(pid: int, timeout: float) -> tuple[int, bool, resource.struct_rusage]:
+    """Wait for a child, killing its process group on timeout.
+
+    Returns (returncode, timed_out, usage), the last being the resources
+    used by the child and the children it waited for.
+    """
+    deadline = time.monotonic() + timeout
+    delay = 0.001
+    timed_out = False
+    while True:
+        done, status, usage = os.wait4(pid, os.WNOHANG)
+        if done:
+            break
+        if time.monotonic() >= deadline:
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            _, status, usage = os.wait4(pid, 0)
+            timed_out = True
+            break
+        time.sleep(delay)
+        delay = min(delay * 2, 0.01)
+    return os.waitstatus_to_exitcode(status), timed_out, usage
+
+
+def cpu_seconds() -> tuple[float, float]:
+    """User and system CPU seconds used so far by this process and its children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + children.ru_utime, own.ru_stime + children.ru_stime
+
+
+def serve() -> int:
+    """Serve block requests read as JSON lines from stdin."""
+    # Keep the protocol channel private; anything printed by imports goes to stderr
+    protocol = os.fdopen(os.dup(1), 'w')
+    os.dup2(2, 1)
+
+    preload()
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        start = time.monotonic()
+        pid, setup_pipe = fork_block(request)
+        # The child leads its own process group; tell the client so it can kill it
+        protocol.write(json.dumps({'started': pid}) + '\n')
+        protocol.flush()
+        returncode, timed_out, usage = wait_with_timeout(pid, request['timeout'])
+        with os.fdopen(setup_pipe) as setup:
+            setup_error = setup.read()
+        protocol.write(json.dumps({'returncode': returncode, 'timed_out': timed_out,
+                                   'wall': time.monotonic() - start,
+                                   'user': usage.ru_utime, 'sys': usage.ru_stime,
+                                   'maxrss': usage.ru_maxrss,
+                                   'setup_error': setup_error}) + '\n')
+        protocol.flush()
+
+    return 0
+
+
+def serve_session() -> int:
+    """Serve block requests from stdin in one process with shared globals."""
+    # Blocks run in this process, so keep both protocol channels away from them
+    requests = os.fdopen(os.dup(0), 'r')
+    protocol = os.fdopen(os.dup(1), 'w')
+    os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+    os.dup2(2, 1)
+    saved_stdout = os.dup(1)
+    saved_stderr = os.dup(2)
+    sys.path[0] = ''
+
+    preload()
+    namespace = new_namespace()
+
+    for line in requests:
+        request = json.loads(line)
+        stdout = os.open(request['stdout_path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        stderr = os.open(request['stderr_path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        os.dup2(stdout, 1)
+        os.dup2(stderr, 2)
+        os.close(stdout)
+        os.close(stderr)
+        start = time.monotonic()
+        before = cpu_seconds()
+        try:
+            returncode = run_child(request['code'], namespace)
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_stdout, 1)
+            os.dup2(saved_stderr, 2)
+        user, system = (after - start for after, start in zip(cpu_seconds(), before))
+        # The session's peak so far, which earlier blocks may have set
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        protocol.write(json.dumps({'returncode': returncode, 'timed_out': False,
+                                   'wall': time.monotonic() - start,
+                                   'user': user, 'sys': system, 'maxrss': maxrss}) + '\n')
+        protocol.flush()
+
+    return 0
+
+
+def send_request(process: subprocess.Popen, code: str, request: dict,
+                 timeout: float | None = None,
+                 on_start: Callable[[int], None] | None = None,
+                 max_lines: int | None = None
+                 ) -> tuple[bool | None, CapturedOutput, str, dict]:
+    """Send one block to a server process and return (success, stdout, stderr, response).
+
+    Output is captured through files in a temporary directory, which are
+    read back in chunks: only the first max_lines lines of stdout (all of
+    it if None) and the end of stderr are kept. success is None (and
+    response empty) if no reply arrives within timeout. response holds the
+    server's returncode, the CPU seconds the block used and its peak RSS.
+    If the server reports the process group the block started in, on_start
+    is called with it. Raises RunnerError if the child running the block
+    could not be set up.
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        stdout_path = Path(tmpdir) / 'stdout'
+        stderr_path = Path(tmpdir) / 'stderr'
+        request = {
+            **request,
+            'code': code,
+            'stdout_path': str(stdout_path),
+            'stderr_path': str(stderr_path),
+        }
+        process.stdin.write(json.dumps(request) + '\n')
+        process.stdin.flush()
+
+        if timeout is not None:
+            with selectors.DefaultSelector() as selector:
+                selector.register(process.stdout, selectors.EVENT_READ)
+                if not selector.select(timeout):
+                    return None, CapturedOutput(''), '', {}
+
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError('Python server exited unexpectedly')
+            response = json.loads(line)
+            if 'started' not in response:
+                break
+            if on_start is not None:
+                on_start(response['started'])
+        if response.get('setup_error'):
+            raise RunnerError(response['setup_error'])
+
+        stdout = capture_file(stdout_path, HeadCapture(max_lines))
+        stderr = capture_file(stderr_path, TailCapture()).text
+
+    if response['timed_out']:
+        return False, stdout, f"Command timed out after {request['timeout']:g} seconds", response
+    return response['returncode'] == 0, stdout, stderr, response
+
+
+def response_stats(response: dict, start: float) -> ProcessStats:
+    """Stats for a request sent at time.monotonic() == start.
+
+    The server's own wall time is used when it sent one, so that waiting
+    for a server to finish preloading is not counted. An empty response,
+    e.g. after a failure, has no CPU times or exit status.
+    """
+    maxrss = response.get('maxrss')
+    return ProcessStats(
+        wall_seconds=response.get('wall', time.monotonic() - start),
+        user_seconds=response.get('user', 0.0),
+        sys_seconds=response.get('sys', 0.0),
+        exit_status=response.get('returncode'),
+        timed_out=response.get('timed_out', False),
+        # ru_maxrss is in KiB on Linux
+        max_rss_mb=maxrss / 1024 if maxrss is not None else None,
+    )
+
+
+class WarmPythonServer:
+    """Client side of a single warm interpreter process."""
+
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), '--serve'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            # Out of the terminal's process group, so Ctrl-C is left to the client
+            start_new_session=True
+        )
+
+    def run(self, code: str, cwd: Path, timeout: float,
+            on_start: Callable[[int], None] | None = None,
+            max_lines: int | None = None,
+            limits: dict[str, int] | None = None
+            ) -> tuple[bool, CapturedOutput, str, ProcessStats]:
+        """Run code in a forked child and return (success, stdout, stderr, stats).
+
+        on_start is called with the child's process group id. The child
+        sets limits, rlimits by resource name, before running the code.
+        """
+        start = time.monotonic()
+        success, stdout, stderr, response = send_request(
+            self.process, code, {'cwd': str(cwd), 'timeout': timeout, 'limits': limits or {}},
+            on_start=on_start, max_lines=max_lines
+        )
+        return success, stdout, stderr, response_stats(response, start)
+
+    def close(self) -> None:
+        """Shut the server down."""
+        if self.process.stdin:
+            self.process.stdin.close()
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class WarmPythonPool:
+    """A pool of warm interpreters shared by worker threads.
+
+    Each server handles one block at a time; run() borrows an idle server,
+    starting a replacement if a server dies.
+    """
+
+    def __init__(self, size: int = 1):
+        self.idle: queue.Queue[WarmPythonServer] = queue.Queue()
+        for _ in range(size):
+            self.idle.put(WarmPythonServer())
+
+    def run(self, code: str, cwd: Path, timeout: float,
+            on_start: Callable[[int], None] | None = None,
+            max_lines: int | None = None,
+            limits: dict[str, int] | None = None
+            ) -> tuple[bool, CapturedOutput, str, ProcessStats]:
+        """Run code on an idle server and return (success, stdout, stderr, stats).
+
+        Raises RunnerError if the block's child could not be set up; the
+        server itself is still usable.
+        """
+        server = self.idle.get()
+        start = time.monotonic()
+        try:
+            return server.run(code, cwd, timeout, on_start, max_lines, limits)
+        except RunnerError:
+            raise
+        except (OSError, ValueError, RuntimeError) as e:
+            server.close()
+            server = WarmPythonServer()
+            return False, CapturedOutput(''), str(e), response_stats({}, start)
+        finally:
+            self.idle.put(server)
+
+    def close(self) -> None:
+        """Shut down every server in the pool."""
+        while not self.idle.empty():
+            self.idle.get().close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class PythonSession:
+    """One interpreter that runs a page's python blocks in a shared namespace.
+
+    A block that times out cannot be interrupted without losing the shared
+    state, so the whole session is killed and later blocks fail. limits,
+    rlimits by resource name, apply to the session as a whole.
+    """
+
+    def __init__(self, cwd: Path, limits: dict[str, int] | None = None):
+        self.process = subprocess.Popen(
+            limited_command([sys.executable, str(Path(__file__).resolve()), '--session'],
+                            limits or {}),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=cwd,
+            start_new_session=True
+        )
+        self.dead_reason: str | None = None
+
+    def run(self, code: str, timeout: float,
+            on_start: Callable[[int], None] | None = None,
+            max_lines: int | None = None
+            ) -> tuple[bool, CapturedOutput, str, ProcessStats]:
+        """Run code in the session and return (success, stdout, stderr, stats).
+
+        on_start is called with the session's process group id; killing
+        that group ends the whole session.
+        """
+        start = time.monotonic()
+        if self.dead_reason is not None:
+            return False, CapturedOutput(''), self.dead_reason, response_stats({}, start)
+        if on_start is not None:
+            on_start(self.process.pid)
+
+        try:
+            success, stdout, stderr, response = send_request(self.process, code, {}, timeout,
+                                                             max_lines=max_lines)
+        except (OSError, ValueError, RuntimeError) as e:
+            self.kill(f"Python session ended: {e}")
+            return False, CapturedOutput(''), str(e), response_stats({}, start)
+
+        if success is None:
+            self.kill("Python session was stopped after an earlier block timed out")
+            stats = response_stats({}, start)
+            stats.timed_out = True
+            return False, CapturedOutput(''), f"Command timed out after {timeout:g} seconds", stats
+        return success, stdout, stderr, response_stats(response, start)
+
+    def kill(self, reason: str) -> None:
+        """Kill the session and everything it started."""
+        self.dead_reason = reason
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def close(self) -> None:
+        """Shut the session down."""
+        if self.dead_reason is None:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.kill("Python session closed")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    modes = {'--serve': serve, '--session': serve_session}
+    if len(sys.argv) != 2 or sys.argv[1] not in modes:
+        print(f"Usage: {sys.argv[0]} --serve | --session", file=sys.stderr)
+        sys.exit(2)
+    sys.exit(modes[sys.argv[1]]())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Local HTTP stand-in for the remote BAM examples.
+
+The docs show nanalogue reading BAMs straight from a URL, with a region so
+that only part of the file is downloaded. Those examples point at
+https://example.com/..., so they are run against a server on 127.0.0.1
+instead. It serves a simulated BAM and its index with HTTP Range support,
+like the object stores that real remote BAMs live on.
+
+Each block gets its own URL prefix, and the server counts the requests and
+body bytes served under each prefix, so a block's traffic can be checked:
+a region query should fetch only a small part of the file. An artificial
+delay per request and a bandwidth cap can be set to see how the examples
+behave on a slow link.
+"""
+
+import re
+import threading
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from test_data import index_path, read_region_table
+
+# Remote BAM URLs in the docs that are served locally
+REMOTE_BAM_URL = re.compile(r'https?://example\.com/[^\s\'"]*\.bam\b')
+# Fixture served in place of every remote BAM
+REMOTE_PLACEHOLDER = 'large_input.bam'
+# Width of the fixture region that stands in for the regions of remote examples
+REMOTE_REGION_WIDTH = 5000
+# Most of the BAM a --region query may fetch, index and header included
+REGION_MAX_FRACTION = 0.25
+CHUNK_SIZE = 1 << 16
+RANGE_HEADER = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+@dataclass
+class RemoteTraffic:
+    """Requests made and body bytes served under one block's URL prefix."""
+    requests: int = 0
+    bytes_served: int = 0
+    # Size of the BAM that was served in place of the remote one
+    file_size: int = 0
+
+    @property
+    def fraction(self) -> float:
+        return self.bytes_served / self.file_size if self.file_size else 0.0
+
+
+def is_remote_block(code: str) -> bool:
+    """Check whether a block reads a remote BAM from a placeholder URL."""
+    return REMOTE_BAM_URL.search(code) is not None
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """Parse a Range header into (first, last) byte positions, both inclusive.
+
+    Returns None for no header, or one that is malformed or asks for several
+    ranges, in which case the whole file is sent. Raises ValueError if the
+    range lies beyond the end of the file.
+    """
+    match = RANGE_HEADER.match(header or '')
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        # A suffix: the last N bytes
+        return max(size - int(last), 0), size - 1
+    first = int(first)
+    last = size - 1 if last == '' else min(int(last), size - 1)
+    if first >= size:
+        raise ValueError(f"range starts at {first}, file has {size} bytes")
+    if first > last:
+        return None
+    return first, last
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """Serve GET and HEAD requests for /<client>/<name> with Range support."""
+    # Keep connections open between requests, as remote readers expect
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def respond(self, send_body: bool) -> None:
+        remote: RangeServer = self.server.remote
+        client, _, name = self.path.lstrip('/').partition('/')
+        remote.record(client)
+        if remote.delay:
+            time.sleep(remote.delay)
+
+        path = remote.resolve(name)
+        if path is None:
+            self.send_error(404)
+            return
+
+        size = path.stat().st_size
+        try:
+            byte_range = parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        first, last = byte_range if byte_range is not None else (0, size - 1)
+        self.send_response(200 if byte_range is None else 206)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(last - first + 1))
+        if byte_range is not None:
+            self.send_header('Content-Range', f'bytes {first}-{last}/{size}')
+        self.end_headers()
+        if send_body:
+            self.send_body(path, first, last - first + 1, client)
+
+    def send_body(self, path: Path, offset: int, length: int, client: str) -> None:
+        """Send part of a file, at no more than the server's bandwidth."""
+        remote: RangeServer = self.server.remote
+        chunk_size = CHUNK_SIZE
+        if remote.bandwidth:
+            # Small chunks keep the rate even
+            chunk_size = max(1024, min(CHUNK_SIZE, int(remote.bandwidth / 10)))
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while length > 0:
+                data = f.read(min(chunk_size, length))
+                if not data:
+                    break
+                try:
+                    self.wfile.write(data)
+                except ConnectionError:
+                    # Readers often hang up once they have what they need
+                    break
+                remote.record(client, len(data), request=False)
+                length -= len(data)
+                if remote.bandwidth:
+                    time.sleep(len(data) / remote.bandwidth)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class RangeServer:
+    """HTTP server on 127.0.0.1 serving files by name, with per-client accounting.
+
+    files maps the names that can be requested to their paths; it is looked
+    up on every request, so fixtures added to it later are served too. The
+    index of a served BAM is available under its name plus .bai or .csi.
+    delay is added to every request, in seconds, and bandwidth caps the
+    rate of each response, in bytes per second.
+    """
+
+    def __init__(self, files: Mapping[str, Path], delay: float = 0.0,
+                 bandwidth: float | None = None):
+        self.files = files
+        self.delay = delay
+        self.bandwidth = bandwidth
+        self._lock = threading.Lock()
+        self._traffic: dict[str, RemoteTraffic] = {}
+        self._clients = 0
+        self._httpd = None
+        self._thread = None
+
+    def __enter__(self):
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.remote = self
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def resolve(self, name: str) -> Path | None:
+        """Find the file served under name, if any."""
+        if name in self.files:
+            return self.files[name]
+        for suffix in ('.bai', '.csi'):
+            bam = self.files.get(name.removesuffix(suffix))
+            if name.endswith(suffix) and bam is not None:
+                index = index_path(bam)
+                if index is not None and index.name.endswith(suffix):
+                    return index
+        return None
+
+    def new_client(self) -> str:
+        """Allocate a URL prefix whose traffic is counted separately."""
+        with self._lock:
+            self._clients += 1
+            client = f'client{self._clients:04d}'
+            self._traffic[client] = RemoteTraffic()
+        return client
+
+    def record(self, client: str, bytes_served: int = 0, request: bool = True) -> None:
+        with self._lock:
+            traffic = self._traffic.setdefault(client, RemoteTraffic())
+            traffic.requests += request
+            traffic.bytes_served += bytes_served
+
+    def traffic(self, client: str, name: str = REMOTE_PLACEHOLDER) -> RemoteTraffic:
+        """Traffic of a client so far, relative to the size of the file name."""
+        with self._lock:
+            traffic = self._traffic.get(client, RemoteTraffic())
+            traffic = RemoteTraffic(traffic.requests, traffic.bytes_served)
+        path = self.files.get(name)
+        if path is not None:
+            traffic.file_size = path.stat().st_size
+        return traffic
+
+    def rewrite(self, code: str, client: str) -> str:
+        """Point the remote BAM URLs of a block at this server, under client.
+
+        Example regions such as chr17:43044295-43170245 are mapped onto a
+        region of the served fixture, from its region table.
+        """
+        code = REMOTE_BAM_URL.sub(f'{self.base_url}/{client}/{REMOTE_PLACEHOLDER}', code)
+        bam = self.files.get(REMOTE_PLACEHOLDER)
+        if bam is None:
+            return code
+        table = bam.with_name(bam.stem + '.regions.tsv')
+        regions = [row['region'] for row in read_region_table(table)
+                   if row['width'] == REMOTE_REGION_WIDTH]
+        if regions:
+            code = re.sub(r'chr\w+:\d+-\d+', regions[0], code)
+        return code
+
+
+def check_region_traffic(code: str, traffic: RemoteTraffic) -> str | None:
+    """Describe why a block's traffic is wrong for a region query, or None.
+
+    A region query must fetch something from the server, as one that does
+    not has read a local file or never reached the URL, and must fetch no
+    more than REGION_MAX_FRACTION of the BAM. Blocks without --region pass.
+    """
+    if '--region' not in code:
+        return None
+    if traffic.requests == 0:
+        return ("region query made no requests to the remote BAM server; "
+                "it must read the BAM from its URL")
+    if traffic.fraction <= REGION_MAX_FRACTION:
+        return None
+    return (f"region query fetched {traffic.bytes_served:,} bytes in {traffic.requests} "
+            f"request(s), {traffic.fraction:.0%} of the {traffic.file_size:,} byte BAM "
+            f"(at most {REGION_MAX_FRACTION:.0%} expected)")
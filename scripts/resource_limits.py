@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Resource budgets for code blocks, enforced with rlimits.
+
+Some recipes are meant for small cluster nodes. A block can state what it
+may use in a comment on the line before its opening fence:
+
+    <!-- BUDGET seconds=30 rss_mb=512 output_bytes=1000000 -->
+
+Each key is optional. The limits are set in the child that runs the block,
+so the kernel stops it from going far beyond them: seconds caps CPU time
+(RLIMIT_CPU) as well as being the block's wall-clock timeout, rss_mb caps
+the data segment (RLIMIT_DATA, which covers heap and anonymous mappings;
+Linux does not enforce RLIMIT_RSS) and output_bytes caps the size of files
+written (RLIMIT_FSIZE). After the run the measured wall time, peak RSS and
+stdout size are compared with the budget, and any excess fails the block.
+
+A memory limit for a whole run caps the address space of every block
+(RLIMIT_AS), as a batch scheduler's memory request would.
+
+Run this file with a JSON object of limits and a command to exec the
+command under those limits.
+"""
+
+import json
+import math
+import os
+import resource
+import signal
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+from timing_report import ProcessStats
+
+MIB = 1024 * 1024
+BUDGET_KEYS = ('seconds', 'rss_mb', 'output_bytes')
+
+
+@dataclass
+class Budget:
+    """The most a block may use; None means no limit."""
+    seconds: float | None = None
+    rss_mb: float | None = None
+    output_bytes: int | None = None
+
+    def __str__(self):
+        parts = []
+        if self.seconds is not None:
+            parts.append(f"{self.seconds:g} s")
+        if self.rss_mb is not None:
+            parts.append(f"{self.rss_mb:g} MB RSS")
+        if self.output_bytes is not None:
+            parts.append(f"{self.output_bytes:,} bytes of output")
+        return ', '.join(parts)
+
+
+def parse_budget(options: dict[str, str]) -> Budget:
+    """Build a budget from the key=value options of a BUDGET comment.
+
+    Raises ValueError for unknown keys and values that are not positive.
+    """
+    unknown = sorted(set(options) - set(BUDGET_KEYS))
+    if unknown:
+        raise ValueError(f"unknown budget key(s): {', '.join(unknown)} "
+                         f"(expected {', '.join(BUDGET_KEYS)})")
+    budget = Budget()
+    for key, value in options.items():
+        try:
+            number = int(value) if key == 'output_bytes' else float(value)
+        except ValueError:
+            raise ValueError(f"budget {key}={value} is not a number") from None
+        if number <= 0:
+            raise ValueError(f"budget {key}={value} must be positive")
+        setattr(budget, key, number)
+    return budget
+
+
+def child_limits(budget: Budget | None, memory_limit_mb: float | None) -> dict[str, int]:
+    """The rlimits, by resource name, that enforce a budget and a memory limit."""
+    limits = {}
+    if memory_limit_mb is not None:
+        limits['RLIMIT_AS'] = int(memory_limit_mb * MIB)
+    if budget is None:
+        return limits
+    if budget.seconds is not None:
+        # A second of slack, so the wall-clock timeout usually fires first
+        limits['RLIMIT_CPU'] = math.ceil(budget.seconds) + 1
+    if budget.rss_mb is not None:
+        limits['RLIMIT_DATA'] = int(budget.rss_mb * MIB)
+    if budget.output_bytes is not None:
+        limits['RLIMIT_FSIZE'] = budget.output_bytes
+    return limits
+
+
+def apply_limits(limits: dict[str, int]) -> None:
+    """Lower this process's rlimits; children inherit them.
+
+    A limit is never raised above an existing hard limit.
+    """
+    for name, value in limits.items():
+        kind = getattr(resource, name)
+        _, hard = resource.getrlimit(kind)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(kind, (value, value))
+
+
+def limited_command(command: list[str], limits: dict[str, int]) -> list[str]:
+    """Wrap a command so that it runs under limits, if there are any."""
+    if not limits:
+        return command
+    return [sys.executable, str(Path(__file__).resolve()), json.dumps(limits), *command]
+
+
+def budget_violations(budget: Budget, stats: ProcessStats, output_bytes: int) -> list[str]:
+    """Describe each part of a budget that a block exceeded."""
+    violations = []
+    if budget.seconds is not None and (stats.timed_out or stats.wall_seconds > budget.seconds):
+        violations.append(f"took {stats.wall_seconds:.2f} s, budget is {budget.seconds:g} s")
+    # Killed by SIGXCPU, either directly or as a command run by bash
+    if (budget.seconds is not None
+            and stats.exit_status in (-signal.SIGXCPU, 128 + signal.SIGXCPU)):
+        violations.append(f"killed for exceeding {budget.seconds:g} s of CPU time")
+    if (budget.rss_mb is not None and stats.max_rss_mb is not None
+            and stats.max_rss_mb > budget.rss_mb):
+        violations.append(f"peak RSS {stats.max_rss_mb:.1f} MB, budget is {budget.rss_mb:g} MB")
+    if budget.output_bytes is not None and output_bytes > budget.output_bytes:
+        violations.append(f"wrote {output_bytes:,} bytes to stdout, "
+                          f"budget is {budget.output_bytes:,}")
+    return violations
+
+
+def usage_summary(budget: Budget, stats: ProcessStats | None, output_bytes: int) -> str:
+    """Measured usage against each part of a budget, e.g. '1.2/30 s, 45/512 MB RSS'."""
+    if stats is None:
+        return f"budget {budget}"
+    parts = []
+    if budget.seconds is not None:
+        parts.append(f"{stats.wall_seconds:.2f}/{budget.seconds:g} s")
+    if budget.rss_mb is not None:
+        rss = '?' if stats.max_rss_mb is None else f"{stats.max_rss_mb:.1f}"
+        parts.append(f"{rss}/{budget.rss_mb:g} MB RSS")
+    if budget.output_bytes is not None:
+        parts.append(f"{output_bytes:,}/{budget.output_bytes:,} bytes")
+    return ', '.join(parts)
+
+
+if __name__ == '__main__':
+    apply_limits(json.loads(sys.argv[1]))
+    os.execvp(sys.argv[2], sys.argv[2:])
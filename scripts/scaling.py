@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Scaling exponents of code blocks across fixture sizes.
+
+The doc fixtures hold a few dozen reads, so a recipe whose run time grows
+with the square of the input looks as fast as a linear one. In a scaling
+run every block is run against fixtures with several multiples of their
+configured read count, and a straight line is fitted to log(run time)
+against log(reads). Its slope is the block's scaling exponent: about 1 for
+a block that reads its input once, 2 for one that is quadratic in it.
+
+At the configured size a block's time is almost all fixed cost, such as
+starting the interpreter or nanalogue, which would pull the slope towards
+0. So the time at the smallest scale is taken as the fixed cost, and the
+time above it is fitted at the other scales, leaving out those where it is
+under MIN_SECONDS and mostly noise. That needs at least three scales. A
+block is flagged when its exponent is above EXPONENT_LIMIT, when it failed
+at any size (e.g. timed out at a larger one), or when no exponent could be
+fitted, as its scaling was then never measured.
+"""
+
+import math
+from dataclasses import dataclass, field
+
+# Multiples of each fixture's read count that a scaling run uses by default
+DEFAULT_SCALES = (1.0, 10.0, 100.0)
+# Time above the fixed cost below which a size is too noisy to fit
+MIN_SECONDS = 0.05
+# Exponents above this count as super-linear; the margin above 1 absorbs noise
+EXPONENT_LIMIT = 1.2
+# The smallest scale is the fixed cost and a slope needs two more points
+MIN_SCALES = 3
+
+
+@dataclass
+class ScalingResult:
+    """Run times of one block at each scale, and what they say about it."""
+    label: str
+    # Wall seconds at each scale, None where the block failed or did not run
+    seconds: list[float | None] = field(default_factory=list)
+    # Last line of the error at each scale where the block failed, '' where it passed
+    errors: list[str] = field(default_factory=list)
+    exponent: float | None = None
+
+    def problem(self, scales: list[float]) -> str | None:
+        """Why this block scales badly, or could not be measured, or None."""
+        passed = [s is not None for s in self.seconds]
+        if not passed[0]:
+            return f"failed at {scales[0]:g}x: {self.errors[0]}"
+        for scale, ok, error in zip(scales, passed, self.errors):
+            if not ok:
+                return f"passed at {scales[0]:g}x but failed at {scale:g}x: {error}"
+        if self.exponent is None:
+            return (f"no exponent could be fitted: fewer than two larger sizes took "
+                    f"{MIN_SECONDS:g} s longer than at {scales[0]:g}x; try larger scales")
+        if self.exponent > EXPONENT_LIMIT:
+            return f"run time grows as reads^{self.exponent:.2f}"
+        return None
+
+
+def parse_scales(text: str) -> list[float]:
+    """Parse comma-separated multiples of the fixture read counts, e.g. '1,10,100'.
+
+    Raises ValueError unless there are at least MIN_SCALES distinct positive
+    scales.
+    """
+    try:
+        scales = sorted({float(scale) for scale in text.split(',')})
+    except ValueError:
+        raise ValueError(f"expected comma-separated numbers, not {text!r}") from None
+    if any(scale <= 0 for scale in scales):
+        raise ValueError("scales must be positive")
+    if len(scales) < MIN_SCALES:
+        raise ValueError(f"at least {MIN_SCALES} different scales are needed to fit an "
+                         f"exponent, as the smallest only gives the fixed cost")
+    return scales
+
+
+def fit_exponent(scales: list[float], seconds: list[float | None]) -> float | None:
+    """Least-squares slope of log(time above the fixed cost) against log(scale).
+
+    scales must be in increasing order. The time at the first scale is the
+    fixed cost. None if it failed there, or fewer than two other scales
+    have at least MIN_SECONDS above it.
+    """
+    fixed = seconds[0]
+    if fixed is None:
+        return None
+    points = [(math.log(scale), math.log(wall - fixed))
+              for scale, wall in zip(scales[1:], seconds[1:])
+              if wall is not None and wall - fixed >= MIN_SECONDS]
+    if len(points) < 2:
+        return None
+    mean_x = sum(x for x, _ in points) / len(points)
+    mean_y = sum(y for _, y in points) / len(points)
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+
+def print_scaling(results: list[ScalingResult], scales: list[float]) -> list[ScalingResult]:
+    """Print a table of run times and exponents; return the flagged blocks."""
+    header = ''.join(f"{f'{scale:g}x':>9}" for scale in scales)
+    print("\nRun time at each multiple of the fixture read counts:")
+    print(f"  {'exponent':>8}{header}  block")
+    flagged = []
+    ordered = sorted(results, key=lambda r: (r.exponent is None, -(r.exponent or 0), r.label))
+    for result in ordered:
+        exponent = '-' if result.exponent is None else f"{result.exponent:.2f}"
+        times = ''.join(f"{'fail' if wall is None else f'{wall:.2f}s':>9}"
+                        for wall in result.seconds)
+        problem = result.problem(scales)
+        mark = '  <-' if problem is not None else ''
+        print(f"  {exponent:>8}{times}  {result.label}{mark}")
+        if problem is not None:
+            flagged.append(result)
+
+    if flagged:
+        print(f"\n{len(flagged)} block(s) scale super-linearly, fail or could not be "
+              f"fitted (exponent limit {EXPONENT_LIMIT}):")
+        for result in flagged:
+            print(f"  {result.label}: {result.problem(scales)}")
+    else:
+        print(f"\nNo block scales worse than reads^{EXPONENT_LIMIT}")
+    return flagged
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Splitting the doc tests into shards that run on separate CI nodes.
+
+Pages are the unit of work: a page's python session, its AUTO-GENERATED
+sections and the files its blocks pass to each other all stay on one node.
+Pages whose blocks read files written on another page are kept together
+too. Each page is weighted by the expected time of its blocks, the median
+of their recent timings in the timing history, and the pages are dealt out
+longest first, each to the shard with the least work so far. Without any
+history every block counts the same, so shards get similar block counts.
+
+Every shard computes the same split from the same pages and history, and
+records a digest of it in its report. Merging the reports checks that the
+digests match and every shard is present, and that shards using the same
+fixture used identical files: simulation is not seeded, so shards only
+agree if they link their fixtures from one shared fixture cache.
+"""
+
+import hashlib
+import statistics
+from dataclasses import dataclass, field
+
+from block_graph import BlockGraph
+from timing_report import HISTORY_WINDOW
+
+
+@dataclass
+class ShardUnit:
+    """Pages that must run on the same shard, and their expected cost."""
+    pages: list[str]
+    weight: float
+
+
+@dataclass
+class ShardPlan:
+    """Pages of each shard, in shard order, with the expected cost of each shard."""
+    shards: list[list[str]]
+    estimates: list[float]
+    # False if no block had any timings, so weights are block counts
+    by_history: bool
+    blocks: list[int] = field(default_factory=list)
+
+    @property
+    def digest(self) -> str:
+        """Identify the split, so that shards can check they agree on it."""
+        digest = hashlib.sha256(str(len(self.shards)).encode())
+        for pages in self.shards:
+            digest.update(b'\0')
+            digest.update('\n'.join(pages).encode())
+        return digest.hexdigest()
+
+
+def parse_shard(text: str) -> tuple[int, int]:
+    """Parse 'i/N' into (i, N), where shards are numbered from 1.
+
+    Raises ValueError if text is not of that form or i is out of range.
+    """
+    index, slash, count = text.partition('/')
+    if not slash or not index.isdigit() or not count.isdigit():
+        raise ValueError(f"expected i/N, e.g. 1/4, not {text!r}")
+    index, count = int(index), int(count)
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError(f"shard {index}/{count} is out of range")
+    return index, count
+
+
+def block_estimates(keys: list[str], history: dict[str, list[float]]) -> tuple[list[float], bool]:
+    """Expected seconds of each block from the median of its recent timings.
+
+    Blocks without timings get the median of the blocks that have some.
+    Returns the estimates and whether any came from the history; if none
+    did, every block is estimated at one second.
+    """
+    medians = {key: statistics.median(history[key][-HISTORY_WINDOW:])
+               for key in keys if history.get(key)}
+    if not medians:
+        return [1.0] * len(keys), False
+    typical = statistics.median(medians.values())
+    return [medians.get(key, typical) for key in keys], True
+
+
+def group_pages(pages: list[str], block_pages: list[str], graph: BlockGraph) -> list[list[str]]:
+    """Group pages linked by a block on one reading a file written on another."""
+    parent = {page: page for page in pages}
+
+    def root(page: str) -> str:
+        while parent[page] != page:
+            parent[page] = parent[parent[page]]
+            page = parent[page]
+        return page
+
+    for block, depends_on in enumerate(graph.depends_on):
+        for producer in depends_on:
+            a, b = root(block_pages[block]), root(block_pages[producer])
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    groups: dict[str, list[str]] = {}
+    for page in pages:
+        groups.setdefault(root(page), []).append(page)
+    return list(groups.values())
+
+
+def plan_shards(pages: list[str], block_pages: list[str], block_keys: list[str],
+                graph: BlockGraph, history: dict[str, list[float]], count: int) -> ShardPlan:
+    """Split pages into count shards of similar expected run time.
+
+    block_pages and block_keys give the page and history key of each block
+    that will run, in the order of the graph's positions. Longest units
+    first, each unit goes to the shard with the least expected time so far,
+    the lowest-numbered one on a tie, so every shard computes the same plan.
+    """
+    estimates, by_history = block_estimates(block_keys, history)
+    page_weight = dict.fromkeys(pages, 0.0)
+    page_blocks = dict.fromkeys(pages, 0)
+    for page, estimate in zip(block_pages, estimates):
+        page_weight[page] += estimate
+        page_blocks[page] += 1
+
+    units = [ShardUnit(sorted(group), sum(page_weight[page] for page in group))
+             for group in group_pages(pages, block_pages, graph)]
+
+    plan = ShardPlan([[] for _ in range(count)], [0.0] * count, by_history, [0] * count)
+    for unit in sorted(units, key=lambda u: (-u.weight, u.pages)):
+        shard = min(range(count), key=lambda s: (plan.estimates[s], s))
+        plan.shards[shard].extend(unit.pages)
+        plan.estimates[shard] += unit.weight
+        plan.blocks[shard] += sum(page_blocks[page] for page in unit.pages)
+    for shard in plan.shards:
+        shard.sort()
+    return plan
+
+
+def check_shard_reports(infos: list[dict]) -> list[str]:
+    """Describe what is wrong with a set of partial reports, if anything.
+
+    infos are the 'shard' sections of the reports. They must all come from
+    the same plan, cover every shard exactly once and have used the same
+    contents for each fixture they share.
+    """
+    if not infos:
+        return ["no shard reports given"]
+    problems = []
+    count = infos[0]['count']
+    if any(info['count'] != count or info['plan'] != infos[0]['plan'] for info in infos):
+        problems.append("shards were split differently; each must see the same pages, "
+                        "options and timing history")
+
+    seen = [info['index'] for info in infos]
+    missing = sorted(set(range(1, count + 1)) - set(seen))
+    duplicated = sorted({index for index in seen if seen.count(index) > 1})
+    if missing:
+        problems.append(f"missing report(s) for shard {', '.join(f'{i}/{count}' for i in missing)}")
+    if duplicated:
+        problems.append(f"more than one report for shard "
+                        f"{', '.join(f'{i}/{count}' for i in duplicated)}")
+
+    fixtures: dict[str, set[str]] = {}
+    for info in infos:
+        for placeholder, digest in info.get('fixtures', {}).items():
+            fixtures.setdefault(placeholder, set()).add(digest)
+    differing = sorted(placeholder for placeholder, digests in fixtures.items()
+                       if len(digests) > 1)
+    if differing:
+        problems.append(f"shards used different {', '.join(differing)} fixtures; "
+                        f"share .cache/fixtures between them (see --build-fixtures)")
+    return problems
@@ -4,36 +4,59 @@ Strips auto-generated content from markdown files before commit.
 
 Replaces content between AUTO-GENERATED markers with placeholder text
 so that commits don't include regenerated output that changes frequently.
+Output sections are stripped when they hold a fenced block; benchmark
+sections (AUTO-GENERATED-BENCH) hold a table of timings, which changes on
+every run, and are always stripped.
+
+As a pre-commit hook it only looks at the markdown files under src/ that
+are staged, and works on their staged content, so unstaged edits are never
+committed or lost. Files without a marker are skipped after a byte scan.
+The stripped content is written to the index in one batch, and to the
+working tree too for files without unstaged changes. Every step is a
+single git call, however many pages the book has.
+
+Usage:
+    python strip_autogenerated.py          # pre-commit: staged files only
+    python strip_autogenerated.py --all    # strip every src/**/*.md in the working tree
 """
 
-import re
+import argparse
+import subprocess
 import sys
+import tempfile
 from pathlib import Path
 
-# Patterns for both regular and full auto-generated sections
-PATTERN = re.compile(
-    r'(<!-- AUTO-GENERATED(?:-FULL)?:START -->)\n'
-    r'```\n'
-    r'.*?'
-    r'```\n'
-    r'(<!-- AUTO-GENERATED(?:-FULL)?:END -->)',
-    re.DOTALL
-)
+from markdown_index import index_markdown
 
+REPO_ROOT = Path(__file__).parent.parent.resolve()
 PLACEHOLDER = '''```
 ...
 ```
 '''
+# Every marker starts with this; files without it need no parsing
+MARKER_BYTES = b'<!-- AUTO-GENERATED'
+# Sections filled with measurements rather than a fenced block of output
+BENCH_MARKER = 'AUTO-GENERATED-BENCH'
+STAGED_PAGES = ':(glob)src/**/*.md'
 
 
 def strip_autogenerated(content: str) -> str:
-    """Replace auto-generated sections with placeholder."""
-    def replacer(match):
-        start_marker = match.group(1)
-        end_marker = match.group(2)
-        return f'{start_marker}\n{PLACEHOLDER}{end_marker}'
+    """Replace the fenced body of every auto-generated section with placeholder."""
+    pieces = []
+    previous_end = 0
 
-    return PATTERN.sub(replacer, content)
+    for section in index_markdown(content).markers:
+        body = content[section.body_start:section.body_end]
+        # Only sections holding a ``` fenced block are stripped, and benchmarks
+        fenced = len(body) >= 8 and body.startswith('```\n') and body.endswith('```\n')
+        if not fenced and section.name != BENCH_MARKER:
+            continue
+        pieces.append(content[previous_end:section.body_start])
+        pieces.append(PLACEHOLDER)
+        previous_end = section.body_end
+
+    pieces.append(content[previous_end:])
+    return ''.join(pieces)
 
 
 def process_file(filepath: Path) -> bool:
@@ -47,9 +70,99 @@ def process_file(filepath: Path) -> bool:
     return False
 
 
+def git(args: list[str], input: bytes | None = None) -> bytes:
+    """Run a git command in the repository and return its stdout."""
+    result = subprocess.run(['git', *args], cwd=REPO_ROOT, input=input,
+                            capture_output=True, check=True)
+    return result.stdout
+
+
+def staged_pages() -> list[tuple[str, str, str]]:
+    """Return (mode, blob id, path) of each markdown page added or modified in the index."""
+    raw = git(['diff', '--cached', '--raw', '-z', '--no-renames', '--diff-filter=AM',
+               '--', STAGED_PAGES])
+    fields = raw.decode().split('\0')
+    pages = []
+    # Each entry is ":oldmode newmode oldsha newsha status" followed by the path
+    for info, path in zip(fields[0::2], fields[1::2]):
+        _, mode, _, blob, _ = info.split(' ')
+        pages.append((mode, blob, path))
+    return pages
+
+
+def read_blobs(blobs: list[str]) -> list[bytes]:
+    """Read the contents of blobs from the object database in one git call."""
+    output = git(['cat-file', '--batch'], input=''.join(f'{blob}\n' for blob in blobs).encode())
+    contents = []
+    pos = 0
+    for _ in blobs:
+        header_end = output.index(b'\n', pos)
+        size = int(output[pos:header_end].split()[2])
+        start = header_end + 1
+        contents.append(output[start:start + size])
+        # Each object is followed by a newline
+        pos = start + size + 1
+    return contents
+
+
+def write_blobs(contents: list[bytes]) -> list[str]:
+    """Store contents in the object database in one git call; return their ids."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for i, content in enumerate(contents):
+            path = Path(tmpdir) / str(i)
+            path.write_bytes(content)
+            paths.append(f'{path}\n')
+        output = git(['hash-object', '-w', '--no-filters', '--stdin-paths'],
+                     input=''.join(paths).encode())
+    return output.decode().split()
+
+
+def strip_staged() -> list[str]:
+    """Strip the staged pages and return the paths of those that changed."""
+    pages = staged_pages()
+    if not pages:
+        return []
+
+    changed = []
+    for (mode, _, path), staged in zip(pages, read_blobs([blob for _, blob, _ in pages])):
+        if MARKER_BYTES not in staged:
+            continue
+        stripped = strip_autogenerated(staged.decode()).encode()
+        if stripped != staged:
+            changed.append((mode, path, staged, stripped))
+    if not changed:
+        return []
+
+    blobs = write_blobs([stripped for _, _, _, stripped in changed])
+    git(['update-index', '--index-info'],
+        input=''.join(f'{mode} {blob}\t{path}\n'
+                      for (mode, path, _, _), blob in zip(changed, blobs)).encode())
+
+    for _, path, staged, stripped in changed:
+        worktree = REPO_ROOT / path
+        # Leave files with unstaged changes alone; only their index entry is stripped
+        try:
+            if worktree.read_bytes() == staged:
+                worktree.write_bytes(stripped)
+        except FileNotFoundError:
+            pass
+    return [path for _, path, _, _ in changed]
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description='Strip auto-generated output from markdown files')
+    parser.add_argument('--all', action='store_true',
+                        help='Strip every src/**/*.md file in the working tree instead of '
+                             'the staged ones, without staging anything')
+    return parser.parse_args()
+
+
 def main():
-    """Process all markdown files in src/ directory."""
-    src_dir = Path(__file__).parent.parent / 'src'
+    """Strip the staged markdown files in src/, or all of them with --all."""
+    args = parse_args()
+    src_dir = REPO_ROOT / 'src'
 
     if not src_dir.exists():
         print(f"Error: src directory not found at {src_dir}", file=sys.stderr)
@@ -57,19 +170,16 @@ def main():
 
     print("Pre-commit hook: checking auto-generated content...")
 
-    modified = []
-    for md_file in src_dir.rglob('*.md'):
-        if process_file(md_file):
-            modified.append(md_file)
+    if args.all:
+        modified = [str(f.relative_to(REPO_ROOT)) for f in src_dir.rglob('*.md')
+                    if process_file(f)]
+    else:
+        modified = strip_staged()
 
     if modified:
         print(f"Stripped auto-generated content from {len(modified)} file(s):")
         for f in modified:
-            print(f"  - {f.relative_to(src_dir.parent)}")
-        # Re-stage the modified files
-        import subprocess
-        for f in modified:
-            subprocess.run(['git', 'add', str(f)], check=True)
+            print(f"  - {f}")
     else:
         print("No auto-generated content to strip.")
 
@@ -0,0 +1,25 @@
+"""Tests of the command lines built by benchmark_nanalogue.py."""
+
+from pathlib import Path
+
+from benchmark_nanalogue import FILTERS, benchmark_command
+
+
+def test_nested_subcommand_comes_before_options_and_filters():
+    command = benchmark_command('find-modified-reads', FILTERS['mapq-filter'], Path('sim.bam'))
+    assert command == ['nanalogue', 'find-modified-reads', 'any-dens-above',
+                       '--win', '10', '--step', '5', '--tag', 'm', '--high', '0.8',
+                       '--mapq-filter', '20', 'sim.bam']
+
+
+def test_region_goes_after_nested_subcommand():
+    command = benchmark_command('find-modified-reads', ['--region', 'contig_00001:1-100'],
+                                Path('sim.bam'))
+    assert command.index('--region') > command.index('any-dens-above')
+    assert command[-1] == 'sim.bam'
+
+
+def test_subcommand_without_nesting():
+    command = benchmark_command('window-dens', FILTERS['subsample'], Path('sim.bam'))
+    assert command == ['nanalogue', 'window-dens', '--win', '10', '--step', '5',
+                       '-s', '0.1', 'sim.bam']
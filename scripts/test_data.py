@@ -1,12 +1,46 @@
 #!/usr/bin/env python3
 """
 Shared test data configuration and creation for markdown documentation scripts.
+
+Every simulated BAM comes with an index (.bai, or .csi for contigs too long
+for BAI), checked against the BAM header, so that region queries in the
+examples take nanalogue's indexed random-access path. Each fixture also has
+a region table, <stem>.regions.tsv, of windows of several widths on each of
+its contigs.
 """
 
+import gzip
+import hashlib
+import json
+import os
+import re
+import resource
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from importlib import metadata
 from pathlib import Path
 
 import pynanalogue
 
+from timing_report import ProcessStats, stats_since
+
+# Simulated fixtures are kept here between runs, keyed by config and pynanalogue version
+FIXTURE_CACHE_DIR = Path(__file__).parent.parent.resolve() / ".cache" / "fixtures"
+# Bumped whenever the files in a fixture cache entry change
+FIXTURE_LAYOUT = "2"
+# Files of a fixture, as suffixes of its stem
+FIXTURE_SUFFIXES = (".bam", ".bam.bai", ".bam.csi", ".fasta", ".regions.tsv")
+# Widths of the windows in a region table
+REGION_WIDTHS = (500, 5000, 50000)
+# Longest reference position a BAI index can hold
+BAI_MAX_POSITION = (1 << 29) - 1
+
 # Basic BAM with modifications
 JSON_CONFIG_BASIC = '''
 {
@@ -124,52 +158,433 @@ JSON_CONFIG_INDELS = '''
 }
 '''
 
+# Many long contigs with short reads, for region queries and benchmarks
+# (about 16 MB); a region is a small part of the file, unlike on the others
+JSON_CONFIG_LARGE = '''
+{
+  "contigs": {
+    "number": 24,
+    "len_range": [50000, 100000]
+  },
+  "reads": [
+    {
+      "number": 6000,
+      "mapq_range": [20, 60],
+      "base_qual_range": [20, 40],
+      "len_range": [0.01, 0.05],
+      "mods": [{
+        "base": "C",
+        "is_strand_plus": true,
+        "mod_code": "m",
+        "win": [5, 3],
+        "mod_range": [[0.7, 1.0], [0.1, 0.4]]
+      }]
+    }
+  ]
+}
+'''
+
 
-def create_test_data(work_dir: Path) -> dict[str, Path]:
-    """Create test BAM files for use in documentation examples.
+# Simulated datasets: file stem in the work directory and the config it is built from
+FIXTURES = [
+    ("test_input", JSON_CONFIG_BASIC),
+    ("test_input_indels", JSON_CONFIG_INDELS),
+    ("test_input_errors", JSON_CONFIG_ERRORS),
+    ("test_input_variant", JSON_CONFIG_VARIANT),
+    ("test_input_large", JSON_CONFIG_LARGE),
+]
 
-    Returns a dict mapping placeholder filenames to actual test file paths.
+# Placeholder filenames used in the docs and the fixture each one stands for
+PLACEHOLDERS = {
+    "input.bam": "test_input",
+    "aligned_reads.bam": "test_input",
+    "input_indels.bam": "test_input_indels",
+    "error_data.bam": "test_input_errors",
+    "variant_data.bam": "test_input_variant",
+    "large_input.bam": "test_input_large",
+}
+
+
+def placeholder_pattern(placeholders: Iterable[str]) -> re.Pattern:
+    """Match any of the placeholders as a whole file name.
+
+    A placeholder inside a longer name or a path, such as input.bam in
+    large_input.bam or in a URL, does not match. Longer placeholders are
+    tried first.
+    """
+    alternatives = sorted(placeholders, key=len, reverse=True)
+    return re.compile(r'(?<![/\w])(?:' + '|'.join(map(re.escape, alternatives)) + r')(?!\w)')
+
+
+def referenced_placeholders(codes: Iterable[str]) -> set[str]:
+    """Return the placeholders mentioned anywhere in the given code."""
+    pattern = placeholder_pattern(PLACEHOLDERS)
+    return {match.group() for code in codes for match in pattern.finditer(code)}
+
+
+def substitute_placeholders(code: str, test_files: dict[str, Path]) -> str:
+    """Replace each placeholder file name in code with the path of its test file."""
+    if not test_files:
+        return code
+    return placeholder_pattern(test_files).sub(lambda match: str(test_files[match.group()]),
+                                               code)
+
+
+def scaled_config(json_config: str, reads: int) -> str:
+    """Rescale the read groups of a simulation config to `reads` reads in total.
+
+    Groups keep their relative sizes, e.g. the two groups of the variant
+    config stay equal.
+    """
+    config = json.loads(json_config)
+    groups = config['reads']
+    total = sum(group['number'] for group in groups)
+    remaining = reads
+    for i, group in enumerate(groups):
+        if i == len(groups) - 1:
+            group['number'] = max(remaining, 1)
+        else:
+            group['number'] = max(round(group['number'] * reads / total), 1)
+            remaining -= group['number']
+    return json.dumps(config, indent=2)
+
+
+def config_reads(json_config: str) -> int:
+    """Total number of reads a simulation config asks for."""
+    return sum(group['number'] for group in json.loads(json_config)['reads'])
+
+
+@dataclass
+class FixtureBuild:
+    """How one fixture was obtained in a run, for timing reports."""
+    stem: str
+    json_config: str
+    # True if it was linked from the fixture cache rather than simulated
+    cached: bool
+    # None if creating the fixture failed
+    stats: ProcessStats | None
+
+
+def fixture_key(json_config: str) -> str:
+    """Hash a simulation config together with the pynanalogue version."""
+    try:
+        version = metadata.version('pynanalogue')
+    except metadata.PackageNotFoundError:
+        version = 'unknown'
+    digest = hashlib.sha256()
+    for part in (FIXTURE_LAYOUT, version):
+        digest.update(part.encode())
+        digest.update(b'\0')
+    digest.update(json.dumps(json.loads(json_config), sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def bam_references(bam_path: Path) -> list[tuple[str, int]]:
+    """Read the name and length of each reference from a BAM header."""
+    with gzip.open(bam_path, 'rb') as f:
+        magic, text_length = struct.unpack('<4si', f.read(8))
+        if magic != b'BAM\1':
+            raise ValueError(f"{bam_path} is not a BAM file")
+        f.seek(text_length, os.SEEK_CUR)
+        (count,) = struct.unpack('<i', f.read(4))
+        references = []
+        for _ in range(count):
+            (name_length,) = struct.unpack('<i', f.read(4))
+            name = f.read(name_length).rstrip(b'\0').decode()
+            (length,) = struct.unpack('<i', f.read(4))
+            references.append((name, length))
+    return references
+
+
+def index_path(bam_path: Path) -> Path | None:
+    """Return the .bai or .csi index next to a BAM, or None if it has neither."""
+    for suffix in ('.bai', '.csi'):
+        path = bam_path.with_name(bam_path.name + suffix)
+        if path.exists():
+            return path
+    return None
+
+
+def index_reference_count(path: Path) -> int:
+    """Read the number of references from a BAI or CSI index."""
+    if path.suffix == '.bai':
+        with open(path, 'rb') as f:
+            magic, count = struct.unpack('<4si', f.read(8))
+        if magic != b'BAI\1':
+            raise ValueError(f"{path} is not a BAI index")
+        return count
+
+    # CSI indexes are BGZF compressed, with an auxiliary block before the count
+    with gzip.open(path, 'rb') as f:
+        magic, _, _, aux_length = struct.unpack('<4siii', f.read(16))
+        if magic != b'CSI\1':
+            raise ValueError(f"{path} is not a CSI index")
+        f.seek(aux_length, os.SEEK_CUR)
+        (count,) = struct.unpack('<i', f.read(4))
+    return count
+
+
+def verify_index(bam_path: Path) -> Path:
+    """Check that a BAM has an index that is current and covers its references.
+
+    Returns the index path; raises ValueError if it is missing or does not
+    match the BAM.
     """
-    bam_path = work_dir / "test_input.bam"
-    fasta_path = work_dir / "test_input.fasta"
+    path = index_path(bam_path)
+    if path is None:
+        raise ValueError(f"{bam_path} has no .bai or .csi index")
+    if path.stat().st_mtime < bam_path.stat().st_mtime:
+        raise ValueError(f"{path} is older than {bam_path.name}")
+    references = len(bam_references(bam_path))
+    indexed = index_reference_count(path)
+    if indexed != references:
+        raise ValueError(f"{path} indexes {indexed} references, "
+                         f"{bam_path.name} has {references}")
+    return path
+
+
+def ensure_index(bam_path: Path) -> Path:
+    """Index a BAM with samtools unless the simulator already did, then verify it.
+
+    A CSI index is made if any contig is too long for BAI.
+    """
+    if index_path(bam_path) is None:
+        longest = max((length for _, length in bam_references(bam_path)), default=0)
+        command = ['samtools', 'index', str(bam_path)]
+        if longest > BAI_MAX_POSITION:
+            command.insert(2, '-c')
+        try:
+            subprocess.run(command, capture_output=True, text=True, check=True)
+        except FileNotFoundError:
+            raise RuntimeError(f"samtools is needed to index {bam_path.name}") from None
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(f"samtools index failed on {bam_path.name}: "
+                               f"{e.stderr.strip()}") from None
+    return verify_index(bam_path)
+
+
+def region_table(references: list[tuple[str, int]]) -> str:
+    """Build a TSV of windows of each width in REGION_WIDTHS on every contig.
 
+    Windows are centred on their contig; widths longer than a contig are left
+    out for it. The region column is in the `contig:start-end` form that
+    --region and --mod-region take.
+    """
+    lines = ["region\tcontig\tstart\tend\twidth"]
+    for name, length in references:
+        for width in REGION_WIDTHS:
+            if width > length:
+                continue
+            start = (length - width) // 2
+            end = start + width
+            lines.append(f"{name}:{start}-{end}\t{name}\t{start}\t{end}\t{width}")
+    return '\n'.join(lines) + '\n'
+
+
+def read_region_table(path: Path) -> list[dict]:
+    """Read a region table written alongside a fixture."""
+    lines = path.read_text().splitlines()
+    header = lines[0].split('\t')
+    rows = []
+    for line in lines[1:]:
+        row = dict(zip(header, line.split('\t')))
+        for column in ('start', 'end', 'width'):
+            row[column] = int(row[column])
+        rows.append(row)
+    return rows
+
+
+def simulate(json_config: str, bam_path: Path, fasta_path: Path) -> None:
+    """Simulate a BAM and its reference, then index the BAM and tabulate its regions."""
     pynanalogue.simulate_mod_bam(
-        json_config=JSON_CONFIG_BASIC,
+        json_config=json_config,
         bam_path=str(bam_path),
         fasta_path=str(fasta_path)
     )
+    ensure_index(bam_path)
+    regions = bam_path.with_name(bam_path.name.removesuffix('.bam') + '.regions.tsv')
+    regions.write_text(region_table(bam_references(bam_path)))
 
-    bam_indels_path = work_dir / "test_input_indels.bam"
-    fasta_indels_path = work_dir / "test_input_indels.fasta"
 
-    pynanalogue.simulate_mod_bam(
-        json_config=JSON_CONFIG_INDELS,
-        bam_path=str(bam_indels_path),
-        fasta_path=str(fasta_indels_path)
-    )
+def is_cached(json_config: str, cache_dir: Path) -> bool:
+    """Check whether the fixture cache already holds data for a config."""
+    return (cache_dir / fixture_key(json_config) / "sim.bam").exists()
 
-    bam_errors_path = work_dir / "test_input_errors.bam"
-    fasta_errors_path = work_dir / "test_input_errors.fasta"
 
-    pynanalogue.simulate_mod_bam(
-        json_config=JSON_CONFIG_ERRORS,
-        bam_path=str(bam_errors_path),
-        fasta_path=str(fasta_errors_path)
-    )
+def simulate_cached(json_config: str, cache_dir: Path) -> Path:
+    """Return a cache entry directory holding sim.bam, its index, sim.fasta and sim.regions.tsv.
 
-    bam_variant_path = work_dir / "test_input_variant.bam"
-    fasta_variant_path = work_dir / "test_input_variant.fasta"
+    The data is simulated on a miss. It is written into a private temporary
+    directory first and then renamed into place, so concurrent runs never
+    see a half-written entry; if two runs race, the first rename wins.
+    """
+    entry = cache_dir / fixture_key(json_config)
+    if is_cached(json_config, cache_dir):
+        return entry
 
-    pynanalogue.simulate_mod_bam(
-        json_config=JSON_CONFIG_VARIANT,
-        bam_path=str(bam_variant_path),
-        fasta_path=str(fasta_variant_path)
-    )
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    staging = Path(tempfile.mkdtemp(dir=cache_dir, prefix=".tmp-"))
+    try:
+        simulate(json_config, staging / "sim.bam", staging / "sim.fasta")
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another run populated the entry first; use theirs
+            if not (entry / "sim.bam").exists():
+                raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
 
-    return {
-        "input.bam": bam_path,
-        "aligned_reads.bam": bam_path,
-        "input_indels.bam": bam_indels_path,
-        "error_data.bam": bam_errors_path,
-        "variant_data.bam": bam_variant_path,
-    }
+    return entry
+
+
+def create_fixture(stem: str, json_config: str, work_dir: Path,
+                   cache_dir: Path | None) -> Path:
+    """Create <stem>.bam (with index), <stem>.fasta and <stem>.regions.tsv in work_dir.
+
+    With a cache_dir the files are hard-linked from the fixture cache,
+    simulating them first if needed. Without one they are simulated directly.
+    Either way the index is verified against the BAM in work_dir.
+    """
+    bam_path = work_dir / f"{stem}.bam"
+    fasta_path = work_dir / f"{stem}.fasta"
+
+    if cache_dir is None:
+        simulate(json_config, bam_path, fasta_path)
+        return bam_path
+
+    entry = simulate_cached(json_config, cache_dir)
+    for suffix in FIXTURE_SUFFIXES:
+        source = entry / f"sim{suffix}"
+        if source.exists():
+            link_or_copy(source, work_dir / f"{stem}{suffix}")
+
+    verify_index(bam_path)
+    return bam_path
+
+
+def timed_create_fixture(stem: str, json_config: str, work_dir: Path,
+                         cache_dir: Path | None) -> tuple[Path, ProcessStats]:
+    """Create a fixture as create_fixture does, measuring the time it takes."""
+    start_wall = time.monotonic()
+    start_usage = resource.getrusage(resource.RUSAGE_SELF)
+    bam_path = create_fixture(stem, json_config, work_dir, cache_dir)
+    return bam_path, stats_since(start_wall, start_usage, exit_status=0)
+
+
+def create_fixtures(fixtures: list[tuple[str, str]], work_dir: Path,
+                    cache_dir: Path | None,
+                    builds: list[FixtureBuild] | None = None) -> dict[str, Path]:
+    """Create several fixtures, simulating the missing ones concurrently.
+
+    Fixtures already in the cache are just linked. The rest are simulated
+    in a process pool, since each simulation is independent. Every fixture
+    is attempted; if any fail, a RuntimeError lists all of the failures.
+    If builds is given, a FixtureBuild is appended to it for each fixture.
+
+    Returns a dict mapping each fixture stem to its BAM path in work_dir.
+    """
+    if builds is None:
+        builds = []
+    bam_paths = {}
+    errors: dict[str, Exception] = {}
+    to_simulate = []
+    for stem, json_config in fixtures:
+        try:
+            if cache_dir is not None and is_cached(json_config, cache_dir):
+                bam_paths[stem], stats = timed_create_fixture(stem, json_config, work_dir,
+                                                              cache_dir)
+                builds.append(FixtureBuild(stem, json_config, True, stats))
+                continue
+        except Exception as e:
+            errors[stem] = e
+            builds.append(FixtureBuild(stem, json_config, True, None))
+            continue
+        to_simulate.append((stem, json_config))
+
+    workers = min(len(to_simulate), os.cpu_count() or 1)
+
+    if workers <= 1:
+        for stem, json_config in to_simulate:
+            try:
+                bam_paths[stem], stats = timed_create_fixture(stem, json_config, work_dir,
+                                                              cache_dir)
+                builds.append(FixtureBuild(stem, json_config, False, stats))
+            except Exception as e:
+                errors[stem] = e
+                builds.append(FixtureBuild(stem, json_config, False, None))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                stem: (json_config, executor.submit(timed_create_fixture, stem, json_config,
+                                                    work_dir, cache_dir))
+                for stem, json_config in to_simulate
+            }
+            for stem, (json_config, future) in futures.items():
+                try:
+                    bam_paths[stem], stats = future.result()
+                    builds.append(FixtureBuild(stem, json_config, False, stats))
+                except Exception as e:
+                    errors[stem] = e
+                    builds.append(FixtureBuild(stem, json_config, False, None))
+
+    if errors:
+        details = '; '.join(f"{stem}: {e}" for stem, e in errors.items())
+        raise RuntimeError(
+            f"Failed to create {len(errors)} test fixture(s): {details}"
+        ) from next(iter(errors.values()))
+
+    return bam_paths
+
+
+def create_test_data(work_dir: Path,
+                     cache_dir: Path | None = FIXTURE_CACHE_DIR,
+                     placeholders: Iterable[str] | None = None,
+                     builds: list[FixtureBuild] | None = None,
+                     scale: float = 1) -> dict[str, Path]:
+    """Create test BAM files for use in documentation examples.
+
+    Simulated data is reused from cache_dir across runs; pass None to
+    simulate fresh data instead. If placeholders is given, only the
+    fixtures behind those placeholders are created. builds collects how
+    each fixture was obtained, as in create_fixtures. With a scale other
+    than 1, each fixture has that many times the reads of its config.
+
+    Returns a dict mapping placeholder filenames to actual test file paths.
+    """
+    wanted = PLACEHOLDERS if placeholders is None else {p: PLACEHOLDERS[p] for p in placeholders}
+    stems = set(wanted.values())
+    fixtures = [(stem, json_config) for stem, json_config in FIXTURES if stem in stems]
+    if scale != 1:
+        fixtures = [(stem, scaled_config(json_config, round(config_reads(json_config) * scale)))
+                    for stem, json_config in fixtures]
+    bam_paths = create_fixtures(fixtures, work_dir, cache_dir, builds)
+
+    return {placeholder: bam_paths[stem] for placeholder, stem in wanted.items()}
+
+
+def link_or_copy(source: Path, target: Path) -> None:
+    """Hard-link source to target, copying if a link is not possible."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def link_test_data(test_files: dict[str, Path], dest_dir: Path) -> dict[str, Path]:
+    """Hard-link test files (and their indexes and region tables) into dest_dir.
+
+    Falls back to copying when a hard link is not possible, e.g. across
+    filesystems. Returns the placeholder mapping rewritten to point at the
+    linked files.
+    """
+    linked = {}
+    for placeholder, real_path in test_files.items():
+        target = dest_dir / real_path.name
+        if not target.exists():
+            for suffix in FIXTURE_SUFFIXES:
+                source = real_path.with_name(real_path.stem + suffix)
+                if source.exists():
+                    link_or_copy(source, dest_dir / source.name)
+        linked[placeholder] = target
+    return linked
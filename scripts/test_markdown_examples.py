@@ -6,26 +6,213 @@ Extracts fenced code blocks from markdown files and executes them,
 verifying they complete successfully.
 
 Usage:
-    python test_markdown_examples.py [markdown_files...]
+    python test_markdown_examples.py [-j N] [--no-cache] [--generate-outputs]
+                                     [--warm-python] [--changed-since REF]
+                                     [--time-budget SECONDS] [--json-report PATH]
+                                     [--junit-xml PATH] [--slowest N] [--history PATH]
+                                     [--fail-fast | --max-failures N]
+                                     [--results-jsonl PATH] [--watch]
+                                     [--remote-delay SECONDS] [--remote-bandwidth KIB_PER_S]
+                                     [--memory-limit MB] [--shard I/N] [--build-fixtures]
+                                     [--scaling [F,F,...]] [--profile [DIR]]
+                                     [markdown_files...]
+    python test_markdown_examples.py --merge-reports REPORT [REPORT ...]
 
 If no files specified, searches for all .md files in src/
+
+With -j/--jobs N (N > 1), blocks run on a pool of N workers. Each block gets
+its own scratch directory with the test data hard-linked in, so output files
+written by one block cannot collide with another. A block that reads a file
+written by an earlier block waits for it, and the file is linked into its
+directory (see block_graph.py). Results are still printed in document order.
+
+Passing results are cached in .cache/markdown_examples, keyed on the
+prepared code, the test fixtures and the versions of the tools involved.
+Unchanged blocks are not re-run; --no-cache forces every block to run.
+
+With --generate-outputs the AUTO-GENERATED sections are filled in from the
+same run (see generate_markdown_outputs.py), so each block executes once
+for both testing and output generation. AUTO-GENERATED-BENCH sections need
+repeated runs of their block; they are measured one at a time after every
+other block has finished, so that nothing competes with them.
+
+With --warm-python, python blocks are forked from pre-imported interpreters
+(see python_runner.py) instead of each starting a new `python -c`.
+
+A page containing the comment <!-- PYTHON-SESSION --> runs its python blocks
+in order in one interpreter with shared globals, so later blocks can reuse
+data loaded by earlier ones. Each block is still reported separately.
+
+--changed-since REF limits the run to pages changed since a git ref, plus
+pages using test data whose config in test_data.py changed (see
+changed_blocks.py). --time-budget SECONDS runs changed blocks first and
+starts no new block once the budget is spent.
+
+The wall time, CPU time and exit status of every block and fixture build
+are recorded (see timing_report.py). --json-report and --junit-xml write
+them out, and the slowest are listed after each run. Timings are appended
+to a history file, and blocks much slower than their rolling median over
+earlier runs are flagged.
+
+--max-failures N stops the run after N failed blocks (--fail-fast after
+the first): blocks still running are killed along with their whole
+process group, the rest are reported as not run, and the summary and
+reports are still written.
+
+Output is read as blocks write it and only a bounded part is kept (see
+output_capture.py): the lines of stdout that an AUTO-GENERATED section or
+a preview shows, and the end of stderr. Results are counted and streamed
+out as they arrive rather than kept until the end; --results-jsonl PATH
+writes each one, with the size and sha256 of its full stdout, as a line
+of JSON.
+
+--watch keeps the fixtures and a warm python runner alive after the run
+and polls the pages for edits. Only the blocks that changed, and the
+blocks linked to them through the files they write, are re-run; with
+--generate-outputs their AUTO-GENERATED sections are rewritten in place.
+
+Blocks that read a BAM from an https://example.com/... URL run against a
+local HTTP server serving the large_input.bam fixture with Range support
+(see remote_bam.py). The requests and bytes each block fetched are
+reported, and a --region query that fetches more than a small part of the
+BAM fails. --remote-delay and --remote-bandwidth slow the server down.
+Remote blocks are never cached, so their traffic is measured every run.
+
+A block preceded by a comment such as <!-- BUDGET seconds=30 rss_mb=512 -->
+runs under rlimits matching its budget, and fails if its wall time, peak
+RSS or stdout size goes over it (see resource_limits.py). Its usage is
+reported against the budget, and it is never cached. --memory-limit MB caps
+the address space of every block, to check that the book still runs on a
+node with that much memory.
+
+--shard I/N runs one part of the pages, split so that every part takes
+about as long according to the timing history (see shard_plan.py), and
+writes a partial report. --merge-reports combines the partial reports of
+all shards into one summary and exit status. --build-fixtures only fills
+the fixture cache, which the shards should share.
+
+--scaling runs the blocks against fixtures with several multiples of their
+read counts instead, and flags blocks whose run time grows faster than
+linearly with the number of reads (see scaling.py).
+
+--profile runs each python block under cProfile and tracemalloc, saving
+its profile and largest allocations to .cache/profiles, or the directory
+given, and merges them into one profile whose hottest functions are listed
+after the run and in the JSON report (see block_profile.py). Profiled
+blocks are never cached.
 """
 
 import argparse
+import contextlib
 import os
+import json
 import re
 import subprocess
 import sys
 import tempfile
 import textwrap
-from dataclasses import dataclass
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
 from pathlib import Path
 
-from test_data import create_test_data
+from block_cache import ResultCache, file_digest, fixture_digests, tool_fingerprint
+from block_graph import (
+    BlockGraph,
+    affected_blocks,
+    block_files,
+    build_graph,
+    dependency_order,
+)
+from block_profile import (
+    HOT_FUNCTIONS,
+    PROFILE_DIR,
+    BlockProfile,
+    block_profile,
+    hot_functions,
+    merge_profiles,
+    package_seconds,
+    print_profile,
+    profiled_code,
+)
+from changed_blocks import (
+    changed_markdown_files,
+    changed_placeholders,
+    is_valid_ref,
+    show_at_ref,
+    uses_placeholder,
+)
+from generate_markdown_outputs import (
+    CommandResult,
+    fill_marker_sections,
+    marker_config,
+    process_markdown_file,
+    rewrite_for_output,
+)
+from markdown_index import MarkdownIndex, index_markdown
+from output_capture import CapturedOutput, HeadCapture, TailCapture, kill_group, stream_process
+from python_runner import PythonSession, RunnerError, WarmPythonPool
+from remote_bam import (
+    REMOTE_PLACEHOLDER,
+    RangeServer,
+    RemoteTraffic,
+    check_region_traffic,
+    is_remote_block,
+)
+from resource_limits import (
+    Budget,
+    budget_violations,
+    child_limits,
+    limited_command,
+    parse_budget,
+    usage_summary,
+)
+from scaling import DEFAULT_SCALES, ScalingResult, fit_exponent, parse_scales, print_scaling
+from shard_plan import ShardPlan, check_shard_reports, parse_shard, plan_shards
+from test_data import (
+    PLACEHOLDERS,
+    FixtureBuild,
+    create_test_data,
+    fixture_key,
+    link_or_copy,
+    link_test_data,
+    referenced_placeholders,
+    substitute_placeholders,
+)
+from timing_report import (
+    HISTORY_PATH,
+    ProcessStats,
+    TimingRecord,
+    append_history,
+    block_key,
+    find_regressions,
+    load_history,
+    print_regressions,
+    print_slowest,
+    read_json_report,
+    relative_path,
+    write_json_report,
+    write_junit_report,
+)
 
 COMMAND_TIMEOUT_SECONDS = 60
 REPO_ROOT = Path(__file__).parent.parent.resolve()
 OUTPUTS_DIR = REPO_ROOT / "outputs"
+CACHE_DIR = REPO_ROOT / ".cache" / "markdown_examples"
+# Files written by examples; they are redirected into the work directory
+OUTPUT_FILES = ['hypermethylated_reads.txt',
+                'hypermethylated.bam',
+                'high_meth_reads.txt',
+                'detailed_densities.tsv',
+                'densities.tsv']
+# Page-level opt-in for running all python blocks of a page in one interpreter
+PYTHON_SESSION_MARKER = '<!-- PYTHON-SESSION -->'
+# Lines of stdout kept for blocks whose output only appears in previews
+PREVIEW_LINES = 5
+# How often --watch checks the pages for changes
+WATCH_INTERVAL_SECONDS = 0.5
 
 
 def is_gitignored(file_path: Path) -> bool:
@@ -45,6 +232,11 @@ class CodeBlock:
     code: str
     line_number: int
     file_path: str
+    python_session: bool = False
+    # Lines of stdout to keep, None for all of it
+    max_output_lines: int | None = PREVIEW_LINES
+    # key=value options of the block's BUDGET comment
+    budget: dict[str, str] = field(default_factory=dict)
 
     def __str__(self):
         return f"{self.file_path}:{self.line_number} ({self.language})"
@@ -57,38 +249,38 @@ class TestResult:
     success: bool
     output: str
     error: str
-
-
-def find_replace_regions(content: str) -> list[tuple[int, int, str, str]]:
-    """Find REPLACE tag regions and extract their replacement rules.
-
-    Returns list of (start_pos, end_pos, from_str, to_str) tuples.
-    Tags look like: <!--REPLACE_CHR1_WITH_CONTIG_00001:START--> ... <!--REPLACE_CHR1_WITH_CONTIG_00001:END-->
-    """
-    regions = []
-    # Match REPLACE_<FROM>_WITH_<TO>:START and corresponding END tags
-    pattern = r'<!--REPLACE_([^_]+)_WITH_([^:]+):START-->(.*?)<!--REPLACE_\1_WITH_\2:END-->'
-
-    for match in re.finditer(pattern, content, re.DOTALL):
-        from_str = match.group(1)
-        to_str = match.group(2)
-        start_pos = match.start()
-        end_pos = match.end()
-        regions.append((start_pos, end_pos, from_str, to_str))
-
-    return regions
-
-
-def apply_replace_tags(code: str, code_start_pos: int, replace_regions: list[tuple[int, int, str, str]]) -> str:
-    """Apply REPLACE tag substitutions to code if it falls within a replace region.
+    cached: bool = False
+    ran: bool = True
+    # None if the block did not run, e.g. on a cache hit
+    stats: ProcessStats | None = None
+    # Size and sha256 of all of stdout, and whether output holds only its start
+    output_bytes: int = 0
+    output_sha256: str = ''
+    truncated: bool = False
+    # What a block reading a remote BAM fetched from the local server
+    remote: RemoteTraffic | None = None
+    # Resources the block was allowed, if it had a BUDGET comment
+    budget: Budget | None = None
+    # Where the block's profile was written, if it was profiled
+    profile: BlockProfile | None = None
+
+
+def captured_result(block: CodeBlock, success: bool, stdout: CapturedOutput, stderr: str,
+                    **kwargs) -> TestResult:
+    """Result of a block from its captured stdout."""
+    return TestResult(block, success, stdout.text, stderr, output_bytes=stdout.total_bytes,
+                      output_sha256=stdout.sha256, truncated=stdout.truncated, **kwargs)
+
+
+def apply_replace_tags(code: str, replacements: list[tuple[str, str]]) -> str:
+    """Apply the REPLACE tag substitutions of the regions a code block falls within.
 
     The tag names use uppercase (e.g., CHR1, CONTIG_00001) but the actual code and
     BAM files use lowercase. This function handles the case conversion automatically.
     """
-    for start_pos, end_pos, from_str, to_str in replace_regions:
-        if start_pos <= code_start_pos <= end_pos:
-            # Replace case-insensitively, using lowercase target (BAM uses lowercase contig names)
-            code = re.sub(re.escape(from_str), to_str.lower(), code, flags=re.IGNORECASE)
+    for from_str, to_str in replacements:
+        # Replace case-insensitively, using lowercase target (BAM uses lowercase contig names)
+        code = re.sub(re.escape(from_str), to_str.lower(), code, flags=re.IGNORECASE)
     return code
 
 
@@ -97,32 +289,96 @@ def extract_code_blocks(markdown_path: str) -> list[CodeBlock]:
     with open(markdown_path, 'r') as f:
         content = f.read()
 
-    # Find REPLACE tag regions for later substitution
-    replace_regions = find_replace_regions(content)
+    return parse_code_blocks(content, markdown_path)
 
-    blocks = []
-    # Match fenced code blocks: ```language ... ```
-    # Allow optional leading whitespace for indented blocks
-    pattern = r'^[ \t]*```(\w+)\n(.*?)^[ \t]*```'
 
-    for match in re.finditer(pattern, content, re.MULTILINE | re.DOTALL):
-        language = match.group(1)
-        code = match.group(2)
+def parse_code_blocks(content: str, markdown_path: str,
+                      index: MarkdownIndex | None = None) -> list[CodeBlock]:
+    """Extract fenced code blocks from markdown content.
 
-        # Apply REPLACE tag substitutions if this code block is within a replace region
-        code = apply_replace_tags(code, match.start(), replace_regions)
+    Pass the page's index if it has already been built.
+    """
+    if index is None:
+        index = index_markdown(content)
+    session_page = PYTHON_SESSION_MARKER in content
+
+    return [
+        CodeBlock(
+            language=fenced.language,
+            # Apply REPLACE tag substitutions if this code block is within a replace region
+            code=apply_replace_tags(fenced.code, fenced.replacements),
+            line_number=fenced.line_number,
+            file_path=markdown_path,
+            python_session=session_page and fenced.language == 'python',
+            budget=fenced.budget
+        )
+        for fenced in index.blocks
+    ]
+
+
+def find_marker_owners(index: MarkdownIndex, blocks: list[CodeBlock]) -> dict[int, CodeBlock]:
+    """Map the position of each AUTO-GENERATED marker to the bash block above it.
+
+    blocks must be the page's blocks as parsed from the same index.
+    """
+    return {marker.start: blocks[marker.owner]
+            for marker in index.markers if marker.owner is not None}
 
-        # Calculate line number
-        line_number = content[:match.start()].count('\n') + 1
 
-        blocks.append(CodeBlock(
-            language=language,
-            code=code,
-            line_number=line_number,
-            file_path=markdown_path
-        ))
+def rewrite_marker_owners(index: MarkdownIndex, blocks: list[CodeBlock]
+                          ) -> tuple[list[CodeBlock], dict[int, CodeBlock]]:
+    """Turn the blocks that feed a marker into their output-producing form.
 
-    return blocks
+    Each such block keeps as many lines of stdout as its markers show.
+    Returns the page's blocks and the marker owners, as find_marker_owners.
+    """
+    limits: dict[int, int | None] = {}
+    for marker in index.markers:
+        config = marker_config(marker)
+        if marker.owner is None or config is None:
+            continue
+        current = limits.get(marker.owner, 0)
+        if current is None or config.max_lines is None:
+            limits[marker.owner] = None
+        else:
+            limits[marker.owner] = max(current, config.max_lines)
+
+    blocks = [replace(b, code=rewrite_for_output(b.code), max_output_lines=limits[i])
+              if i in limits else b
+              for i, b in enumerate(blocks)]
+    return blocks, find_marker_owners(index, blocks)
+
+
+def flag_changed_blocks(old_blocks: list[CodeBlock], blocks: list[CodeBlock],
+                        placeholders: set[str] = frozenset()) -> list[bool]:
+    """Flag the blocks that are not among old_blocks.
+
+    Blocks that use one of placeholders, or whose budget changed, also
+    count as changed. If any
+    python session block changed, the whole session is flagged so that it
+    still runs as one ordered unit.
+    """
+    old_codes = {(b.language, b.code, tuple(sorted(b.budget.items()))) for b in old_blocks}
+
+    changed = [(b.language, b.code, tuple(sorted(b.budget.items()))) not in old_codes
+               or uses_placeholder(b.code, placeholders)
+               for b in blocks]
+
+    if any(c for b, c in zip(blocks, changed) if b.python_session):
+        changed = [c or b.python_session for b, c in zip(blocks, changed)]
+    return changed
+
+
+def find_changed_blocks(md_file: Path, blocks: list[CodeBlock], ref: str,
+                        placeholders: set[str]) -> list[bool]:
+    """Flag the blocks of a page that are new or different since ref.
+
+    Blocks that use a placeholder whose test data changed also count as
+    changed, see flag_changed_blocks.
+    """
+    old_content = show_at_ref(ref, md_file)
+    old_blocks = parse_code_blocks(old_content, str(md_file)) if old_content is not None else []
+    return flag_changed_blocks(old_blocks, blocks, placeholders)
 
 
 def should_skip_block(block: CodeBlock) -> tuple[bool, str]:
@@ -147,30 +403,33 @@ def should_skip_block(block: CodeBlock) -> tuple[bool, str]:
         if any(first_line.startswith(prefix) for prefix in install_prefixes):
             return True, "skipping installation command"
 
-        # Skip blocks with placeholder URLs (example.com)
-        if 'example.com' in code:
+        # Skip blocks with placeholder URLs (example.com), except remote BAMs,
+        # which are served locally
+        if 'example.com' in code and not is_remote_block(code):
             return True, "skipping example.com placeholder URL"
 
     return False, ""
 
 
+def needed_placeholders(blocks: Iterable[CodeBlock]) -> set[str]:
+    """Return the placeholders whose fixtures the blocks need, remote BAMs included."""
+    blocks = list(blocks)
+    needed = referenced_placeholders(b.code for b in blocks)
+    if any(is_remote_block(b.code) for b in blocks):
+        needed.add(REMOTE_PLACEHOLDER)
+    return needed
+
+
 def prepare_bash_code(code: str, test_files: dict[str, Path], work_dir: Path) -> str:
     """Prepare bash code for execution by substituting test files."""
     prepared = textwrap.dedent(code)
 
     # Replace placeholder BAM files with test files
-    for placeholder, real_path in test_files.items():
-        prepared = prepared.replace(placeholder, str(real_path))
-
+    prepared = substitute_placeholders(prepared, test_files)
 
     # Replace output files with paths in work_dir
     # Use word boundary regex to avoid matching substrings (e.g. densities.tsv within detailed_densities.tsv)
-    output_files = ['hypermethylated_reads.txt', 
-            'hypermethylated.bam',
-            'high_meth_reads.txt',
-            'detailed_densities.tsv',
-            'densities.tsv']
-    for outfile in output_files:
+    for outfile in OUTPUT_FILES:
         # Match filename only at word boundaries (not as substring of another path)
         pattern = r'(?<![/\w])' + re.escape(outfile) + r'(?![/\w])'
         prepared = re.sub(pattern, str(work_dir / outfile), prepared)
@@ -187,8 +446,78 @@ def prepare_python_code(code: str, test_files: dict[str, Path], work_dir: Path)
     return prepared
 
 
-def run_code_block(language: str, code: str, work_dir: Path) -> tuple[bool, str, str]:
-    """Run a code block and return (success, stdout, stderr)."""
+def run_subprocess(command: list[str], cwd: Path, env: dict | None,
+                   on_start: Callable[[int], None] | None = None,
+                   max_lines: int | None = None,
+                   timeout: float = COMMAND_TIMEOUT_SECONDS
+                   ) -> tuple[bool, CapturedOutput, str, ProcessStats]:
+    """Run a command in its own process group and return (success, stdout, stderr, stats).
+
+    Output is read from pipes as it is written, keeping only the first
+    max_lines lines of stdout (all of it if None) and the end of stderr.
+    Waiting on the child with wait4 gives the CPU time of that child alone,
+    even when other blocks are running in parallel, and its peak RSS. After
+    timeout seconds the whole process group is killed. on_start is called with the process group id
+    once the command has started.
+    """
+    start = time.monotonic()
+    stdout = HeadCapture(max_lines)
+    stderr = TailCapture()
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        start_new_session=True
+    )
+    if on_start is not None:
+        on_start(process.pid)
+    returncode, timed_out, usage = stream_process(process, timeout, stdout, stderr)
+    # ru_maxrss is in KiB on Linux
+    stats = ProcessStats(time.monotonic() - start, usage.ru_utime, usage.ru_stime,
+                         returncode, timed_out, max_rss_mb=usage.ru_maxrss / 1024)
+
+    if timed_out:
+        return False, stdout.result(), f"Command timed out after {timeout:g} seconds", stats
+    return returncode == 0, stdout.result(), stderr.result().text, stats
+
+
+def run_code_block(language: str, code: str, work_dir: Path, cwd: Path = OUTPUTS_DIR,
+                   python_pool: WarmPythonPool | None = None,
+                   python_session: PythonSession | None = None,
+                   on_start: Callable[[int], None] | None = None,
+                   max_lines: int | None = None,
+                   timeout: float = COMMAND_TIMEOUT_SECONDS,
+                   limits: dict[str, int] | None = None,
+                   profile: BlockProfile | None = None
+                   ) -> tuple[bool, CapturedOutput, str, ProcessStats]:
+    """Run a code block in cwd and return (success, stdout, stderr, stats).
+
+    Python blocks run in python_session when one is given (its cwd was fixed
+    when it started), otherwise they are forked from python_pool if given.
+    on_start is called with the id of the process group the block runs in.
+    Only the first max_lines lines of stdout are kept, all of it if None.
+    The block runs under limits, rlimits by resource name, except in a
+    session, whose limits were set when it started. A python block that the
+    warm pool fails to set up runs in a new interpreter. A python block with a
+    profile runs under cProfile and tracemalloc, which write to its paths.
+    """
+    if language == 'python' and profile is not None:
+        code = profiled_code(code, profile)
+
+    if language == 'python' and python_session is not None:
+        return python_session.run(code, timeout, on_start, max_lines)
+
+    if language == 'python' and python_pool is not None:
+        try:
+            return python_pool.run(code, cwd, timeout, on_start, max_lines, limits)
+        except RunnerError as e:
+            # The runner's fault, not the block's: run it in a new interpreter instead
+            print(f"Warm python runner error, running the block with python -c:\n{e}",
+                  file=sys.stderr)
+
     if language == 'bash':
         command = ['bash', '-e', '-c', code]
         env = {**os.environ, 'HOME': str(work_dir)}
@@ -196,36 +525,416 @@ def run_code_block(language: str, code: str, work_dir: Path) -> tuple[bool, str,
         command = [sys.executable, '-c', code]
         env = None
 
+    start = time.monotonic()
     try:
-        result = subprocess.run(
-            command,
-            capture_output=True,
-            text=True,
-            timeout=COMMAND_TIMEOUT_SECONDS,
-            cwd=OUTPUTS_DIR,
-            env=env
-        )
-        return result.returncode == 0, result.stdout, result.stderr
-    except subprocess.TimeoutExpired:
-        return False, "", f"Command timed out after {COMMAND_TIMEOUT_SECONDS} seconds"
+        return run_subprocess(limited_command(command, limits or {}), cwd, env, on_start,
+                              max_lines, timeout)
     except Exception as e:
-        return False, "", str(e)
+        return (False, CapturedOutput(""), str(e),
+                ProcessStats(time.monotonic() - start, 0.0, 0.0, None))
+
+
+@dataclass(eq=False)
+class RunningBlock:
+    """A block in flight and the process groups it has started."""
+    groups: list[int] = field(default_factory=list)
+    # Set when the block was killed because the run was cancelled
+    cancelled: bool = False
+
+
+class RunControl:
+    """Decides when a run stops starting blocks, and cancels those in flight.
+
+    A run stops once its deadline passes or once max_failures blocks have
+    failed. Reaching the failure limit also kills the process group of
+    every block still running, including pipelines and their children.
+    """
 
+    def __init__(self, deadline: float | None = None, max_failures: int | None = None):
+        # time.monotonic() after which no further blocks are started
+        self.deadline = deadline
+        self.max_failures = max_failures
+        self.failures = 0
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._running: list[RunningBlock] = []
+
+    def stop_reason(self) -> str | None:
+        """Why no further blocks should start, or None if they may."""
+        if self.cancelled:
+            return f"stopped after {self.max_failures} failure(s)"
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return "time budget spent"
+        return None
+
+    @contextlib.contextmanager
+    def running(self) -> Iterator[RunningBlock]:
+        """Track a block for as long as it runs."""
+        block = RunningBlock()
+        with self._lock:
+            self._running.append(block)
+        try:
+            yield block
+        finally:
+            with self._lock:
+                self._running.remove(block)
+
+    def started(self, block: RunningBlock, pgid: int) -> None:
+        """Record a process group started by a block, killing it if the run was cancelled."""
+        with self._lock:
+            block.groups.append(pgid)
+            block.cancelled = self.cancelled
+        if block.cancelled:
+            kill_group(pgid)
+
+    def record_failure(self) -> None:
+        """Count a failed block and cancel the run when the limit is reached."""
+        with self._lock:
+            self.failures += 1
+            if (self.cancelled or self.max_failures is None
+                    or self.failures < self.max_failures):
+                return
+            self.cancelled = True
+            in_flight = list(self._running)
+            for block in in_flight:
+                block.cancelled = True
+        for block in in_flight:
+            for pgid in block.groups:
+                kill_group(pgid)
+
+
+@dataclass
+class RunContext:
+    """Settings shared by every block in a run."""
+    test_files: dict[str, Path]
+    work_dir: Path
+    cache: ResultCache | None = None
+    python_pool: WarmPythonPool | None = None
+    control: RunControl = field(default_factory=RunControl)
+    # Content digest of each placeholder's fixture, for cache keys
+    fixture_digests: dict[str, str] = field(default_factory=dict)
+    # Serves the BAM of blocks that read one from a URL
+    remote: RangeServer | None = None
+    # Address space limit of every block, in MB
+    memory_limit_mb: float | None = None
+    # Where python blocks are profiled into, if they are
+    profile_dir: Path | None = None
+
+
+def not_run_result(block: CodeBlock, reason: str) -> TestResult:
+    """Result for a block that was not started, or was cancelled, for reason."""
+    return TestResult(block, False, "", f"not run: {reason}", ran=False)
+
+
+def run_test(block: CodeBlock, ctx: RunContext, cwd: Path = OUTPUTS_DIR,
+             python_session: PythonSession | None = None) -> TestResult:
+    """Run a single code block test, reusing a cached pass when available.
+
+    Blocks run in a python session are never cached, as their result
+    depends on the blocks that ran before them, and neither are blocks
+    reading a remote BAM, whose traffic is measured, blocks with a
+    resource budget, whose usage is, or profiled python blocks, whose
+    profiles are written. A block that goes over its budget fails. A
+    failure counts towards the run's failure limit; a block killed because
+    the run was cancelled is reported as not run.
+    """
+    reason = ctx.control.stop_reason()
+    if reason is not None:
+        return not_run_result(block, reason)
 
-def run_test(block: CodeBlock, test_files: dict[str, Path], work_dir: Path) -> TestResult:
-    """Run a single code block test."""
     if block.language == 'bash':
-        prepared_code = prepare_bash_code(block.code, test_files, work_dir)
+        prepared_code = prepare_bash_code(block.code, ctx.test_files, ctx.work_dir)
     elif block.language == 'python':
-        prepared_code = prepare_python_code(block.code, test_files, work_dir)
+        prepared_code = prepare_python_code(block.code, ctx.test_files, ctx.work_dir)
     else:
         return TestResult(block, False, "", f"Unknown language: {block.language}")
 
-    success, stdout, stderr = run_code_block(block.language, prepared_code, work_dir)
-    return TestResult(block, success, stdout, stderr)
+    budget = None
+    if block.budget:
+        try:
+            budget = parse_budget(block.budget)
+        except ValueError as e:
+            return TestResult(block, False, "", f"Invalid BUDGET comment: {e}")
+    timeout = budget.seconds if budget and budget.seconds else COMMAND_TIMEOUT_SECONDS
+
+    profile = None
+    if ctx.profile_dir is not None and block.language == 'python':
+        profile = block_profile(ctx.profile_dir, relative_path(block.file_path),
+                                block.line_number)
+
+    cache = ctx.cache if python_session is None and budget is None and profile is None else None
+
+    client = None
+    if ctx.remote is not None and block.language == 'bash' and is_remote_block(block.code):
+        client = ctx.remote.new_client()
+        prepared_code = ctx.remote.rewrite(prepared_code, client)
+        cache = None
+
+    if cache is not None:
+        fixtures = {placeholder: digest for placeholder, digest in ctx.fixture_digests.items()
+                    if placeholder in block.code}
+        produced, mentioned = block_files(block.language, block.code)
+        # Files written by earlier blocks count like fixtures, so that a
+        # block re-runs when what it reads changes
+        for name in sorted(mentioned - produced - ctx.test_files.keys()):
+            path = ctx.work_dir / name if name in OUTPUT_FILES else cwd / name
+            if path.is_file():
+                fixtures[f'input:{name}'] = file_digest(path)
+        key = cache.key(block.language, prepared_code, ctx.work_dir, fixtures)
+        # Known output files are redirected into work_dir; others are written to cwd
+        outputs = {name: ctx.work_dir / name for name in OUTPUT_FILES
+                   if str(ctx.work_dir / name) in prepared_code}
+        for name in produced:
+            outputs.setdefault(name, cwd / name)
+        hit = cache.get(key, outputs, block.max_output_lines)
+        if hit is not None:
+            return captured_result(block, True, hit.stdout, hit.stderr, cached=True)
+
+    with ctx.control.running() as running:
+        success, stdout, stderr, stats = run_code_block(
+            block.language, prepared_code, ctx.work_dir, cwd, ctx.python_pool, python_session,
+            on_start=lambda pgid: ctx.control.started(running, pgid),
+            max_lines=block.max_output_lines, timeout=timeout,
+            limits=child_limits(budget, ctx.memory_limit_mb), profile=profile
+        )
+
+    if not success and running.cancelled:
+        return replace(not_run_result(block, ctx.control.stop_reason()), stats=stats)
+
+    remote = None
+    if client is not None:
+        remote = ctx.remote.traffic(client)
+        problem = check_region_traffic(block.code, remote) if success else None
+        if problem is not None:
+            success = False
+            stderr = f"{stderr}\n{problem}" if stderr else problem
+
+    if budget is not None:
+        violations = budget_violations(budget, stats, stdout.total_bytes)
+        if violations:
+            success = False
+            problem = f"over budget: {'; '.join(violations)}"
+            stderr = f"{stderr}\n{problem}" if stderr else problem
+
+    if cache is not None and success:
+        cache.put(key, stdout, stderr, outputs, block.max_output_lines)
+
+    if not success:
+        ctx.control.record_failure()
+
+    return captured_result(block, success, stdout, stderr, stats=stats, remote=remote,
+                           budget=budget, profile=profile)
+
+
+def isolated_context(ctx: RunContext, name: str,
+                     inputs: list[tuple[Path, str]] = ()) -> RunContext:
+    """Create a scratch directory with hard-linked test data for one unit of work.
+
+    inputs lists (source, name) pairs of files written by earlier units
+    that are linked in under name as well.
+    """
+    block_dir = ctx.work_dir / 'blocks' / name
+    block_dir.mkdir(parents=True)
+    block_files = link_test_data(ctx.test_files, block_dir)
+    for source, input_name in inputs:
+        target = block_dir / input_name
+        if source.is_file() and not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            link_or_copy(source, target)
+    return replace(ctx, test_files=block_files, work_dir=block_dir)
+
+
+def run_isolated_test(block: CodeBlock, index: int, ctx: RunContext,
+                      inputs: list[tuple[Path, str]] = ()) -> TestResult:
+    """Run a code block in its own scratch directory with hard-linked test data.
+
+    The scratch directory doubles as cwd, HOME and the destination for
+    output files, so concurrently running blocks cannot clobber each other.
+    Files the block needs from its producers are linked in from inputs.
+    """
+    reason = ctx.control.stop_reason()
+    if reason is not None:
+        return not_run_result(block, reason)
+
+    block_ctx = isolated_context(ctx, f'block_{index:04d}', inputs)
+    return run_test(block, block_ctx, cwd=block_ctx.work_dir)
+
+
+def run_session_tests(group: list[tuple[CodeBlock, Future]], index: int,
+                      ctx: RunContext, inputs: list[tuple[Path, str]] = ()) -> None:
+    """Run a page's session blocks in order in one scratch directory.
+
+    Each block's result is delivered through its future as soon as it is
+    known, so the caller can report blocks as they finish.
+    """
+    remaining = iter(group)
+    try:
+        session_ctx = isolated_context(ctx, f'session_{index:04d}', inputs)
+        limits = child_limits(None, ctx.memory_limit_mb)
+        with PythonSession(session_ctx.work_dir, limits) as session:
+            for block, future in remaining:
+                future.set_result(run_test(block, session_ctx, cwd=session_ctx.work_dir,
+                                           python_session=session))
+    except BaseException as e:
+        for _, future in remaining:
+            future.set_exception(e)
+        raise
+
+
+@dataclass
+class WorkUnit:
+    """Blocks that run together on the pool: one block, or a page's session blocks."""
+    # Positions of the blocks in run order
+    indexes: list[int]
+    # Scratch directory of the unit, relative to work_dir/blocks
+    dir_name: str
+    # Units that must finish first
+    depends_on: set[int] = field(default_factory=set)
+
+
+def work_units(blocks: list[CodeBlock], graph: BlockGraph) -> tuple[list[WorkUnit], list[int]]:
+    """Group blocks into units of work and work out the dependencies between units.
+
+    Returns the units and the unit of each block. A session may need a
+    block placed between its own blocks, and that block may need the
+    session; the session then does not wait for it, since the two
+    cannot both wait for each other.
+    """
+    units: list[WorkUnit] = []
+    unit_of: list[int] = []
+    session_unit: dict[str, int] = {}
+
+    for index, block in enumerate(blocks):
+        if block.python_session and block.file_path in session_unit:
+            unit = session_unit[block.file_path]
+            units[unit].indexes.append(index)
+        else:
+            unit = len(units)
+            if block.python_session:
+                session_unit[block.file_path] = unit
+                units.append(WorkUnit([index], f'session_{index:04d}'))
+            else:
+                units.append(WorkUnit([index], f'block_{index:04d}'))
+        unit_of.append(unit)
+
+    for index, deps in enumerate(graph.depends_on):
+        unit = unit_of[index]
+        units[unit].depends_on |= {unit_of[dep] for dep in deps} - {unit}
+
+    def needs(start: int, target: int) -> bool:
+        """Whether unit start waits, directly or not, for unit target."""
+        seen = set()
+        stack = [start]
+        while stack:
+            number = stack.pop()
+            if number == target:
+                return True
+            if number not in seen:
+                seen.add(number)
+                stack.extend(units[number].depends_on)
+        return False
+
+    # Only sessions can wait for a later unit; drop such waits that form a cycle
+    for number, unit in enumerate(units):
+        for dep in sorted(d for d in unit.depends_on if d > number):
+            if needs(dep, number):
+                unit.depends_on.discard(dep)
+
+    return units, unit_of
+
+
+def run_tests(blocks: list[CodeBlock], ctx: RunContext, jobs: int = 1,
+              graph: BlockGraph | None = None) -> Iterator[TestResult]:
+    """Run blocks and yield their results in the order the blocks were given.
+
+    With jobs == 1 the blocks run one at a time in the shared outputs
+    directory, in the order given, which must respect graph. With jobs > 1
+    they run on a thread pool (the work happens in subprocesses, so threads
+    are enough), each in an isolated scratch directory. The session blocks
+    of a page always run in order in one python session, which is a single
+    unit of work for the pool.
+
+    In parallel, a unit is only submitted once the units it depends on in
+    graph have finished, and the files they wrote are linked into its
+    scratch directory. Independent units run concurrently in any order.
+
+    Once ctx.control says the run should stop (its deadline passed or it
+    reached its failure limit), blocks that have not started yet are
+    reported as not run.
+    """
+    if jobs <= 1:
+        sessions: dict[str, PythonSession] = {}
+        last_session_block = {b.file_path: i for i, b in enumerate(blocks) if b.python_session}
+        try:
+            for index, block in enumerate(blocks):
+                if not block.python_session:
+                    yield run_test(block, ctx)
+                    continue
 
+                if block.file_path not in sessions:
+                    sessions[block.file_path] = PythonSession(
+                        OUTPUTS_DIR, child_limits(None, ctx.memory_limit_mb))
+                session = sessions[block.file_path]
+                result = run_test(block, ctx, python_session=session)
+                if index == last_session_block[block.file_path]:
+                    sessions.pop(block.file_path).close()
+                yield result
+        finally:
+            for session in sessions.values():
+                session.close()
+        return
 
-def print_output_preview(output: str, label: str, max_lines: int = 5) -> None:
+    if graph is None:
+        graph = BlockGraph([set() for _ in blocks], [set() for _ in blocks])
+    units, _ = work_units(blocks, graph)
+    futures: list[Future] = [Future() for _ in blocks]
+    waiting = [len(unit.depends_on) for unit in units]
+    dependents: list[list[int]] = [[] for _ in units]
+    for number, unit in enumerate(units):
+        for dep in unit.depends_on:
+            dependents[dep].append(number)
+    lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+
+        def run_unit(number: int) -> None:
+            unit = units[number]
+            inputs = [(ctx.work_dir / 'blocks' / units[dep].dir_name / name, name)
+                      for dep in sorted(unit.depends_on)
+                      for index in units[dep].indexes
+                      for name in graph.produces[index]]
+            try:
+                first = blocks[unit.indexes[0]]
+                if first.python_session:
+                    run_session_tests([(blocks[i], futures[i]) for i in unit.indexes],
+                                      unit.indexes[0], ctx, inputs)
+                else:
+                    futures[unit.indexes[0]].set_result(
+                        run_isolated_test(first, unit.indexes[0], ctx, inputs)
+                    )
+            except BaseException as e:
+                for index in unit.indexes:
+                    if not futures[index].done():
+                        futures[index].set_exception(e)
+            finally:
+                with lock:
+                    ready = []
+                    for dependent in dependents[number]:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            ready.append(dependent)
+                for dependent in ready:
+                    executor.submit(run_unit, dependent)
+
+        for number in range(len(units)):
+            if waiting[number] == 0:
+                executor.submit(run_unit, number)
+
+        for future in futures:
+            yield future.result()
+
+
+def print_output_preview(output: str, label: str, max_lines: int = PREVIEW_LINES) -> None:
     """Print a preview of output with a label prefix."""
     if not output:
         return
@@ -233,11 +942,542 @@ def print_output_preview(output: str, label: str, max_lines: int = 5) -> None:
         print(f"       {label}: {line}")
 
 
+def block_record(block: CodeBlock, status: str, stats: ProcessStats | None = None,
+                 message: str = '') -> TimingRecord:
+    """Timing record of a code block."""
+    return TimingRecord(
+        kind='block',
+        group=relative_path(block.file_path),
+        name=f"{block.line_number} ({block.language})",
+        key=block_key(block.file_path, block.language, block.code),
+        status=status,
+        stats=stats,
+        message=message,
+    )
+
+
+def result_record(result: TestResult) -> TimingRecord:
+    """Timing record of a code block that was due to run."""
+    if not result.ran:
+        return block_record(result.block, 'not run', message=result.error)
+    if result.cached:
+        return block_record(result.block, 'cached')
+    if result.success:
+        return block_record(result.block, 'pass', result.stats)
+    return block_record(result.block, 'fail', result.stats, result.error)
+
+
+def fixture_record(build: FixtureBuild) -> TimingRecord:
+    """Timing record of a fixture built or linked from the cache."""
+    if build.cached:
+        status = 'cached'
+    else:
+        status = 'pass' if build.stats is not None else 'fail'
+    return TimingRecord(
+        kind='fixture',
+        group='fixtures',
+        name=build.stem,
+        key=f"fixture:{build.stem}#{fixture_key(build.json_config)[:12]}",
+        status=status,
+        stats=build.stats,
+    )
+
+
+def print_result(result: TestResult, verbose: bool) -> None:
+    """Print the outcome of a block that was due to run."""
+    block = result.block
+    if not result.ran:
+        print(f"  NOT RUN {block} ({result.error.removeprefix('not run: ')})")
+        return
+
+    status = "PASS" if result.success else "FAIL"
+    cached = " (cached)" if result.cached else ""
+    remote = ""
+    if result.remote is not None:
+        traffic = result.remote
+        remote = (f" (remote: {traffic.requests} request(s), {traffic.bytes_served:,} bytes, "
+                  f"{traffic.fraction:.1%} of the BAM)")
+    budget = ""
+    if result.budget is not None:
+        budget = f" (budget: {usage_summary(result.budget, result.stats, result.output_bytes)})"
+    print(f"  {status} {block}{cached}{remote}{budget}")
+
+    if verbose or not result.success:
+        print_output_preview(result.output, "stdout")
+        print_output_preview(result.error, "stderr")
+
+
+class ResultStream:
+    """Per-block results written out as JSON lines as soon as they are known.
+
+    Nothing is written if path is None.
+    """
+
+    def __init__(self, path: Path | None):
+        self.file = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.file = open(path, 'w')
+
+    def write(self, record: TimingRecord, result: TestResult | None = None) -> None:
+        """Write the record of a block, with its kept output if it was due to run."""
+        if self.file is None:
+            return
+        line = {**asdict(record), 'label': record.label}
+        if result is not None:
+            line.update({
+                'stdout': result.output,
+                'stdout_bytes': result.output_bytes,
+                'stdout_sha256': result.output_sha256,
+                'stdout_truncated': result.truncated,
+                'stderr': result.error,
+            })
+            if result.remote is not None:
+                line.update({
+                    'remote_requests': result.remote.requests,
+                    'remote_bytes': result.remote.bytes_served,
+                    'remote_file_bytes': result.remote.file_size,
+                })
+            if result.budget is not None:
+                line['budget'] = asdict(result.budget)
+        self.file.write(json.dumps(line) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+@dataclass
+class RunTally:
+    """Counts of block outcomes, kept instead of every result."""
+    passed: int = 0
+    cached: int = 0
+    failed: int = 0
+    not_run: int = 0
+    not_run_reasons: set[str] = field(default_factory=set)
+    # Each failed block and the start of its error
+    failures: list[tuple[CodeBlock, str]] = field(default_factory=list)
+
+    def add(self, result: TestResult) -> None:
+        if not result.ran:
+            self.not_run += 1
+            self.not_run_reasons.add(result.error.removeprefix('not run: '))
+        elif result.success:
+            self.passed += 1
+            self.cached += result.cached
+        else:
+            self.failed += 1
+            self.failures.append((result.block, result.error[:200]))
+
+
+def command_result(result: TestResult) -> CommandResult:
+    """The result of a block in the form that fills a marker section."""
+    return CommandResult(result.success, result.output, result.error, result.truncated)
+
+
+def update_page_outputs(md_file: Path, owners: dict[int, CodeBlock],
+                        file_results: dict[int, CommandResult],
+                        expected: str | None = None) -> tuple[int, bool]:
+    """Fill a page's AUTO-GENERATED sections from the results of its blocks.
+
+    owners maps marker positions to blocks as find_marker_owners does, and
+    file_results maps id(block) to results. If expected is given, only
+    the sections whose block has a result are filled, and nothing is
+    written unless the page still reads expected, i.e. it has not been
+    edited since its blocks were parsed. Returns the number of sections
+    replaced and whether any failed.
+    """
+    errors: list[str] = []
+    content = md_file.read_text()
+    if expected is not None and content != expected:
+        print(f"  {md_file} changed again; not updating its sections")
+        return 0, False
+
+    new_content, num_replacements = fill_marker_sections(
+        content,
+        index_markdown(content),
+        lambda marker: file_results.get(id(owners.get(marker.start))),
+        errors,
+        skip_missing=expected is not None
+    )
+    for error in errors:
+        print(f"  ERROR: {error}", file=sys.stderr)
+
+    if new_content != content:
+        md_file.write_text(new_content)
+    if num_replacements > 0:
+        print(f"  Updated {num_replacements} section(s) in {md_file}")
+    return num_replacements, bool(errors)
+
+
+def page_mtimes(paths: list[Path]) -> dict[Path, int]:
+    """Modification times of the pages that exist."""
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            pass
+    return mtimes
+
+
+def rerun_page(md_file: Path, args: argparse.Namespace, ctx: RunContext, cycle: int,
+               snapshots: dict[Path, list[CodeBlock]], stream: ResultStream) -> None:
+    """Run the blocks of an edited page that changed, and those linked to them.
+
+    Blocks are compared with the page's snapshot, which is then updated.
+    Besides the changed blocks, the blocks that depend on them run, and so
+    do the blocks those read files from, which are usually cache hits.
+    """
+    content = md_file.read_text()
+    index = index_markdown(content)
+    blocks = parse_code_blocks(content, str(md_file), index)
+    changed = flag_changed_blocks(snapshots.get(md_file, []), blocks)
+    snapshots[md_file] = blocks
+
+    owners: dict[int, CodeBlock] = {}
+    if args.generate_outputs:
+        blocks, owners = rewrite_marker_owners(index, blocks)
+
+    runnable = [(b, c) for b, c in zip(blocks, changed) if not should_skip_block(b)[0]]
+    if not any(c for _, c in runnable):
+        return
+
+    graph = build_graph([(b.language, b.code) for b, _ in runnable], OUTPUT_FILES)
+    flags = [c for _, c in runnable]
+    selected = affected_blocks(graph, flags)
+    if any(runnable[i][0].python_session for i in selected):
+        # A session only runs as a whole
+        flags = [c or b.python_session for b, c in runnable]
+        selected = affected_blocks(graph, flags)
+    to_run = [runnable[i][0] for i in selected]
+
+    print(f"{md_file} changed: running {len(to_run)} block(s)...")
+
+    missing = needed_placeholders(to_run) - ctx.test_files.keys()
+    if missing:
+        try:
+            created = create_test_data(ctx.work_dir, placeholders=missing)
+        except RuntimeError as e:
+            print(f"  ERROR: {e}", file=sys.stderr)
+            return
+        ctx.test_files.update(created)
+        ctx.fixture_digests.update(fixture_digests(created))
+
+    # Fresh scratch space, as the directories of earlier runs are still there
+    cycle_dir = ctx.work_dir / 'watch' / str(cycle)
+    cycle_dir.mkdir(parents=True)
+    cycle_ctx = replace(ctx, work_dir=cycle_dir,
+                        control=RunControl(max_failures=args.max_failures))
+
+    file_results: dict[int, CommandResult] = {}
+    for result in run_tests(to_run, cycle_ctx, jobs=args.jobs, graph=graph.reordered(selected)):
+        print_result(result, args.verbose)
+        stream.write(result_record(result), result)
+        file_results[id(result.block)] = command_result(result)
+
+    if args.generate_outputs:
+        update_page_outputs(md_file, owners, file_results, expected=content)
+    print()
+
+
+def watch_pages(args: argparse.Namespace, ctx: RunContext,
+                snapshots: dict[Path, list[CodeBlock]], stream: ResultStream) -> None:
+    """Re-run blocks as pages are edited, until interrupted.
+
+    Pages are polled for changes every WATCH_INTERVAL_SECONDS. Without
+    explicit files, pages added to src/ are picked up too. snapshots holds
+    the blocks of each page as last run.
+    """
+    ignored: dict[Path, bool] = {}
+
+    def watched() -> list[Path]:
+        if args.files:
+            return [Path(f) for f in args.files]
+        pages = []
+        for page in (REPO_ROOT / 'src').rglob('*.md'):
+            if page not in ignored:
+                ignored[page] = is_gitignored(page)
+            if not ignored[page]:
+                pages.append(page)
+        return pages
+
+    mtimes = page_mtimes(watched())
+    # Pages left out of the first run only count edits from now on
+    for page in mtimes:
+        if page not in snapshots:
+            snapshots[page] = parse_code_blocks(page.read_text(), str(page))
+    print(f"Watching {len(mtimes)} markdown file(s) for changes (Ctrl-C to stop)...\n")
+    cycle = 0
+    try:
+        while True:
+            time.sleep(WATCH_INTERVAL_SECONDS)
+            current = page_mtimes(watched())
+            edited = [page for page, mtime in current.items() if mtimes.get(page) != mtime]
+            mtimes = current
+            for md_file in edited:
+                cycle += 1
+                rerun_page(md_file, args, ctx, cycle, snapshots, stream)
+                # Filling in sections rewrites the page; that is not an edit
+                mtimes.update(page_mtimes([md_file]))
+    except KeyboardInterrupt:
+        print("\nStopped watching")
+
+
+def split_pages(plan: list[tuple[Path, list[tuple[CodeBlock, str | None]]]],
+                runnable: list[CodeBlock], count: int,
+                history: dict[str, list[float]]) -> ShardPlan:
+    """Split the pages of a run into count shards (see shard_plan.py).
+
+    Pages are weighted by the blocks of theirs that would run, and kept
+    together with the pages they share files with.
+    """
+    graph = build_graph([(b.language, b.code) for b in runnable], OUTPUT_FILES)
+    return plan_shards(
+        pages=[relative_path(md_file) for md_file, _ in plan],
+        block_pages=[relative_path(b.file_path) for b in runnable],
+        block_keys=[block_key(b.file_path, b.language, b.code) for b in runnable],
+        graph=graph,
+        history=history,
+        count=count,
+    )
+
+
+def run_scaling(blocks: list[CodeBlock], scales: list[float], args: argparse.Namespace,
+                work_dir: Path, python_pool: WarmPythonPool | None) -> int:
+    """Run blocks against fixtures of each scale and flag those that scale badly.
+
+    See scaling.py. Only the blocks whose run time can depend on the
+    fixtures are reported: those using a placeholder, those reading files
+    written by such blocks, and later blocks of their python session. Remote
+    blocks are left out, as their time depends on the local server. Nothing
+    is cached and no page is changed. Returns 1 if any block was flagged.
+    """
+    blocks = [b for b in blocks if not is_remote_block(b.code)]
+    needed = needed_placeholders(blocks)
+    graph = build_graph([(b.language, b.code) for b in blocks], OUTPUT_FILES)
+
+    uses_data = []
+    session_data: set[str] = set()
+    for block, depends_on in zip(blocks, graph.depends_on):
+        data = (uses_placeholder(block.code, set(PLACEHOLDERS))
+                or any(uses_data[i] for i in depends_on)
+                or (block.python_session and block.file_path in session_data))
+        if data and block.python_session:
+            session_data.add(block.file_path)
+        uses_data.append(data)
+
+    results = {id(b): ScalingResult(str(b)) for b, data in zip(blocks, uses_data) if data}
+    for scale in scales:
+        scale_dir = work_dir / f'scale_{scale:g}'
+        scale_dir.mkdir()
+        print(f"Running {len(blocks)} block(s) at {scale:g}x the fixture read counts...")
+        test_files = create_test_data(scale_dir, placeholders=needed, scale=scale) if needed else {}
+        ctx = RunContext(test_files, scale_dir, python_pool=python_pool,
+                         fixture_digests=fixture_digests(test_files),
+                         memory_limit_mb=args.memory_limit)
+        failed = 0
+        for result in run_tests(blocks, ctx, jobs=args.jobs, graph=graph):
+            failed += not result.success
+            entry = results.get(id(result.block))
+            if entry is None:
+                continue
+            if result.success and result.stats is not None:
+                entry.seconds.append(result.stats.wall_seconds)
+                entry.errors.append('')
+            else:
+                lines = result.error.strip().splitlines() or ['failed']
+                entry.seconds.append(None)
+                entry.errors.append(lines[-1][:100])
+        print(f"  {len(blocks) - failed} passed, {failed} failed")
+
+    for entry in results.values():
+        entry.exponent = fit_exponent(scales, entry.seconds)
+    flagged = print_scaling(list(results.values()), scales)
+    return 1 if flagged else 0
+
+
+def merge_shard_reports(args: argparse.Namespace) -> int:
+    """Combine the partial reports of a sharded run into one summary.
+
+    Returns 1 if any shard failed, is missing or disagrees with the others.
+    The merged records go to --json-report, --junit-xml and the history,
+    as those of an unsharded run would.
+    """
+    records: list[TimingRecord] = []
+    infos = []
+    counts = dict.fromkeys(('passed', 'cached', 'failed', 'skipped', 'not_run'), 0)
+    shard_counts = []
+    for path in args.merge_reports:
+        try:
+            shard_records, report = read_json_report(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Error: cannot read report {path}: {e}", file=sys.stderr)
+            return 1
+        if 'shard' not in report:
+            print(f"Error: {path} is not the report of a shard (see --shard)", file=sys.stderr)
+            return 1
+        infos.append(report['shard'])
+        shard_counts.append(report['summary'])
+        records.extend(shard_records)
+        for name in counts:
+            counts[name] += report['summary'].get(name, 0)
+
+    print(f"Merging {len(infos)} shard report(s):")
+    for info, shard in sorted(zip(infos, shard_counts), key=lambda pair: pair[0]['index']):
+        estimate = info['estimated_seconds']
+        estimated = f" (estimated {estimate:.1f}s)" if estimate is not None else ""
+        print(f"  shard {info['index']}/{info['count']}: {shard['passed']} passed "
+              f"({shard['cached']} cached), {shard['failed']} failed, "
+              f"{shard['skipped']} skipped in {info['wall_seconds']:.1f}s{estimated}")
+    walls = [info['wall_seconds'] for info in infos]
+    if len(walls) > 1:
+        print(f"  slowest shard took {max(walls):.1f}s, "
+              f"{max(walls) / max(sum(walls) / len(walls), 1e-9):.2f}x the mean")
+
+    problems = check_shard_reports(infos)
+
+    regressions = find_regressions(records, load_history(args.history))
+    append_history(args.history, records)
+    if args.json_report is not None:
+        write_json_report(args.json_report, records, counts, shards=infos)
+    if args.junit_xml is not None:
+        write_junit_report(args.junit_xml, records)
+    if args.slowest > 0:
+        print_slowest(records, args.slowest)
+    print_regressions(regressions)
+    print()
+
+    print("=" * 60)
+    summary = (f"Results: {counts['passed']} passed ({counts['cached']} cached), "
+               f"{counts['failed']} failed, {counts['skipped']} skipped")
+    if counts['not_run']:
+        summary += f", {counts['not_run']} not run"
+    print(summary)
+    print("=" * 60)
+
+    failures = [record for record in records if record.status == 'fail']
+    if failures:
+        print("\nFailed tests:")
+        for record in failures:
+            print(f"  - {record.label}")
+            if record.message:
+                print(f"    Error: {record.message[:200]}")
+    if problems:
+        print("\nShard problems:")
+        for problem in problems:
+            print(f"  - {problem}")
+
+    failed = problems or failures or any(info['exit_status'] for info in infos)
+    return 1 if failed else 0
+
+
 def main():
     parser = argparse.ArgumentParser(description='Test code blocks in markdown files')
     parser.add_argument('files', nargs='*', help='Markdown files to test')
     parser.add_argument('-v', '--verbose', action='store_true', help='Show output from tests')
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar='N',
+                        help='Run blocks on N parallel workers, each in its own scratch directory')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Re-run every block instead of reusing cached passes')
+    parser.add_argument('--generate-outputs', action='store_true',
+                        help='Also fill AUTO-GENERATED sections from the results of this run')
+    parser.add_argument('--warm-python', action='store_true',
+                        help='Fork python blocks from pre-imported interpreters')
+    parser.add_argument('--changed-since', metavar='REF',
+                        help='Only test pages changed since the git ref REF, or whose '
+                             'test data changed in scripts/test_data.py')
+    parser.add_argument('--time-budget', type=float, metavar='SECONDS',
+                        help='Run changed blocks first and start no new blocks after SECONDS')
+    parser.add_argument('--json-report', type=Path, metavar='PATH',
+                        help='Write per-block and per-fixture timings to PATH as JSON')
+    parser.add_argument('--junit-xml', type=Path, metavar='PATH',
+                        help='Write results and timings to PATH as JUnit XML')
+    parser.add_argument('--slowest', type=int, default=10, metavar='N',
+                        help='Show the N slowest blocks and fixture builds (default: 10, 0 to hide)')
+    parser.add_argument('--history', type=Path, default=HISTORY_PATH, metavar='PATH',
+                        help='Timing history file used to spot slowdowns '
+                             f'(default: {relative_path(HISTORY_PATH)})')
+    parser.add_argument('--max-failures', type=int, metavar='N',
+                        help='Stop after N failed blocks, killing the blocks still running')
+    parser.add_argument('--fail-fast', dest='max_failures', action='store_const', const=1,
+                        help='Stop at the first failed block (same as --max-failures 1)')
+    parser.add_argument('--results-jsonl', type=Path, metavar='PATH',
+                        help='Stream each block\'s result and kept output to PATH as JSON lines')
+    parser.add_argument('--watch', action='store_true',
+                        help='After the run, keep re-running the blocks of pages as they '
+                             'are edited, until interrupted')
+    parser.add_argument('--remote-delay', type=float, default=0.0, metavar='SECONDS',
+                        help='Delay every request to the local server behind remote BAM '
+                             'examples by SECONDS (default: 0)')
+    parser.add_argument('--remote-bandwidth', type=float, metavar='KIB_PER_S',
+                        help='Cap each response of that server at KIB_PER_S KiB/s '
+                             '(default: unlimited)')
+    parser.add_argument('--memory-limit', type=float, metavar='MB',
+                        help='Cap the address space of every block at MB megabytes, as on '
+                             'a small cluster node')
+    parser.add_argument('--shard', metavar='I/N',
+                        help='Run only shard I of N, split by page and balanced on the timing '
+                             'history, and write a partial report')
+    parser.add_argument('--merge-reports', nargs='+', type=Path, metavar='REPORT',
+                        help='Combine the partial reports of every shard into one summary '
+                             'instead of running anything')
+    parser.add_argument('--build-fixtures', action='store_true',
+                        help='Only simulate the fixtures the pages need into the fixture '
+                             'cache, to be shared by the shards of a run')
+    parser.add_argument('--profile', nargs='?', type=Path, const=PROFILE_DIR, metavar='DIR',
+                        help='Run python blocks under cProfile and tracemalloc, saving a '
+                             'profile and allocation summary of each to DIR (default: '
+                             '.cache/profiles) and a merged profile of all of them')
+    parser.add_argument('--scaling', nargs='?', const=','.join(f'{s:g}' for s in DEFAULT_SCALES),
+                        metavar='F,F,...',
+                        help='Run the blocks against fixtures with F times their read counts '
+                             '(default 1,10,100) and flag blocks whose run time grows '
+                             'faster than linearly')
     args = parser.parse_args()
+    start_time = time.monotonic()
+
+    if args.jobs < 1:
+        parser.error('--jobs must be at least 1')
+    if args.max_failures is not None and args.max_failures < 1:
+        parser.error('--max-failures must be at least 1')
+    if args.changed_since is not None and not is_valid_ref(args.changed_since):
+        parser.error(f'--changed-since: unknown git ref {args.changed_since!r}')
+    if args.remote_delay < 0:
+        parser.error('--remote-delay must not be negative')
+    if args.remote_bandwidth is not None and args.remote_bandwidth <= 0:
+        parser.error('--remote-bandwidth must be positive')
+    if args.memory_limit is not None and args.memory_limit <= 0:
+        parser.error('--memory-limit must be positive')
+    if args.shard is not None:
+        try:
+            args.shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(f'--shard: {e}')
+        if args.watch:
+            parser.error('--shard cannot be combined with --watch')
+    if args.scaling is not None:
+        try:
+            args.scaling = parse_scales(args.scaling)
+        except ValueError as e:
+            parser.error(f'--scaling: {e}')
+        if args.watch or args.generate_outputs:
+            parser.error('--scaling cannot be combined with --watch or --generate-outputs')
+    if args.profile is not None:
+        if args.watch or args.scaling is not None:
+            parser.error('--profile cannot be combined with --watch or --scaling')
+        # Blocks run in scratch directories, so they need an absolute path
+        args.profile = args.profile.resolve()
+
+    if args.merge_reports:
+        return merge_shard_reports(args)
 
     # Find markdown files
     if args.files:
@@ -256,69 +1496,282 @@ def main():
             print(f"  - {f}")
         print()
 
+    placeholders: set[str] = set()
+    if args.changed_since is not None:
+        changed_files = changed_markdown_files(args.changed_since)
+        placeholders = changed_placeholders(args.changed_since)
+        md_files = [f for f in md_files
+                    if f.resolve() in changed_files or uses_placeholder(f.read_text(), placeholders)]
+        if placeholders:
+            print(f"Test data changed since {args.changed_since} for: {', '.join(sorted(placeholders))}")
+        if not md_files:
+            print(f"No markdown files changed since {args.changed_since}")
+            return 0
+        print(f"Selected {len(md_files)} file(s) changed since {args.changed_since}\n")
+
     if not md_files:
         print("No markdown files found")
         return 1
 
     # Create outputs directory for any files generated by test commands
     OUTPUTS_DIR.mkdir(exist_ok=True)
+    if args.profile is not None:
+        args.profile.mkdir(parents=True, exist_ok=True)
 
     print(f"Testing {len(md_files)} markdown file(s)...\n")
 
     # Create temp directory and test data
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory() as tmpdir, contextlib.ExitStack() as stack:
         work_dir = Path(tmpdir)
-
-        print("Creating test data...")
-        test_files = create_test_data(work_dir)
-        print(f"  Created test BAM: {test_files['input.bam']}\n")
-
-        results: list[TestResult] = []
+        stream = stack.enter_context(ResultStream(args.results_jsonl))
+
+        # Extract every block up front so that a worker pool can start on
+        # all of them while results are reported in document order
+        plan: list[tuple[Path, list[tuple[CodeBlock, str | None]]]] = []
+        marker_owners: dict[Path, dict[int, CodeBlock]] = {}
+        # Blocks of each page as parsed, which --watch compares edits with
+        snapshots: dict[Path, list[CodeBlock]] = {}
+        runnable: list[CodeBlock] = []
+        changed_ids: set[int] = set()
         skipped = 0
+        # Pages with benchmark sections, filled in after the run
+        bench_pages: list[Path] = []
 
         for md_file in md_files:
-            print(f"Processing {md_file}...")
-            blocks = extract_code_blocks(str(md_file))
-
-            for block in blocks:
+            content = md_file.read_text()
+            index = index_markdown(content)
+            blocks = parse_code_blocks(content, str(md_file), index)
+            snapshots[md_file] = blocks
+            if args.changed_since is not None:
+                changed = find_changed_blocks(md_file, blocks, args.changed_since, placeholders)
+            else:
+                changed = [False] * len(blocks)
+
+            if args.generate_outputs:
+                # Blocks that feed a marker run in their output-producing
+                # form, and that one result serves both purposes
+                blocks, marker_owners[md_file] = rewrite_marker_owners(index, blocks)
+                if any(marker_config(m) is not None and marker_config(m).bench
+                       for m in index.markers):
+                    bench_pages.append(md_file)
+
+            entries = []
+            for block, block_changed in zip(blocks, changed):
                 skip, reason = should_skip_block(block)
                 if skip:
-                    if args.verbose:
-                        print(f"  SKIP {block}: {reason}")
+                    entries.append((block, reason))
                     skipped += 1
+                else:
+                    entries.append((block, None))
+                    runnable.append(block)
+                    if block_changed:
+                        changed_ids.add(id(block))
+            plan.append((md_file, entries))
+
+        split = None
+        if args.shard is not None:
+            index, count = args.shard
+            split = split_pages(plan, runnable, count, load_history(args.history))
+            pages = set(split.shards[index - 1])
+            plan = [(md_file, entries) for md_file, entries in plan
+                    if relative_path(md_file) in pages]
+            runnable = [b for b in runnable if relative_path(b.file_path) in pages]
+            bench_pages = [md_file for md_file in bench_pages if relative_path(md_file) in pages]
+            skipped = sum(reason is not None for _, entries in plan for _, reason in entries)
+            if split.by_history:
+                basis = f"estimated {split.estimates[index - 1]:.1f}s from the timing history"
+            else:
+                basis = "balanced by block count, no timing history"
+            print(f"Shard {index}/{count}: {len(plan)} page(s), {len(runnable)} block(s), "
+                  f"{basis}\n")
+
+        if args.scaling is not None:
+            python_pool = None
+            if args.warm_python and any(b.language == 'python' for b in runnable):
+                python_pool = stack.enter_context(WarmPythonPool(args.jobs))
+            return run_scaling(runnable, args.scaling, args, work_dir, python_pool)
+
+        # Only simulate the fixtures that the blocks about to run refer to
+        needed = needed_placeholders(runnable)
+        builds: list[FixtureBuild] = []
+        if needed:
+            print("Creating test data...")
+            test_files = create_test_data(work_dir, placeholders=needed, builds=builds)
+            print(f"  Created test data for: {', '.join(sorted(test_files))}\n")
+        else:
+            test_files = {}
+        records = [fixture_record(build) for build in builds]
+
+        if args.build_fixtures:
+            return 0
+
+        salt = tool_fingerprint()
+        if args.memory_limit is not None:
+            # A block that passes with plenty of memory may not under a limit
+            salt += f'\0memory-limit={args.memory_limit:g}'
+        cache = ResultCache(CACHE_DIR, salt, read=not args.no_cache)
+
+        deadline = None
+        # Blocks that read files written by earlier blocks wait for them
+        graph = build_graph([(b.language, b.code) for b in runnable], OUTPUT_FILES)
+        if args.time_budget is not None:
+            deadline = start_time + args.time_budget
+            # Changed blocks first, so they are the ones that fit in the
+            # budget, but never ahead of the blocks they depend on
+            preferred = sorted(range(len(runnable)), key=lambda i: id(runnable[i]) not in changed_ids)
+            order = dependency_order(graph, preferred)
+            runnable = [runnable[i] for i in order]
+            graph = graph.reordered(order)
+
+        python_pool = None
+        # A watch session keeps a warm runner for python blocks added later
+        if args.watch or (args.warm_python and any(b.language == 'python' for b in runnable)):
+            python_pool = stack.enter_context(WarmPythonPool(args.jobs))
+
+        remote = None
+        # The server looks fixtures up in test_files, which --watch extends
+        if args.watch or any(is_remote_block(b.code) for b in runnable):
+            bandwidth = args.remote_bandwidth * 1024 if args.remote_bandwidth else None
+            remote = stack.enter_context(RangeServer(test_files, args.remote_delay, bandwidth))
+
+        control = RunControl(deadline=deadline, max_failures=args.max_failures)
+        ctx = RunContext(test_files, work_dir, cache=cache, python_pool=python_pool,
+                         control=control, fixture_digests=fixture_digests(test_files),
+                         remote=remote, memory_limit_mb=args.memory_limit,
+                         profile_dir=args.profile)
+        pending = run_tests(runnable, ctx, jobs=args.jobs, graph=graph)
+        finished: dict[int, TestResult] = {}
+
+        def result_for(block: CodeBlock) -> TestResult:
+            """Wait for a block's result; blocks may finish in a different order."""
+            while id(block) not in finished:
+                result = next(pending)
+                finished[id(result.block)] = result
+            return finished.pop(id(block))
+
+        # Results are counted and streamed out as they arrive, not kept
+        tally = RunTally()
+        profiles: list[BlockProfile] = []
+        total_replacements = 0
+        generate_failed = False
+
+        for md_file, entries in plan:
+            print(f"Processing {md_file}...")
+            # Only the results of the blocks that feed a marker are kept
+            owner_ids = {id(b) for b in marker_owners.get(md_file, {}).values()}
+            file_results: dict[int, CommandResult] = {}
+
+            for block, skip_reason in entries:
+                if skip_reason is not None:
+                    file_results[id(block)] = CommandResult(False, "", f"block {block} is skipped: {skip_reason}")
+                    record = block_record(block, 'skipped', message=skip_reason)
+                    records.append(record)
+                    stream.write(record)
+                    if args.verbose:
+                        print(f"  SKIP {block}: {skip_reason}")
                     continue
 
-                result = run_test(block, test_files, work_dir)
-                results.append(result)
-
-                status = "PASS" if result.success else "FAIL"
-                print(f"  {status} {block}")
-
-                if args.verbose or not result.success:
-                    print_output_preview(result.output, "stdout")
-                    print_output_preview(result.error, "stderr")
+                result = result_for(block)
+                tally.add(result)
+                if result.profile is not None:
+                    profiles.append(result.profile)
+                record = result_record(result)
+                records.append(record)
+                stream.write(record, result)
+                if id(block) in owner_ids:
+                    file_results[id(block)] = command_result(result)
+                print_result(result, args.verbose)
+
+            if args.generate_outputs:
+                num_replacements, errors = update_page_outputs(
+                    md_file, marker_owners[md_file], file_results
+                )
+                generate_failed |= errors
+                total_replacements += num_replacements
 
             print()
 
-    # Summary
-    passed = sum(r.success for r in results)
-    failed = len(results) - passed
-
-    print("=" * 60)
-    print(f"Results: {passed} passed, {failed} failed, {skipped} skipped")
-    print("=" * 60)
+        if bench_pages and control.stop_reason() is None:
+            print("Running benchmarks...")
+            for md_file in bench_pages:
+                success, num_replacements = process_markdown_file(
+                    md_file, test_files, work_dir, bench_only=True
+                )
+                if num_replacements > 0:
+                    print(f"  Updated {num_replacements} benchmark section(s) in {md_file}")
+                generate_failed |= not success
+                total_replacements += num_replacements
+            print()
 
-    if failed > 0:
-        print("\nFailed tests:")
-        for r in results:
-            if not r.success:
-                print(f"  - {r.block}")
-                if r.error:
-                    print(f"    Error: {r.error[:200]}")
-        return 1
+        # Summary
+        exit_status = 1 if tally.failed > 0 or generate_failed else 0
+        regressions = find_regressions(records, load_history(args.history))
+        # Shards leave the history they were split by alone; merging their
+        # reports records the timings of the whole run
+        if split is None:
+            append_history(args.history, records)
+        counts = {'passed': tally.passed, 'cached': tally.cached, 'failed': tally.failed,
+                  'skipped': skipped, 'not_run': tally.not_run}
+        sections = {}
+        profile_stats = None
+        if args.profile is not None:
+            merged_profile = args.profile / 'merged.pstats'
+            profile_stats = merge_profiles(profiles, merged_profile)
+            if profile_stats is not None:
+                sections['profile'] = {'merged': str(merged_profile),
+                                       'package_seconds': package_seconds(profile_stats),
+                                       'hot_functions': hot_functions(profile_stats)}
+        if split is not None:
+            # Every shard writes a partial report for --merge-reports
+            index, count = args.shard
+            report_path = args.json_report or Path(f'shard-{index}-of-{count}.json')
+            write_json_report(report_path, records, counts, **sections, shard={
+                'index': index,
+                'count': count,
+                'plan': split.digest,
+                'pages': split.shards[index - 1],
+                'estimated_seconds': split.estimates[index - 1] if split.by_history else None,
+                'wall_seconds': time.monotonic() - start_time,
+                'exit_status': exit_status,
+                'fixtures': ctx.fixture_digests,
+            })
+            print(f"\nWrote the report of shard {index}/{count} to {report_path}")
+        elif args.json_report is not None:
+            write_json_report(args.json_report, records, counts, **sections)
+        if args.junit_xml is not None:
+            write_junit_report(args.junit_xml, records)
+        if args.slowest > 0:
+            print_slowest(records, args.slowest)
+        print_regressions(regressions)
+        if profile_stats is not None:
+            print_profile(profile_stats, HOT_FUNCTIONS, merged_profile)
+        elif args.profile is not None:
+            print("\nNo python block was profiled")
+        print()
 
-    return 0
+        print("=" * 60)
+        summary = (f"Results: {tally.passed} passed ({tally.cached} cached), "
+                   f"{tally.failed} failed, {skipped} skipped")
+        if tally.not_run:
+            summary += f", {tally.not_run} not run ({'; '.join(sorted(tally.not_run_reasons))})"
+        print(summary)
+        if args.generate_outputs:
+            print(f"Updated {total_replacements} auto-generated section(s)")
+        print("=" * 60)
+
+        if tally.failed > 0:
+            print("\nFailed tests:")
+            for block, error in tally.failures:
+                print(f"  - {block}")
+                if error:
+                    print(f"    Error: {error}")
+
+        if args.watch:
+            print()
+            watch_pages(args, ctx, snapshots, stream)
+            return 0
 
+    return exit_status
 
 if __name__ == '__main__':
     sys.exit(main())
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Timing reports for code block runs.
+
+Every block that runs and every fixture that is built is recorded with its
+wall time, user and system CPU time and exit status. A run can be written
+out as a JSON report and as JUnit XML, and is appended to a local history
+file. Each block's time is compared with its rolling median over earlier
+runs so that examples which are getting slower stand out.
+"""
+
+import hashlib
+import json
+import resource
+import statistics
+import time
+import xml.etree.ElementTree as ET
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).parent.parent.resolve()
+HISTORY_PATH = REPO_ROOT / ".cache" / "timing_history.jsonl"
+# Number of earlier timings of a block that make up its rolling median
+HISTORY_WINDOW = 10
+# A median needs at least this many earlier timings to be trusted
+MIN_HISTORY = 3
+# A block has regressed if it took this many times its median, and at
+# least REGRESSION_MIN_SECONDS longer, so that noise on fast blocks is ignored
+REGRESSION_FACTOR = 2.0
+REGRESSION_MIN_SECONDS = 0.5
+
+
+@dataclass
+class ProcessStats:
+    """Resources used by one unit of work."""
+    wall_seconds: float
+    user_seconds: float
+    sys_seconds: float
+    # None if the work could not be started
+    exit_status: int | None
+    timed_out: bool = False
+    # Peak resident set size, where it was measured
+    max_rss_mb: float | None = None
+
+
+def stats_since(start_wall: float, start_usage: resource.struct_rusage,
+                exit_status: int | None) -> ProcessStats:
+    """Stats for work done in this process since time.monotonic() and
+    getrusage(RUSAGE_SELF) returned start_wall and start_usage."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return ProcessStats(
+        wall_seconds=time.monotonic() - start_wall,
+        user_seconds=usage.ru_utime - start_usage.ru_utime,
+        sys_seconds=usage.ru_stime - start_usage.ru_stime,
+        exit_status=exit_status,
+    )
+
+
+@dataclass
+class TimingRecord:
+    """One timed unit of work in a run: a code block or a fixture build."""
+    # 'block' or 'fixture'
+    kind: str
+    # Markdown file of a block, or 'fixtures'
+    group: str
+    # e.g. '12 (bash)' for a block or the file stem of a fixture
+    name: str
+    # Identity of the work across runs, used to look up its history
+    key: str
+    # 'pass', 'fail', 'cached', 'skipped' or 'not run'
+    status: str
+    stats: ProcessStats | None = None
+    message: str = ''
+
+    @property
+    def label(self) -> str:
+        return f"{self.group}:{self.name}"
+
+    @property
+    def timed(self) -> bool:
+        """Whether the work really ran, so its time says something about it."""
+        return self.status in ('pass', 'fail') and self.stats is not None
+
+
+def relative_path(path: str | Path) -> str:
+    """Path relative to the repository root when it is inside it."""
+    resolved = Path(path).resolve()
+    try:
+        return resolved.relative_to(REPO_ROOT).as_posix()
+    except ValueError:
+        return str(resolved)
+
+
+def block_key(file_path: str, language: str, code: str) -> str:
+    """Identify a block by its page and code, so moving it keeps its history."""
+    digest = hashlib.sha256(f'{language}\0{code}'.encode()).hexdigest()
+    return f"{relative_path(file_path)}#{digest[:12]}"
+
+
+def write_json_report(path: Path, records: list[TimingRecord], summary: dict,
+                      **sections) -> None:
+    """Write the records of a run and its summary counts as JSON.
+
+    Any further sections, e.g. shard=..., are added to the report as they are.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        'summary': summary,
+        **sections,
+        'records': [{**asdict(record), 'label': record.label} for record in records],
+    }
+    path.write_text(json.dumps(report, indent=2) + '\n')
+
+
+def read_json_report(path: Path) -> tuple[list[TimingRecord], dict]:
+    """Read a report written by write_json_report; return its records and the whole report."""
+    report = json.loads(path.read_text())
+    records = []
+    for data in report['records']:
+        data = {key: value for key, value in data.items() if key != 'label'}
+        stats = data.pop('stats')
+        records.append(TimingRecord(**data, stats=ProcessStats(**stats) if stats else None))
+    return records, report
+
+
+def write_junit_report(path: Path, records: list[TimingRecord]) -> None:
+    """Write the records of a run as JUnit XML, one test suite per page."""
+    root = ET.Element('testsuites', name='markdown-examples')
+    suites: dict[str, ET.Element] = {}
+
+    for record in records:
+        suite = suites.get(record.group)
+        if suite is None:
+            suite = suites[record.group] = ET.SubElement(root, 'testsuite', name=record.group)
+        wall = record.stats.wall_seconds if record.stats else 0.0
+        case = ET.SubElement(suite, 'testcase', classname=record.group, name=record.name,
+                             time=f"{wall:.3f}")
+        if record.status == 'fail':
+            failure = ET.SubElement(case, 'failure', message=record.message.split('\n')[0][:200])
+            failure.text = record.message
+        elif record.status in ('skipped', 'not run'):
+            ET.SubElement(case, 'skipped', message=record.message)
+        if record.stats is not None:
+            properties = ET.SubElement(case, 'properties')
+            for name in ('user_seconds', 'sys_seconds', 'exit_status'):
+                ET.SubElement(properties, 'property', name=name,
+                              value=str(getattr(record.stats, name)))
+            ET.SubElement(properties, 'property', name='cached',
+                          value=str(record.status == 'cached').lower())
+
+    for suite in suites.values():
+        cases = list(suite)
+        suite.set('tests', str(len(cases)))
+        suite.set('failures', str(sum(c.find('failure') is not None for c in cases)))
+        suite.set('skipped', str(sum(c.find('skipped') is not None for c in cases)))
+        suite.set('time', f"{sum(float(c.get('time')) for c in cases):.3f}")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    ET.ElementTree(root).write(path, encoding='utf-8', xml_declaration=True)
+
+
+def load_history(path: Path) -> dict[str, list[float]]:
+    """Read earlier wall times from the history file, oldest first, by key."""
+    history: dict[str, list[float]] = {}
+    try:
+        lines = path.read_text().splitlines()
+    except OSError:
+        return history
+
+    for line in lines:
+        try:
+            run = json.loads(line)
+        except ValueError:
+            # A run interrupted while appending; ignore its line
+            continue
+        for key, wall in run.get('wall_seconds', {}).items():
+            history.setdefault(key, []).append(wall)
+    return history
+
+
+def append_history(path: Path, records: list[TimingRecord]) -> None:
+    """Append the wall times of the work that really ran to the history file."""
+    timed = {r.key: r.stats.wall_seconds for r in records if r.timed}
+    if not timed:
+        return
+    path.parent.mkdir(parents=True, exist_ok=True)
+    run = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'wall_seconds': timed}
+    with open(path, 'a') as f:
+        f.write(json.dumps(run) + '\n')
+
+
+def find_regressions(records: list[TimingRecord],
+                     history: dict[str, list[float]]) -> list[tuple[TimingRecord, float]]:
+    """Return (record, median) for work much slower than its rolling median."""
+    regressions = []
+    for record in records:
+        earlier = history.get(record.key, [])[-HISTORY_WINDOW:]
+        if not record.timed or len(earlier) < MIN_HISTORY:
+            continue
+        median = statistics.median(earlier)
+        wall = record.stats.wall_seconds
+        if wall > median * REGRESSION_FACTOR and wall - median > REGRESSION_MIN_SECONDS:
+            regressions.append((record, median))
+    return regressions
+
+
+def print_slowest(records: list[TimingRecord], count: int) -> None:
+    """Print a table of the count slowest blocks and fixture builds."""
+    timed = sorted((r for r in records if r.timed),
+                   key=lambda r: r.stats.wall_seconds, reverse=True)[:count]
+    if not timed:
+        return
+    print(f"\nSlowest {len(timed)}:")
+    print(f"  {'wall':>8} {'user':>8} {'sys':>8}  {'exit':>4}  name")
+    for record in timed:
+        stats = record.stats
+        exit_status = '-' if stats.exit_status is None else str(stats.exit_status)
+        print(f"  {stats.wall_seconds:7.2f}s {stats.user_seconds:7.2f}s "
+              f"{stats.sys_seconds:7.2f}s  {exit_status:>4}  {record.label}")
+
+
+def print_regressions(regressions: list[tuple[TimingRecord, float]]) -> None:
+    """Print the work that took much longer than its rolling median."""
+    if not regressions:
+        return
+    print(f"\nSlower than their rolling median over the last {HISTORY_WINDOW} runs:")
+    for record, median in regressions:
+        print(f"  {record.label}: {record.stats.wall_seconds:.2f}s "
+              f"(median {median:.2f}s)")